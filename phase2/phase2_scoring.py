@@ -6,9 +6,24 @@
 # Outputs:
 #   phase2_scored_drugs.csv
 #   phase2_report.txt
+#
+# Importable engine: score_drugs(bbb, moa, ad_genes) scores in-process;
+# running the file writes the outputs (paths are relative to the repo,
+# not the working directory).
 
-import pandas as pd
+import os
 import re
+import argparse
+import numpy as np
+import pandas as pd
+
+PHASE2_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(PHASE2_DIR)
+
+BBB_PATH = os.path.join(PROJECT_ROOT, "phase1", "outputs", "bbb_positive_drugs.csv")
+MOA_PATH = os.path.join(PROJECT_ROOT, "database", "chembl_drug_mechanism_curated.csv")
+AD_GENES_PATH = os.path.join(PROJECT_ROOT, "database", "ad_genes_disgenet.csv")
+OUT_DIR = os.path.join(PHASE2_DIR, "outputs")
 
 def norm_name(x: str) -> str:
     if pd.isna(x):
@@ -19,48 +34,18 @@ def norm_name(x: str) -> str:
     x = re.sub(r"\s+", " ", x).strip()
     return x
 
-print(" Phase 2 v3 scoring started (pathology-focused)")
+def per_value(values: pd.Series, fn) -> np.ndarray:
+    """
+    fn of every value, computed once per distinct value.
+    """
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    return np.array([fn(u) for u in uniques] or [""], dtype=object)[codes]
 
-# --------------------------
-# 1) Load inputs
-# --------------------------
-bbb = pd.read_csv("../phase1/outputs/bbb_positive_drugs.csv")
-moa = pd.read_csv("../database/chembl_drug_mechanism_curated.csv")
-ad  = pd.read_csv("../database/ad_genes_disgenet.csv")
+def norm_names(values: pd.Series) -> pd.Series:
+    return pd.Series(per_value(values, norm_name), index=values.index)
 
 # --------------------------
-# 2) Detect BBB drug column
-# --------------------------
-bbb_name_col = None
-for c in ["compound_name", "drug_name", "name"]:
-    if c in bbb.columns:
-        bbb_name_col = c
-        break
-if bbb_name_col is None:
-    raise SystemExit(f" BBB file missing drug name column. Columns: {bbb.columns.tolist()}")
-
-bbb["drug_norm"] = bbb[bbb_name_col].apply(norm_name)
-
-if "drug_name" not in moa.columns:
-    raise SystemExit(f" chembl_drug_mechanism_curated.csv missing drug_name. Columns: {moa.columns.tolist()}")
-
-moa["drug_norm"] = moa["drug_name"].apply(norm_name)
-
-# Choose best target identifier: gene symbol if present, else target name
-moa["target_gene"] = moa.get("target_gene", "").fillna("").astype(str).str.strip()
-moa["target_name"] = moa.get("target_name", "").fillna("").astype(str).str.strip()
-
-moa["target_best"] = moa["target_gene"]
-mask_empty = moa["target_best"].eq("")
-moa.loc[mask_empty, "target_best"] = moa.loc[mask_empty, "target_name"]
-
-moa["t_upper"] = moa["target_best"].astype(str).str.upper()
-
-# AD gene set (broad)
-ad_genes_upper = set(ad["gene_symbol"].astype(str).str.strip().str.upper().tolist())
-
-# --------------------------
-# 3) Define pathology-focused modules
+# Pathology-focused modules
 # --------------------------
 # Core disease-modifying modules
 AMYLOID  = {"APP","BACE1","PSEN1","PSEN2","ADAM10"}
@@ -76,6 +61,26 @@ MITO_OX= {"NFE2L2","SOD1","SOD2","PPARGC1A","PINK1","PARK7"}
 
 SECONDARY = INFLAM | MITO_OX
 
+# Symptomatic Alzheimer target (keep, but low weight)
+LOW_SYMP = {"ACHE"}
+
+# Checked in this order; the first module a target is in sets its weight.
+# "core" hits also open the core gate.
+MODULES = {
+    "core": CORE,
+    "secondary": SECONDARY,
+    "symptomatic": LOW_SYMP,
+}
+
+# Per-module target weights; "ad_gene" is for the remaining broad
+# DisGeNET AD genes (very low: prevents NR3C1/DRD-like dominance)
+WEIGHTS = {
+    "core": 5.0,
+    "secondary": 2.0,
+    "symptomatic": 0.25,
+    "ad_gene": 0.5,
+}
+
 # Symptomatic / nonspecific CNS targets that we DO NOT want to dominate Phase 2
 # (These are not "wrong", but they aren't disease-modifying signals.)
 EXCLUDE_PREFIXES = (
@@ -93,8 +98,9 @@ EXCLUDE_EXACT = {
     "CNR1",   # cannabinoid receptor 1
 }
 
-# Symptomatic Alzheimer target (keep, but low weight)
-LOW_SYMP = {"ACHE"}
+# You can tune these:
+CORE_MULTIPLIER = 1.0
+NONCORE_PENALTY = 0.05   # secondary-only gets 5% of score
 
 def is_excluded_target(t: str) -> bool:
     t = str(t).upper().strip()
@@ -102,121 +108,174 @@ def is_excluded_target(t: str) -> bool:
         return True
     return any(t.startswith(p) for p in EXCLUDE_PREFIXES)
 
-def target_weight(t: str) -> float:
+def target_weight(t: str, ad_genes=frozenset(), modules: dict = None,
+                  weights: dict = None) -> float:
+    modules = MODULES if modules is None else modules
+    weights = WEIGHTS if weights is None else weights
     t = str(t).upper().strip()
 
     if is_excluded_target(t):
         return 0.0
 
-    if t in CORE:
-        return 5.0
+    for name, genes in modules.items():
+        if t in genes:
+            return weights[name]
 
-    if t in SECONDARY:
-        return 2.0
-
-    if t in LOW_SYMP:
-        return 0.25
-
-    # Broad AD genes from DisGeNET: very low weight (prevents NR3C1/DRD-like dominance)
-    if t in ad_genes_upper:
-        return 0.5
+    if t in ad_genes:
+        return weights["ad_gene"]
 
     return 0.0
 
-moa["w"] = moa["t_upper"].apply(target_weight)
-moa["is_core_hit"] = moa["t_upper"].isin(CORE)
-
-# --------------------------
-# 4) Drug-level features
-# --------------------------
-# Total distinct targets in curated MOA set
-num_targets_moa = moa.groupby("drug_norm")["t_upper"].nunique()
-
-# Weighted AD score across targets
-moa_w = moa[moa["w"] > 0].copy()
-ad_weight_sum = moa_w.groupby("drug_norm")["w"].sum()
-
-# Core hits count (STRICT)
-core_hits = moa.groupby("drug_norm")["is_core_hit"].sum()
-
-# List of hit targets (only those with w>0)
-ad_hit_targets = moa_w.groupby("drug_norm")["t_upper"].apply(lambda s: ";".join(sorted(set(s))))
-
-features = pd.DataFrame({
-    "drug_norm": num_targets_moa.index,
-    "num_targets_moa": num_targets_moa.values
-}).merge(
-    ad_weight_sum.rename("ad_weight_sum"),
-    on="drug_norm",
-    how="left"
-).merge(
-    core_hits.rename("num_core_hits"),
-    on="drug_norm",
-    how="left"
-).merge(
-    ad_hit_targets.rename("ad_hit_targets"),
-    on="drug_norm",
-    how="left"
-)
-
-features["ad_weight_sum"]  = features["ad_weight_sum"].fillna(0.0)
-features["num_core_hits"]  = features["num_core_hits"].fillna(0).astype(int)
-features["ad_hit_targets"] = features["ad_hit_targets"].fillna("")
-
-# --------------------------
-# 5) Merge with BBB list
-# --------------------------
-out = bbb.merge(features, on="drug_norm", how="left")
-out["num_targets_moa"] = out["num_targets_moa"].fillna(0).astype(int)
-out["ad_weight_sum"]   = out["ad_weight_sum"].fillna(0.0)
-out["num_core_hits"]   = out["num_core_hits"].fillna(0).astype(int)
-out["ad_hit_targets"]  = out["ad_hit_targets"].fillna("")
-out["drug_name_out"]   = out[bbb_name_col].astype(str)
-
-# --------------------------
-# 6) Final scoring rules (pathology-focused)
-# --------------------------
-# Normalize by number of targets to avoid promiscuous domination
-out["ad_score_norm"] = out["ad_weight_sum"] / out["num_targets_moa"].clip(lower=1)
-
-# Hard requirement: must hit at least 1 core pathology gene to score fully
-# Otherwise, heavily penalize (still keep a tiny score for secondary-only)
-out["core_gate"] = (out["num_core_hits"] > 0).astype(int)
-
-# You can tune these:
-CORE_MULTIPLIER = 1.0
-NONCORE_PENALTY = 0.05   # secondary-only gets 5% of score
-
-out["ad_score_gated"] = out["ad_score_norm"] * (
-    out["core_gate"] * CORE_MULTIPLIER + (1 - out["core_gate"]) * NONCORE_PENALTY
-)
-
-# Optionally include BBB score if you have it
-if "bbb_score" in out.columns:
-    out["phase2_score"] = 0.7 * out["ad_score_gated"] + 0.3 * out["bbb_score"].fillna(0)
-else:
-    out["phase2_score"] = out["ad_score_gated"]
-
-out = out.sort_values("phase2_score", ascending=False)
-
-# --------------------------
-# 7) Save outputs
-# --------------------------
-out.to_csv("outputs/phase2_scored_drugs.csv", index=False)
-
-top = out.head(30)[["drug_name_out", "num_targets_moa", "num_core_hits", "ad_hit_targets", "phase2_score"]]
-
-with open("outputs/phase2_report.txt", "w", encoding="utf-8") as f:
-    f.write(f"Total BBB+ drugs: {len(out)}\n")
-    nonzero = (out["phase2_score"] > 0).sum()
-    f.write(f"Non-zero Phase2 v3 score: {nonzero} ({100*nonzero/len(out):.2f}%)\n")
-    f.write(f"Core-hit drugs (num_core_hits>0): {(out['num_core_hits']>0).sum()} ({100*(out['num_core_hits']>0).mean():.2f}%)\n\n")
-    f.write("Top 30 candidates:\n")
-    f.write(top.to_string(index=False))
-    f.write("\n")
-
-print(" Saved phase2_scored_drugs.csv")
-print(" Saved phase2_report.txt")
-print("\nTop 30 candidates:")
-print(top)
-
+def bbb_name_column(bbb: pd.DataFrame) -> str:
+    for c in ["compound_name", "drug_name", "name"]:
+        if c in bbb.columns:
+            return c
+    raise ValueError(f" BBB file missing drug name column. Columns: {bbb.columns.tolist()}")
+
+def target_ids(moa: pd.DataFrame) -> np.ndarray:
+    """
+    Best target identifier per MOA row, upper-cased: gene symbol if
+    present, else target name.
+    """
+    def col(name):
+        if name not in moa.columns:
+            return np.full(len(moa), "", dtype=object)
+        return per_value(moa[name], lambda v: "" if pd.isna(v) else str(v).strip())
+
+    gene, name = col("target_gene"), col("target_name")
+    best = np.where(gene != "", gene, name)
+    return per_value(pd.Series(best), str.upper)
+
+def drug_features(moa: pd.DataFrame, ad_genes, modules: dict = None,
+                  weights: dict = None) -> pd.DataFrame:
+    """
+    Per normalized drug name: distinct MOA targets, summed target weight,
+    core-module hits and the weighted targets (";"-joined, sorted).
+    Target weights are looked up once per distinct target, and every
+    feature comes from one named-aggregation pass.
+    """
+    modules = MODULES if modules is None else modules
+    ad_genes = frozenset(str(g).strip().upper() for g in ad_genes)
+
+    # Integer codes, in name order, for drugs and targets
+    drug_codes, drugs = pd.factorize(norm_names(moa["drug_name"]), sort=True)
+    t_codes, targets = pd.factorize(target_ids(moa), sort=True)
+    targets = np.asarray(targets, dtype=object)
+
+    # Per distinct target: weight, core membership, "<target>;" label
+    w = np.array([target_weight(t, ad_genes, modules, weights) for t in targets], dtype=float)
+    core = np.isin(targets, list(modules.get("core", ())))
+    label = np.array([f"{t};" for t in targets] + [""], dtype=object)
+
+    # Each weighted target once per drug, in name order, so that summing
+    # the labels per drug yields the sorted, ";"-joined hit list
+    order = np.argsort(t_codes, kind="stable")
+    pair = drug_codes[order].astype(np.int64) * len(targets) + t_codes[order]
+    first_hit = (w[t_codes[order]] > 0) & ~pd.Series(pair).duplicated().to_numpy()
+
+    df = pd.DataFrame({
+        "drug": drug_codes[order],
+        "target": t_codes[order],
+        "w": w[t_codes[order]],
+        "is_core_hit": core[t_codes[order]],
+        "hit": label[np.where(first_hit, t_codes[order], len(targets))],
+    })
+    features = df.groupby("drug", sort=True).agg(
+        num_targets_moa=("target", "nunique"),
+        ad_weight_sum=("w", "sum"),
+        num_core_hits=("is_core_hit", "sum"),
+        ad_hit_targets=("hit", "sum"),
+    )
+    features.insert(0, "drug_norm", np.asarray(drugs, dtype=object)[features.index])
+    features["num_core_hits"] = features["num_core_hits"].astype(int)
+    features["ad_hit_targets"] = features["ad_hit_targets"].str[:-1]
+    return features.reset_index(drop=True)
+
+def score_drugs(bbb: pd.DataFrame, moa: pd.DataFrame, ad_genes, modules: dict = None,
+                weights: dict = None) -> pd.DataFrame:
+    """
+    Phase 2 table: the BBB+ drugs with their MOA features and the gated,
+    promiscuity-normalized phase2_score, highest first.
+    - ad_genes: gene symbols (broad AD set)
+    - modules / weights: default MODULES / WEIGHTS
+    """
+    if "drug_name" not in moa.columns:
+        raise ValueError(f" chembl_drug_mechanism_curated.csv missing drug_name. Columns: {moa.columns.tolist()}")
+    name_col = bbb_name_column(bbb)
+
+    out = bbb.assign(drug_norm=norm_names(bbb[name_col]))
+    out = out.merge(drug_features(moa, ad_genes, modules, weights), on="drug_norm", how="left")
+    out["num_targets_moa"] = out["num_targets_moa"].fillna(0).astype(int)
+    out["ad_weight_sum"]   = out["ad_weight_sum"].fillna(0.0)
+    out["num_core_hits"]   = out["num_core_hits"].fillna(0).astype(int)
+    out["ad_hit_targets"]  = out["ad_hit_targets"].fillna("")
+    out["drug_name_out"]   = out[name_col].astype(str)
+
+    # Normalize by number of targets to avoid promiscuous domination
+    out["ad_score_norm"] = out["ad_weight_sum"] / out["num_targets_moa"].clip(lower=1)
+
+    # Hard requirement: must hit at least 1 core pathology gene to score fully
+    # Otherwise, heavily penalize (still keep a tiny score for secondary-only)
+    out["core_gate"] = (out["num_core_hits"] > 0).astype(int)
+
+    out["ad_score_gated"] = out["ad_score_norm"] * (
+        out["core_gate"] * CORE_MULTIPLIER + (1 - out["core_gate"]) * NONCORE_PENALTY
+    )
+
+    # Optionally include BBB score if you have it
+    if "bbb_score" in out.columns:
+        out["phase2_score"] = 0.7 * out["ad_score_gated"] + 0.3 * out["bbb_score"].fillna(0)
+    else:
+        out["phase2_score"] = out["ad_score_gated"]
+
+    return out.sort_values("phase2_score", ascending=False)
+
+def load_inputs(bbb_path: str = BBB_PATH, moa_path: str = MOA_PATH,
+                ad_genes_path: str = AD_GENES_PATH):
+    """
+    (bbb, moa, ad_genes) as score_drugs takes them.
+    """
+    bbb = pd.read_csv(bbb_path)
+    moa = pd.read_csv(moa_path)
+    ad_genes = pd.read_csv(ad_genes_path)["gene_symbol"].astype(str).tolist()
+    return bbb, moa, ad_genes
+
+def write_report(out: pd.DataFrame, path: str):
+    top = out.head(30)[["drug_name_out", "num_targets_moa", "num_core_hits", "ad_hit_targets", "phase2_score"]]
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"Total BBB+ drugs: {len(out)}\n")
+        nonzero = (out["phase2_score"] > 0).sum()
+        f.write(f"Non-zero Phase2 v3 score: {nonzero} ({100*nonzero/len(out):.2f}%)\n")
+        f.write(f"Core-hit drugs (num_core_hits>0): {(out['num_core_hits']>0).sum()} ({100*(out['num_core_hits']>0).mean():.2f}%)\n\n")
+        f.write("Top 30 candidates:\n")
+        f.write(top.to_string(index=False))
+        f.write("\n")
+    return top
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Phase 2 mechanism scoring")
+    parser.add_argument("--bbb", default=BBB_PATH)
+    parser.add_argument("--moa", default=MOA_PATH)
+    parser.add_argument("--ad-genes", default=AD_GENES_PATH)
+    parser.add_argument("--out-dir", default=OUT_DIR)
+    args = parser.parse_args(argv)
+
+    print(" Phase 2 v3 scoring started (pathology-focused)")
+
+    try:
+        out = score_drugs(*load_inputs(args.bbb, args.moa, args.ad_genes))
+    except ValueError as e:
+        raise SystemExit(str(e))
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    out.to_csv(os.path.join(args.out_dir, "phase2_scored_drugs.csv"), index=False)
+    top = write_report(out, os.path.join(args.out_dir, "phase2_report.txt"))
+
+    print(" Saved phase2_scored_drugs.csv")
+    print(" Saved phase2_report.txt")
+    print("\nTop 30 candidates:")
+    print(top)
+
+if __name__ == "__main__":
+    main()
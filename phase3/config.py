@@ -1,6 +1,7 @@
 # phase3/config.py
 
 import os
+import re
 
 # -------- Paths --------
 # Resolve paths relative to this config file's location
@@ -12,13 +13,121 @@ BBB_CSV_PATH = os.path.join(PROJECT_ROOT, "phase2", "outputs", "phase2_scored_dr
 
 # -------- Literature mining limits --------
 MAX_PAPERS_PER_DRUG = 50   # safe default (increase later if needed)
+EPMC_PAGE_SIZE = 100       # papers per cursorMark page (Europe PMC max: 1000)
+
+# ---- Europe PMC API ----
+# Set EPMC_BASE_URL to use the offline stand-in (python -m phase3.phase3_mock_epmc)
+EPMC_DEFAULT_BASE_URL = "https://www.ebi.ac.uk/europepmc/webservices/rest"
+EUROPE_PMC_BASE_URL = os.environ.get("EPMC_BASE_URL", EPMC_DEFAULT_BASE_URL).rstrip("/")
+EUROPE_PMC_SEARCH_URL = f"{EUROPE_PMC_BASE_URL}/search"
+
+# Any other endpoint (e.g. the mock) gets its own cache and outputs under
+# "endpoint-<host_port>", so its papers never reach the production cache
+EPMC_ENDPOINT_DIR = (
+    "" if EUROPE_PMC_BASE_URL == EPMC_DEFAULT_BASE_URL
+    else "endpoint-" + re.sub(r"[^A-Za-z0-9]+", "_", EUROPE_PMC_BASE_URL.split("://", 1)[-1]).strip("_")
+)
 
 # ---- Output/cache dirs ----
 OUT_DIR = os.path.join(PROJECT_ROOT, "phase3", "outputs")
 CACHE_DIR = os.path.join(PROJECT_ROOT, "phase3", "cache")
+if EPMC_ENDPOINT_DIR:
+    OUT_DIR = os.path.join(OUT_DIR, EPMC_ENDPOINT_DIR)
+    CACHE_DIR = os.path.join(CACHE_DIR, EPMC_ENDPOINT_DIR)
+CACHE_DB_PATH = os.path.join(CACHE_DIR, "epmc_cache.sqlite")
+CACHE_TTL_DAYS = 90                  # older entries are re-fetched
+CACHE_MAX_BYTES = 2 * 1024 ** 3      # LRU eviction above this size
+CACHE_NEGATIVE_TTL_MINUTES = 30      # failed fetches are retried after this
 
-# ---- Europe PMC API ----
-EUROPE_PMC_SEARCH_URL = "https://www.ebi.ac.uk/europepmc/webservices/rest/search"
+# ---- Europe PMC fetch concurrency ----
+EPMC_MAX_IN_FLIGHT = 8           # concurrent requests (1 = serial)
+EPMC_REQUESTS_PER_SECOND = 5.0   # shared ceiling across all workers
+
+# ---- HTTP resilience ----
+EPMC_TIMEOUT = 30                # seconds per request
+EPMC_MAX_RETRIES = 5             # retries on timeouts, 429 and 5xx
+EPMC_BACKOFF_BASE = 1.0          # seconds; doubles per retry (with jitter)
+EPMC_BACKOFF_MAX = 60.0
+EPMC_BREAKER_THRESHOLD = 10      # consecutive failures that pause all requests
+EPMC_BREAKER_COOLDOWN = 60.0     # seconds
+
+# ---- Paper store ----
+# List IDs first and fetch full records only for unseen papers. Costs one extra
+# call per page on a cold cache; pays off once papers repeat across drugs/runs.
+EPMC_IDLIST_FIRST = True
+EPMC_CORE_BATCH = 100            # IDs per full-record query
+
+# ---- Adaptive retrieval budget (phase3_run_all --plan) ----
+PLAN_TOTAL_BUDGET = 25000        # papers across all drugs
+PLAN_FLOOR = 5                   # minimum papers per drug with hits
+PLAN_CAP = 500                   # maximum papers per drug
+
+# ---- Full text (phase3_run_all --fulltext) ----
+# Open-access papers are parsed section by section from fullTextXML;
+# only extracted section text is cached, never the raw XML
+EPMC_FULLTEXT_WORKERS = 8
+FULLTEXT_MAX_SECTION_CHARS = 20000   # per section, after whitespace collapse
+
+# ---- Evidence extraction (phase3_run_all) ----
+EXTRACT_WORKERS = 1              # processes (1 = serial, in-process)
+EXTRACT_CHUNK_SIZE = 500         # (drug, paper) pairs sent to a worker at a time
+# Reuse extract_evidence results from the cache store; a paper is re-extracted
+# only when its content or the keyword lists / gates change
+EXTRACT_MEMO = True
+# --stream: papers CSV rows buffered per append, and per chunk when aggregating
+STREAM_CHUNK_ROWS = 2000
+# Keep per-drug score tallies between runs; a drug's tallies change only by
+# its new, changed or retracted paper rows. Off by default: running sums can
+# differ from a from-scratch aggregation in the last float digit
+AGG_INCREMENTAL = False
+AGG_STATE_PATH = os.path.join(OUT_DIR, "phase3_agg_state.sqlite")
+# --stream runs record per-drug progress here (phase3_run_all --resume)
+RUN_JOURNAL_PATH = os.path.join(OUT_DIR, "phase3_run_journal.sqlite")
+
+# ---- Run scheduling (phase3_run_all) ----
+# Drugs are mined in descending order of this Phase 2 column (missing
+# values last, then by name), so a run cut short has covered the most
+# promising candidates first
+PRIORITY_COLUMN = "phase2_score"
+RUN_MAX_DRUGS = 500              # top drugs by priority per run (0 = all)
+SNAPSHOT_EVERY_SECONDS = 600     # --stream: republish phase3_lit_evidence.csv this often
+
+# ---- Relevance classifier (phase3_run_all --extractor classifier) ----
+# Hashed title/abstract n-grams + logistic regression for relevance and
+# direction, trained with: python -m phase3.phase3_classifier train
+CLASSIFIER_PATH = os.path.join(OUT_DIR, "phase3_classifier.joblib")
+CLASSIFIER_N_FEATURES = 2 ** 18
+CLASSIFIER_THRESHOLD = 0.5       # relevance probability a paper needs to be kept
+CLASSIFIER_NEGATIVE_RATIO = 2.0  # gate-failing cached papers per labelled row
+
+# ---- Canonical parents ----
+# Enantiomers, racemates, salts and hydrates of one compound share a
+# single literature pull (searching every member's name); evidence is
+# copied back to every member. Off by default: it changes the "drug"
+# values searched and cached.
+CANONICALIZE_DRUGS = False
+CANON_GROUPS_PATH = os.path.join(OUT_DIR, "phase3_canonical_groups.csv")
+
+# ---- Target-centric mode (phase3_run_all --mode target) ----
+MOA_CSV_PATH = os.path.join(PROJECT_ROOT, "database", "chembl_drug_mechanism_curated.csv")
+TARGET_MAX_PAPERS = 200          # papers per AD-relevant target
+
+# ---- Synonym-aware queries ----
+# Also search stereo-free names and ChEMBL synonyms (INN, brand names, codes),
+# packed into as few OR queries per drug as EPMC_QUERY_MAX_CHARS allows
+EPMC_USE_SYNONYMS = False
+CHEMBL_DB_PATH = os.path.join(PROJECT_ROOT, "database", "chembl_36.db")
+EPMC_SYNONYM_MAX = 15            # names per drug (display name first)
+EPMC_QUERY_MAX_CHARS = 1500
+
+# ---- Incremental refresh ----
+EPMC_REFRESH_OVERLAP_DAYS = 7    # re-query this many days before the last fetch
+
+# ---- Batched (multi-drug) queries ----
+EPMC_BATCHED_QUERIES = False     # OR drug names together, then demultiplex
+EPMC_BATCH_GROUP_SIZE = 20       # drugs per query
+EPMC_BATCH_MAX_CHARS = 1500      # max query length
+EPMC_BATCH_MAX_HITS = 200        # bigger groups fall back to per-drug queries
 
 # ---- Alzheimer query building ----
 # (used indirectly by search)
@@ -0,0 +1,201 @@
+# phase3/phase3_bench.py
+# Micro-benchmarks for phase 3 hot paths (no network).
+#
+#   python -m phase3.phase3_bench extract --papers 20000
+#   python -m phase3.phase3_bench classify --papers 20000
+#   python -m phase3.phase3_bench score --papers 10000 100000 1000000
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+try:
+    from .phase3_extract import (
+        KeywordMatcher, MATCH_CATEGORIES, extract_evidence,
+        contains_any, has_any_outcome, keyword_hits, detect_model, outcome_tags,
+        AD_TERMS, AD_MODEL_MARKERS
+    )
+    from .phase3_score import (
+        paper_score, apply_tool_penalty, join_models, aggregate_drug_scores, TOOL_PENALTY_TERMS
+    )
+    from .config import POSITIVE_KEYWORDS, NEGATIVE_KEYWORDS, CLASSIFIER_PATH, MODEL_WEIGHTS
+    from .phase3_mock_epmc import SyntheticCorpus, default_drug_names
+except ImportError:
+    from phase3_extract import (
+        KeywordMatcher, MATCH_CATEGORIES, extract_evidence,
+        contains_any, has_any_outcome, keyword_hits, detect_model, outcome_tags,
+        AD_TERMS, AD_MODEL_MARKERS
+    )
+    from phase3_score import (
+        paper_score, apply_tool_penalty, join_models, aggregate_drug_scores, TOOL_PENALTY_TERMS
+    )
+    from config import POSITIVE_KEYWORDS, NEGATIVE_KEYWORDS, CLASSIFIER_PATH, MODEL_WEIGHTS
+    from phase3_mock_epmc import SyntheticCorpus, default_drug_names
+
+def per_list_evidence(drug: str, paper: dict):
+    """
+    extract_evidence (abstract only) as computed before the single-pass
+    matcher: one lower() and one linear scan per keyword list.
+    """
+    title = paper.get("title", "") or ""
+    abstract = paper.get("abstractText", "") or ""
+    text = f"{title}\n{abstract}"
+    if not contains_any(text, AD_TERMS) or not contains_any(text, AD_MODEL_MARKERS):
+        return None
+    if not has_any_outcome(text):
+        return None
+
+    pos = keyword_hits(text, POSITIVE_KEYWORDS)
+    neg = keyword_hits(text, NEGATIVE_KEYWORDS)
+    direction = "neutral"
+    if pos > neg and pos > 0:
+        direction = "positive"
+    elif neg > pos and neg > 0:
+        direction = "negative"
+    return {
+        "drug": drug, "title": title, "pmid": paper.get("pmid"), "doi": paper.get("doi"),
+        "journal": paper.get("journalTitle"), "pub_year": paper.get("pubYear"),
+        "model": detect_model(text), "direction": direction, "pos_hits": pos, "neg_hits": neg,
+        "outcomes": ";".join(outcome_tags(text)), "abstract": abstract[:8000],
+    }
+
+def timed(fn, papers, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = [fn(p) for p in papers]
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+def bench_extract(n_papers: int, repeat: int, seed: int):
+    corpus = SyntheticCorpus(n_papers, default_drug_names(500), seed=seed)
+    papers = [{k: v for k, v in p.items() if not k.startswith("_")} for p in corpus.papers]
+
+    def single_pass(matcher):
+        return lambda paper: extract_evidence("x", paper, matcher=matcher)
+
+    runs = [("per-list scans (old)", lambda paper: per_list_evidence("x", paper))]
+    for use_automaton in (False, True):
+        matcher = KeywordMatcher(MATCH_CATEGORIES, use_automaton=use_automaton)
+        if use_automaton and matcher.backend != "aho-corasick":
+            print(" pyahocorasick not installed; skipping the Aho-Corasick run")
+            continue
+        runs.append((f"single pass, {matcher.backend}", single_pass(matcher)))
+
+    results = []
+    print(f" {len(papers)} synthetic papers, best of {repeat}")
+    for name, fn in runs:
+        seconds, out = timed(fn, papers, repeat)
+        results.append(out)
+        print(f"   {name:<32} {len(papers) / seconds:>10,.0f} papers/s  "
+              f"({1e6 * seconds / len(papers):.1f} us/paper)")
+
+    same = all(out == results[0] for out in results[1:])
+    print(f" Evidence rows identical: {same}")
+
+def bench_classify(n_papers: int, repeat: int, seed: int, model_path: str):
+    try:
+        from .phase3_classifier import ClassifierExtractor
+    except ImportError:
+        from phase3_classifier import ClassifierExtractor
+
+    corpus = SyntheticCorpus(n_papers, default_drug_names(500), seed=seed)
+    papers = [{k: v for k, v in p.items() if not k.startswith("_")} for p in corpus.papers]
+    extractor = ClassifierExtractor(model_path)
+    extractor.predict(papers[:10])   # load the model outside the timing
+
+    print(f" {len(papers)} synthetic papers, best of {repeat}")
+    for name, fn in [
+        ("predict (one sparse batch)", lambda: extractor.predict(papers)),
+        ("extract_chunk", lambda: extractor.extract_chunk([("x", p, None) for p in papers])),
+    ]:
+        best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - t0)
+        print(f"   {name:<32} {len(papers) / best:>10,.0f} papers/s")
+
+def rowwise_drug_scores(df_papers: pd.DataFrame) -> pd.DataFrame:
+    """
+    aggregate_drug_scores as computed before vectorization: paper_score
+    and apply_tool_penalty row by row, lambda/join aggregations.
+    """
+    df = df_papers.copy()
+    df["paper_score"] = df.apply(paper_score, axis=1)
+    agg = df.groupby("drug").agg(
+        evidence_score=("paper_score", "sum"),
+        n_papers=("paper_score", "count"),
+        n_positive=("direction", lambda x: (x == "positive").sum()),
+        n_negative=("direction", lambda x: (x == "negative").sum()),
+        models=("model", join_models),
+    ).reset_index()
+
+    agg["evidence_score"] = agg["evidence_score"].clip(upper=50)
+    agg["net_positive"] = agg["n_positive"] - agg["n_negative"]
+    agg["signed_score"] = agg["evidence_score"] * (1 + 0.15 * agg["net_positive"])
+    agg.loc[agg["net_positive"] <= 0, "signed_score"] = (
+        agg.loc[agg["net_positive"] <= 0, "evidence_score"] * 0.05
+    )
+    agg["signed_score"] = agg.apply(
+        lambda r: apply_tool_penalty(r["drug"], r["signed_score"]), axis=1
+    )
+    agg["confidence"] = (
+        (agg["n_papers"].clip(upper=20) / 20.0) +
+        (agg["models"].str.count(";").clip(upper=4) / 4.0)
+    ) / 2.0
+    return agg.sort_values("signed_score", ascending=False)
+
+def synthetic_papers(n_papers: int, n_drugs: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    drugs = default_drug_names(n_drugs) + TOOL_PENALTY_TERMS
+    outcomes = ["", "cognition", "amyloid;cognition", "amyloid;tau;synapse", "neuroinflammation"]
+    return pd.DataFrame({
+        "drug": rng.choice(drugs, n_papers),
+        "model": rng.choice(list(MODEL_WEIGHTS) + ["unknown"], n_papers),
+        "direction": rng.choice(["positive", "negative", "neutral"], n_papers),
+        "pos_hits": rng.integers(0, 9, n_papers),
+        "neg_hits": rng.integers(0, 5, n_papers),
+        "outcomes": rng.choice(outcomes, n_papers),
+    })
+
+def bench_score(sizes, n_drugs: int, seed: int):
+    print(f" Drug-level aggregation, {n_drugs} drugs")
+    for n in sizes:
+        df = synthetic_papers(n, n_drugs, seed)
+        times = []
+        for fn in (rowwise_drug_scores, aggregate_drug_scores):
+            t0 = time.perf_counter()
+            out = fn(df)
+            times.append((time.perf_counter() - t0, out))
+        (t_old, old), (t_new, new) = times
+        print(f"   {n:>9,} papers  row-wise {t_old:8.2f}s  vectorized {t_new:6.2f}s  "
+              f"x{t_old / t_new:,.0f}  identical: {old.equals(new)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Phase 3 micro-benchmarks")
+    sub = parser.add_subparsers(dest="bench", required=True)
+    p = sub.add_parser("extract", help="per-paper evidence extraction throughput")
+    p.add_argument("--papers", type=int, default=20000)
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--seed", type=int, default=42)
+    p = sub.add_parser("classify", help="relevance classifier throughput")
+    p.add_argument("--papers", type=int, default=20000)
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--model", default=None, help="default: CLASSIFIER_PATH")
+    p = sub.add_parser("score", help="drug-level aggregation, row-wise vs vectorized")
+    p.add_argument("--papers", type=int, nargs="+", default=[10000, 100000, 1000000])
+    p.add_argument("--drugs", type=int, default=2000)
+    p.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.bench == "extract":
+        bench_extract(args.papers, args.repeat, args.seed)
+    elif args.bench == "classify":
+        bench_classify(args.papers, args.repeat, args.seed, args.model or CLASSIFIER_PATH)
+    elif args.bench == "score":
+        bench_score(args.papers, args.drugs, args.seed)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+# phase3/phase3_cache.py
+import os
+import json
+import time
+import zlib
+import glob
+import datetime
+import sqlite3
+import hashlib
+import argparse
+import threading
+
+try:
+    from .config import (
+        CACHE_DIR, CACHE_DB_PATH, CACHE_TTL_DAYS, CACHE_MAX_BYTES, CACHE_NEGATIVE_TTL_MINUTES
+    )
+except ImportError:
+    from config import (
+        CACHE_DIR, CACHE_DB_PATH, CACHE_TTL_DAYS, CACHE_MAX_BYTES, CACHE_NEGATIVE_TTL_MINUTES
+    )
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key         TEXT PRIMARY KEY,
+    drug        TEXT NOT NULL,
+    params      TEXT NOT NULL,
+    fetched_at  REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    size        INTEGER NOT NULL,
+    blob        BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_entries_drug ON entries(drug);
+CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries(accessed_at);
+CREATE TABLE IF NOT EXISTS papers (
+    paper_key   TEXT PRIMARY KEY,
+    fetched_at  REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    size        INTEGER NOT NULL,
+    blob        BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_papers_accessed ON papers(accessed_at);
+CREATE TABLE IF NOT EXISTS evidence (
+    memo_key    TEXT PRIMARY KEY,
+    accessed_at REAL NOT NULL,
+    size        INTEGER NOT NULL,
+    blob        BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_evidence_accessed ON evidence(accessed_at);
+CREATE TABLE IF NOT EXISTS failures (
+    key       TEXT PRIMARY KEY,
+    drug      TEXT NOT NULL,
+    failed_at REAL NOT NULL,
+    error     TEXT
+);
+"""
+
+# Check the size bound every N writes (SUM(size) is a table scan)
+EVICT_CHECK_EVERY = 64
+
+# SQLite host-parameter limit per IN (...) query
+SQL_CHUNK = 500
+
+def safe_cache_name(drug: str) -> str:
+    """
+    Legacy per-drug JSON filename (phase3/cache/epmc_<sha1>.json).
+    """
+    h = hashlib.sha1(drug.encode("utf-8")).hexdigest()[:16]
+    return f"epmc_{h}.json"
+
+def make_key(drug: str, params: dict) -> str:
+    raw = json.dumps({"drug": drug, "params": params}, sort_keys=True)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def encode(value) -> bytes:
+    return zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8"), 6)
+
+def decode(blob: bytes):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+def paper_key(p: dict):
+    return p.get("pmid") or p.get("doi")
+
+class CacheStore:
+    """
+    Single-file SQLite cache for Europe PMC results.
+    - key = drug + query params (changing the query never serves stale data)
+    - full paper records live once in a global PMID/DOI-keyed table;
+      drug entries only hold references into it
+    - values are zlib-compressed compact JSON
+    - entries older than ttl_days are treated as missing
+    - least-recently-used entries are evicted above max_bytes
+    - WAL mode + busy timeout: safe for threads and for several processes
+    - failed fetches are kept apart as short-lived negative entries
+    - memoized extract_evidence results (phase3_extract) share the LRU bound
+    """
+    def __init__(self, path: str = CACHE_DB_PATH, ttl_days: float = CACHE_TTL_DAYS,
+                 max_bytes: int = CACHE_MAX_BYTES,
+                 negative_ttl_minutes: float = CACHE_NEGATIVE_TTL_MINUTES):
+        self.path = path
+        self.ttl_seconds = None if ttl_days is None else ttl_days * 86400.0
+        self.max_bytes = max_bytes
+        self.negative_ttl_seconds = negative_ttl_minutes * 60.0
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _expired(self, fetched_at: float) -> bool:
+        return self.ttl_seconds is not None and time.time() - fetched_at > self.ttl_seconds
+
+    def get_entry(self, drug: str, params: dict, include_expired: bool = False):
+        """
+        Returns (value, fetched_at) or None if missing/expired.
+        """
+        key = make_key(drug, params)
+        row = self._conn().execute(
+            "SELECT fetched_at, blob FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or (self._expired(row[0]) and not include_expired):
+            return None
+        self._conn().execute(
+            "UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key)
+        )
+        return decode(row[1]), row[0]
+
+    def get(self, drug: str, params: dict):
+        entry = self.get_entry(drug, params)
+        return None if entry is None else entry[0]
+
+    def put(self, drug: str, params: dict, value, fetched_at: float = None):
+        blob = encode(value)
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO entries (key, drug, params, fetched_at, accessed_at, size, blob) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (make_key(drug, params), drug, json.dumps(params, sort_keys=True),
+             now if fetched_at is None else fetched_at, now, len(blob), blob)
+        )
+        self._count_write()
+
+    def _count_write(self):
+        with self._lock:
+            self._writes += 1
+            check = self._writes % EVICT_CHECK_EVERY == 0
+        if check:
+            self.evict()
+
+    # ---- global paper store ----
+    def get_papers(self, keys) -> dict:
+        """
+        {paper_key: record} for the keys present in the store.
+        """
+        keys = list(dict.fromkeys(k for k in keys if k))
+        found = {}
+        conn = self._conn()
+        now = time.time()
+        for i in range(0, len(keys), SQL_CHUNK):
+            chunk = keys[i:i + SQL_CHUNK]
+            marks = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT paper_key, blob FROM papers WHERE paper_key IN ({marks})", chunk
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = decode(blob)
+            conn.execute(
+                f"UPDATE papers SET accessed_at = ? WHERE paper_key IN ({marks})", [now] + chunk
+            )
+        return found
+
+    def iter_papers(self):
+        """
+        Every stored paper record (streamed, in no particular order).
+        """
+        for _, blob in self._conn().execute("SELECT paper_key, blob FROM papers"):
+            yield decode(blob)
+
+    def put_papers(self, papers):
+        now = time.time()
+        rows = []
+        for p in papers:
+            key = paper_key(p)
+            if key:
+                blob = encode(p)
+                rows.append((key, now, now, len(blob), blob))
+        if not rows:
+            return
+        self._conn().executemany(
+            "INSERT OR REPLACE INTO papers (paper_key, fetched_at, accessed_at, size, blob) "
+            "VALUES (?, ?, ?, ?, ?)", rows
+        )
+        self._count_write()
+
+    # ---- memoized extraction results ----
+    def get_evidence(self, keys) -> dict:
+        """
+        {memo_key: evidence row or None (failed the gates)} for stored keys.
+        """
+        keys = list(dict.fromkeys(k for k in keys if k))
+        found = {}
+        conn = self._conn()
+        now = time.time()
+        for i in range(0, len(keys), SQL_CHUNK):
+            chunk = keys[i:i + SQL_CHUNK]
+            marks = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT memo_key, blob FROM evidence WHERE memo_key IN ({marks})", chunk
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = decode(blob)
+            conn.execute(
+                f"UPDATE evidence SET accessed_at = ? WHERE memo_key IN ({marks})", [now] + chunk
+            )
+        return found
+
+    def put_evidence(self, results: dict):
+        now = time.time()
+        rows = []
+        for key, ev in results.items():
+            blob = encode(ev)
+            rows.append((key, now, len(blob), blob))
+        if not rows:
+            return
+        self._conn().executemany(
+            "INSERT OR REPLACE INTO evidence (memo_key, accessed_at, size, blob) VALUES (?, ?, ?, ?)",
+            rows
+        )
+        self._count_write()
+
+    # ---- negative cache ----
+    def put_failure(self, drug: str, params: dict, error: str):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO failures (key, drug, failed_at, error) VALUES (?, ?, ?, ?)",
+            (make_key(drug, params), drug, time.time(), str(error))
+        )
+
+    def get_failure(self, drug: str, params: dict):
+        """
+        Error message of a recent failed fetch, or None once it has expired.
+        """
+        row = self._conn().execute(
+            "SELECT failed_at, error FROM failures WHERE key = ?", (make_key(drug, params),)
+        ).fetchone()
+        if row is None or time.time() - row[0] > self.negative_ttl_seconds:
+            return None
+        return row[1]
+
+    def clear_failure(self, drug: str, params: dict):
+        self._conn().execute("DELETE FROM failures WHERE key = ?", (make_key(drug, params),))
+
+    def delete(self, drug: str, params: dict):
+        self._conn().execute("DELETE FROM entries WHERE key = ?", (make_key(drug, params),))
+
+    def purge_expired(self) -> int:
+        self._conn().execute(
+            "DELETE FROM failures WHERE failed_at < ?", (time.time() - self.negative_ttl_seconds,)
+        )
+        if self.ttl_seconds is None:
+            return 0
+        cur = self._conn().execute(
+            "DELETE FROM entries WHERE fetched_at < ?", (time.time() - self.ttl_seconds,)
+        )
+        return cur.rowcount
+
+    def evict(self) -> int:
+        """
+        Drop least-recently-used entries until the store fits in max_bytes.
+        """
+        if not self.max_bytes:
+            return 0
+        conn = self._conn()
+        total = conn.execute(
+            "SELECT (SELECT COALESCE(SUM(size), 0) FROM entries) + "
+            "(SELECT COALESCE(SUM(size), 0) FROM papers) + "
+            "(SELECT COALESCE(SUM(size), 0) FROM evidence)"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+
+        # Evicted papers are re-fetched by ID when a drug entry needs them
+        excess = total - self.max_bytes
+        rows = conn.execute(
+            "SELECT 'entries', key, size, accessed_at FROM entries "
+            "UNION ALL SELECT 'papers', paper_key, size, accessed_at FROM papers "
+            "UNION ALL SELECT 'evidence', memo_key, size, accessed_at FROM evidence "
+            "ORDER BY accessed_at ASC"
+        ).fetchall()
+        victims = {"entries": [], "papers": [], "evidence": []}
+        for table, key, size, _ in rows:
+            if excess <= 0:
+                break
+            victims[table].append((key,))
+            excess -= size
+        conn.executemany("DELETE FROM entries WHERE key = ?", victims["entries"])
+        conn.executemany("DELETE FROM papers WHERE paper_key = ?", victims["papers"])
+        conn.executemany("DELETE FROM evidence WHERE memo_key = ?", victims["evidence"])
+        return sum(len(v) for v in victims.values())
+
+    def stats(self) -> dict:
+        n, size = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        n_papers, paper_size = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM papers"
+        ).fetchone()
+        n_evidence, evidence_size = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM evidence"
+        ).fetchone()
+        return {
+            "entries": n, "papers": n_papers, "evidence": n_evidence,
+            "bytes": size + paper_size + evidence_size, "path": self.path
+        }
+
+def migrate_json_cache(store: CacheStore, drugs, params_for, cache_dir: str = CACHE_DIR,
+                       legacy_page_size: int = 50) -> int:
+    """
+    Import legacy phase3/cache/epmc_<sha1>.json files into the store.
+    Filenames only hash the drug name, so `drugs` supplies the names;
+    `params_for(drug)` gives the query params to file each entry under.
+    A bare list of papers came from a single first-page call: a full
+    page is marked resumable (cursor restarts, duplicates are skipped).
+    Entries are imported as fresh, so an old file is not expired (and
+    purged) on arrival; its date is kept as the state's last_fetch_date
+    for --refresh.
+    """
+    by_name = {safe_cache_name(d): d for d in drugs}
+    imported = 0
+    for path in sorted(glob.glob(os.path.join(cache_dir, "epmc_*.json"))):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        if isinstance(data, dict):
+            drug = data.get("drug") or by_name.get(os.path.basename(path))
+            state = data
+        else:
+            drug = by_name.get(os.path.basename(path))
+            state = {
+                "drug": drug, "papers": data, "hit_count": None,
+                "next_cursor": "*", "done": len(data) < legacy_page_size
+            }
+        if drug is None:
+            continue
+
+        state.setdefault(
+            "last_fetch_date", datetime.date.fromtimestamp(os.path.getmtime(path)).isoformat()
+        )
+        store.put(drug, params_for(drug), state)
+        imported += 1
+    return imported
+
+def main():
+    parser = argparse.ArgumentParser(description="Phase 3 Europe PMC cache store")
+    parser.add_argument("--migrate", action="store_true",
+                        help="import legacy phase3/cache/epmc_*.json files")
+    parser.add_argument("--purge", action="store_true", help="delete expired entries")
+    args = parser.parse_args()
+
+    try:
+        from .phase3_search import STORE, query_params
+        from .phase3_run_all import load_drug_list
+    except ImportError:
+        from phase3_search import STORE, query_params
+        from phase3_run_all import load_drug_list
+
+    if args.migrate:
+        n = migrate_json_cache(STORE, load_drug_list(), query_params)
+        print(f" Imported {n} legacy cache files into {STORE.path}")
+    if args.purge:
+        print(f" Purged {STORE.purge_expired()} expired entries")
+    print(" Cache:", STORE.stats())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+# phase3/phase3_canon.py
+import os
+import re
+import bisect
+import pandas as pd
+
+try:
+    from .config import CANON_GROUPS_PATH
+    from .phase3_synonyms import CHEMBL, name_key
+except ImportError:
+    from config import CANON_GROUPS_PATH
+    from phase3_synonyms import CHEMBL, name_key
+
+# Optional: connectivity-level InChIKeys when RDKit is installed
+try:
+    from rdkit import Chem, RDLogger
+    from rdkit.Chem.MolStandardize import rdMolStandardize
+    RDLogger.DisableLog("rdApp.*")
+except ImportError:
+    Chem = None
+
+# Counter-ions and solvates only. Words that usually name an ester or
+# prodrug ("acetate", "succinate", "phosphate", "valerate", ...) are a
+# different compound and stay in the name.
+SALT_WORDS = {
+    "hydrochloride", "dihydrochloride", "hcl", "hydrobromide", "hydroiodide",
+    "sulfate", "sulphate", "bisulfate", "mesylate", "mesilate", "dimesylate",
+    "maleate", "dimaleate", "fumarate", "hemifumarate", "tartrate", "bitartrate",
+    "citrate", "besylate", "besilate", "tosylate", "napsylate", "nitrate",
+    "lactate", "gluconate", "oxalate", "malate", "pamoate", "hyclate", "sodium",
+    "disodium", "potassium", "calcium", "magnesium", "hydrate", "monohydrate",
+    "dihydrate", "trihydrate", "hemihydrate", "sesquihydrate", "anhydrous", "salt"
+}
+
+# Prefixes that only pick an enantiomer or the racemate: "(+)-", "(-)-",
+# "(+/-)-", "(?)-" (mis-encoded ±), "(r)-", "(s)-", "rac-". Multi-centre
+# and E/Z descriptors can name a diastereomer, a different compound.
+ENANTIOMER_PREFIX = re.compile(
+    r"^\s*(?:\(\s*[+\-±?/ ]+\s*\)|\(\s*(?:\d+[a-z]?)?[rs]\s*\)|rac)(?:\s*-\s*|\s+)",
+    re.IGNORECASE
+)
+
+ORGANIC = {"B", "C", "N", "O", "P", "S", "F", "Cl", "Br", "I", "b", "c", "n", "o", "p", "s"}
+
+# One SMILES atom: bracket atom or organic-subset symbol
+ATOM_TOKEN = re.compile(r"\[[^\]]*\]|Br|Cl|[BCNOPSFI]|[bcnops]")
+
+GROUP_COLUMNS = ["drug", "parent", "name_key", "structure_key", "version"]
+
+# Bump when grouping rules change, so persisted tables are rebuilt
+GROUPING_VERSION = "2"
+
+# CAS numbers and database IDs are poor search terms for a parent
+IDENTIFIER = re.compile(
+    r"^(?:\d{2,7}-\d{2}-\d|(?:s?chembl|zinc|akos|cid|sid|nsc|dtxsid|mcule)[-_ ]?\d+)$"
+)
+
+def strip_enantiomer(name: str) -> str:
+    prev = None
+    name = name.strip()
+    while prev != name:
+        prev, name = name, ENANTIOMER_PREFIX.sub("", name, count=1)
+    return name
+
+def parent_name(name: str) -> str:
+    """
+    Display name without enantiomer prefix or trailing salt/hydrate words:
+    "(+)-terbutaline sulfate" -> "terbutaline".
+    """
+    words = strip_enantiomer(str(name)).lower().split()
+    while len(words) > 1 and words[-1].strip("(),") in SALT_WORDS:
+        words.pop()
+    return " ".join(words)
+
+def is_systematic(name: str) -> bool:
+    # Identifiers (CAS, ChEMBL/ZINC IDs) and IUPAC-style names
+    return bool(IDENTIFIER.match(name) or re.search(r"[\d\[\](),]", name))
+
+def name_frequency(all_names):
+    """
+    Function giving how many of `all_names` are a name or start with it
+    followed by a separator ("fluorometholone" counts "fluorometholone
+    acetate"): how established a spelling is across the whole table.
+    """
+    ordered = sorted(all_names)
+
+    def frequency(name: str) -> int:
+        lo = bisect.bisect_left(ordered, name)
+        hi = bisect.bisect_left(ordered, name + "\uffff")
+        return sum(1 for n in ordered[lo:hi] if n == name or not n[len(name)].isalnum())
+    return frequency
+
+def choose_parent(names, frequency=None) -> str:
+    """
+    A group's parent among its members' parent names: the ChEMBL
+    preferred name if a member has one; common names before identifiers
+    and systematic names; then the name most members reduce to, the most
+    frequent spelling in the table (`frequency`), and alphabetical.
+    Length plays no part (short names are often older synonyms, e.g.
+    "eserine" for physostigmine).
+    """
+    counts = {}
+    for name in names:
+        counts[name] = counts.get(name, 0) + 1
+    preferred = {
+        name_key(p) for p in (CHEMBL.preferred(n) for n in counts) if p
+    }
+    return min(counts, key=lambda n: (
+        n not in preferred, bool(IDENTIFIER.match(n)), is_systematic(n), -counts[n],
+        -(frequency(n) if frequency else 0), n
+    ))
+
+def _largest_fragment(smiles: str) -> str:
+    # Salts/solvates are "." separated; keep the fragment with most heavy atoms
+    frags = smiles.split(".")
+    return max(frags, key=lambda f: len(re.findall(r"[A-Z][a-z]?|[bcnops]", f)))
+
+def _unstereo_atom(m) -> str:
+    body = m.group(1).replace("@", "")
+    bare = re.fullmatch(r"([A-Z][a-z]?|[bcnops])H?\d*", body)
+    if bare and bare.group(1) in ORGANIC and not body.endswith(("H2", "H3", "H4")):
+        return bare.group(1)
+    return f"[{body}]"
+
+def stereo_signature(smiles):
+    """
+    (skeleton, marks) of the largest fragment, or None without SMILES.
+    skeleton: the structure without tetrahedral stereo (E/Z kept);
+    marks: per atom 0 / 1 for the two configurations, None if unspecified.
+    With RDKit: connectivity InChIKey block plus E/Z bonds, and CIP
+    labels in canonical atom order. Without: the fragment's SMILES with
+    @/@@ removed, and its @/@@ marks in atom order.
+    """
+    if not isinstance(smiles, str) or not smiles.strip():
+        return None
+    smiles = smiles.strip()
+    if Chem is not None:
+        mol = Chem.MolFromSmiles(smiles)
+        if mol is not None:
+            mol = rdMolStandardize.LargestFragmentChooser().choose(mol)
+            Chem.AssignStereochemistry(mol, cleanIt=True, force=True)
+            flat = Chem.Mol(mol)
+            Chem.RemoveStereochemistry(flat)
+            key = Chem.MolToInchiKey(flat)
+            if key:
+                rank = list(Chem.CanonicalRankAtoms(flat, breakTies=True))
+                cip = {"R": 0, "S": 1}
+                marks = [None] * mol.GetNumAtoms()
+                for atom in mol.GetAtoms():
+                    if atom.HasProp("_CIPCode"):
+                        marks[rank[atom.GetIdx()]] = cip.get(atom.GetProp("_CIPCode"))
+                ez = sorted(
+                    (tuple(sorted((rank[b.GetBeginAtomIdx()], rank[b.GetEndAtomIdx()]))), str(b.GetStereo()))
+                    for b in mol.GetBonds() if b.GetStereo() in (Chem.BondStereo.STEREOE, Chem.BondStereo.STEREOZ)
+                )
+                return f"{key.split('-')[0]}{ez if ez else ''}", tuple(marks)
+    frag = _largest_fragment(smiles)
+    marks = tuple(
+        (1 if "@@" in t else 0) if "@" in t else None for t in ATOM_TOKEN.findall(frag)
+    )
+    return re.sub(r"\[([^\]]*@[^\]]*)\]", _unstereo_atom, frag), marks
+
+def _oriented(marks, ref):
+    """
+    marks as seen from ref: unchanged if every centre both specify
+    agrees, mirrored if every one is inverted (an enantiomer), else None.
+    """
+    shared = [(a, b) for a, b in zip(marks, ref) if a is not None and b is not None]
+    if all(a == b for a, b in shared):
+        return marks
+    if all(a != b for a, b in shared):
+        return tuple(None if a is None else 1 - a for a in marks)
+    return None
+
+def structure_keys(smiles) -> list:
+    """
+    Salt-free structure key per SMILES ("" if none). Enantiomers,
+    racemates and records with unspecified centres share a key, but
+    diastereomers (epimers such as dexamethasone / betamethasone) get
+    different ones: within one skeleton, a record joins the first stereo
+    class whose centres it agrees with (or mirrors) wherever both are
+    specified, if exactly one does; the most fully specified records
+    found the classes.
+    """
+    sigs = [stereo_signature(s) for s in smiles]
+    keys = [""] * len(sigs)
+    by_skeleton = {}
+    for i, sig in enumerate(sigs):
+        if sig is not None:
+            by_skeleton.setdefault(sig[0], []).append(i)
+
+    for skeleton, idx in by_skeleton.items():
+        classes = []   # centres known so far per class
+        for i in sorted(idx, key=lambda i: -sum(m is not None for m in sigs[i][1])):
+            marks = sigs[i][1]
+            fits = [(c, o) for c, o in enumerate(_oriented(marks, known) for known in classes)
+                    if o is not None]
+            if len(fits) == 1:
+                c, oriented = fits[0]
+                classes[c] = tuple(k if k is not None else o for k, o in zip(classes[c], oriented))
+            else:
+                # No class, or several (too few centres to tell which): its own
+                c = len(classes)
+                classes.append(marks)
+            keys[i] = skeleton if c == 0 else f"{skeleton}#{c}"
+    return keys
+
+def build_groups(table: pd.DataFrame, smiles_col: str = None) -> pd.DataFrame:
+    """
+    Group drugs that share a parent name or a structure key (union-find),
+    so e.g. (+)-terbutaline, terbutaline and terbutaline sulfate become one.
+    The parent (display name; group_aliases gives the names searched) is
+    chosen by choose_parent. `table` has a "drug" column and optionally SMILES.
+    """
+    if smiles_col is None:
+        smiles_col = next((c for c in table.columns if c.lower() == "smiles"), None)
+    drugs = table["drug"].astype(str).tolist()
+    smiles = table[smiles_col].tolist() if smiles_col else [None] * len(drugs)
+
+    name_keys = [parent_name(d) for d in drugs]
+    struct_keys = structure_keys(smiles)
+
+    parent_of = list(range(len(drugs)))
+
+    def find(i):
+        while parent_of[i] != i:
+            parent_of[i] = parent_of[parent_of[i]]
+            i = parent_of[i]
+        return i
+
+    first = {}
+    for i, keys in enumerate(zip(name_keys, struct_keys)):
+        for kind, key in zip(("name", "struct"), keys):
+            if not key:
+                continue
+            j = first.setdefault((kind, key), i)
+            if j != i:
+                parent_of[find(i)] = find(j)
+
+    members = {}
+    for i in range(len(drugs)):
+        members.setdefault(find(i), []).append(i)
+    parent = [None] * len(drugs)
+    frequency = name_frequency(k for k in name_keys if k)
+    for idx in members.values():
+        name = choose_parent((name_keys[i] or drugs[i] for i in idx), frequency)
+        for i in idx:
+            parent[i] = name
+
+    return pd.DataFrame({
+        "drug": drugs, "parent": parent,
+        "name_key": name_keys, "structure_key": struct_keys,
+        "version": GROUPING_VERSION
+    }, columns=GROUP_COLUMNS)
+
+def group_aliases(groups: pd.DataFrame) -> dict:
+    """
+    {parent: other names to search}: every member's display and parent
+    name, so one pull covers the literature of the whole group (ChEMBL
+    synonyms of each are added when synonym search is on). Database IDs
+    and CAS numbers are left out.
+    """
+    aliases = {}
+    for parent, drug, key in zip(groups["parent"], groups["drug"], groups["name_key"]):
+        names = aliases.setdefault(parent, {})
+        for name in (key, drug):
+            name = str(name).strip()
+            if name and not IDENTIFIER.match(name.lower()) and name_key(name) != name_key(parent):
+                names.setdefault(name_key(name), name)
+    # Common names first, IUPAC-style last (they rarely appear verbatim)
+    return {
+        parent: sorted(names.values(), key=lambda n: (is_systematic(n), n))
+        for parent, names in aliases.items() if names
+    }
+
+def load_groups(table: pd.DataFrame, path: str = CANON_GROUPS_PATH) -> pd.DataFrame:
+    """
+    The persisted grouping table, rebuilt only when it doesn't cover
+    every drug in `table`.
+    """
+    if os.path.exists(path):
+        groups = pd.read_csv(path, keep_default_na=False, dtype=str)
+        if (set(GROUP_COLUMNS) <= set(groups.columns) and set(table["drug"]) <= set(groups["drug"])
+                and (groups["version"] == GROUPING_VERSION).all()):
+            return groups[groups["drug"].isin(set(table["drug"]))].reset_index(drop=True)
+
+    groups = build_groups(table)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    groups.to_csv(path, index=False, encoding="utf-8")
+    return groups
+
+def fan_out(df_parents: pd.DataFrame, groups: pd.DataFrame) -> pd.DataFrame:
+    """
+    Copy per-parent rows (keyed by "drug") to every member drug,
+    keeping the parent in a "parent" column and the input row order.
+    """
+    df = df_parents.rename(columns={"drug": "parent"})
+    df["_order"] = range(len(df))
+    out = groups[["drug", "parent"]].merge(df, on="parent", how="inner")
+    out = out.sort_values(["_order", "drug"], kind="stable").drop(columns="_order")
+    cols = ["drug"] + [c for c in df_parents.columns if c != "drug"] + ["parent"]
+    return out[cols].reset_index(drop=True)
@@ -0,0 +1,207 @@
+# phase3/phase3_classifier.py
+import os
+import random
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+import joblib
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import train_test_split
+from sklearn.metrics import classification_report
+
+try:
+    from .config import (
+        OUT_DIR, CLASSIFIER_PATH, CLASSIFIER_N_FEATURES,
+        CLASSIFIER_THRESHOLD, CLASSIFIER_NEGATIVE_RATIO
+    )
+    from .phase3_extract import EXTRACTOR_FINGERPRINT, scan_paper, passes_gates, evidence_row
+    from .phase3_cache import paper_key
+except ImportError:
+    from config import (
+        OUT_DIR, CLASSIFIER_PATH, CLASSIFIER_N_FEATURES,
+        CLASSIFIER_THRESHOLD, CLASSIFIER_NEGATIVE_RATIO
+    )
+    from phase3_extract import EXTRACTOR_FINGERPRINT, scan_paper, passes_gates, evidence_row
+    from phase3_cache import paper_key
+
+def make_vectorizer(n_features: int = CLASSIFIER_N_FEATURES) -> HashingVectorizer:
+    # Stateless: nothing to fit, and new vocabulary needs no refit
+    return HashingVectorizer(
+        n_features=n_features, ngram_range=(1, 2), alternate_sign=False,
+        norm="l2", dtype=np.float32
+    )
+
+def paper_text(paper: dict) -> str:
+    return f"{paper.get('title', '') or ''}\n{paper.get('abstractText', '') or ''}"
+
+# ----------------------------------
+# Training data
+# ----------------------------------
+def load_labels(path: str, store, negative_ratio: float = CLASSIFIER_NEGATIVE_RATIO, seed: int = 42):
+    """
+    Training rows from a phase3_papers.csv-style file: (texts, relevant, directions).
+    Every row is relevant unless a "relevant" column (0/1) says otherwise;
+    its "direction" is the direction label. Texts are built from the cached
+    paper records as inference builds them (paper_text); rows not in the
+    cache fall back to their (truncated) title/abstract columns. Irrelevant
+    examples are added from cached papers that are not in the file and
+    fail the keyword gates, so without relevant=0 rows the relevance model
+    only learns to approximate the gates.
+    """
+    df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    keys = [pmid or doi for pmid, doi in zip(df["pmid"], df["doi"])]
+    cached = store.get_papers(keys)
+    texts = [
+        paper_text(cached[k]) if k in cached else f"{title}\n{abstract}"
+        for k, title, abstract in zip(keys, df["title"], df["abstract"])
+    ]
+    missing = sum(k not in cached for k in keys)
+    if missing:
+        print(f" {missing} labelled papers not in the paper cache: using their CSV title/abstract")
+    if "relevant" in df.columns:
+        relevant = [int(float(v)) if v.strip() else 1 for v in df["relevant"]]
+    else:
+        relevant = [1] * len(df)
+    if 0 not in relevant:
+        print(" No relevant=0 rows: the relevance model will approximate the keyword gates")
+    directions = [d if r else "" for d, r in zip(df["direction"], relevant)]
+
+    labelled = set(df["pmid"]) | set(df["doi"])
+    pool = [
+        p for p in store.iter_papers()
+        if paper_key(p) not in labelled and not passes_gates(*scan_paper(p))
+    ]
+    random.Random(seed).shuffle(pool)
+    negatives = pool[:int(negative_ratio * len(df))]
+
+    texts += [paper_text(p) for p in negatives]
+    relevant += [0] * len(negatives)
+    directions += [""] * len(negatives)
+    return texts, np.array(relevant), np.array(directions)
+
+def fit_logistic(X, y):
+    return LogisticRegression(max_iter=1000, class_weight="balanced").fit(X, y)
+
+def train(labels_path: str, store, out_path: str = CLASSIFIER_PATH,
+          n_features: int = CLASSIFIER_N_FEATURES, seed: int = 42) -> dict:
+    """
+    Fit the relevance and direction models, report held-out scores (20%)
+    and save both, refit on all rows, with joblib.
+    """
+    texts, relevant, directions = load_labels(labels_path, store, seed=seed)
+    if len(set(relevant)) < 2:
+        raise ValueError("need relevant and irrelevant examples (is the paper cache empty?)")
+    print(f" Training on {len(texts)} papers ({int(relevant.sum())} relevant)")
+
+    X = make_vectorizer(n_features).transform(texts)
+    idx_train, idx_test = train_test_split(
+        np.arange(len(texts)), test_size=0.2, random_state=seed, stratify=relevant
+    )
+    held_out = fit_logistic(X[idx_train], relevant[idx_train]).predict(X[idx_test])
+    print("\nRelevance (held out):")
+    print(classification_report(relevant[idx_test], held_out))
+
+    rel = relevant == 1
+    direction_model = None
+    if len(set(directions[rel])) > 1:
+        d_train = idx_train[rel[idx_train]]
+        d_test = idx_test[rel[idx_test]]
+        held_out = fit_logistic(X[d_train], directions[d_train]).predict(X[d_test])
+        print("Direction (held out):")
+        print(classification_report(directions[d_test], held_out, zero_division=0))
+        direction_model = fit_logistic(X[rel], directions[rel])
+
+    model = {
+        "n_features": n_features,
+        "relevance": fit_logistic(X, relevant),
+        "direction": direction_model,
+    }
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    joblib.dump(model, out_path)
+    print(f" Classifier saved to: {out_path}")
+    return model
+
+# ----------------------------------
+# Extractor
+# ----------------------------------
+class ClassifierExtractor:
+    """
+    Drop-in for the keyword extractor in extract_all: relevance and
+    direction come from the trained models, applied to a whole chunk of
+    abstracts as one sparse matrix; study model, hit counts and outcomes
+    are the keyword features. Rows carry the relevance probability.
+    """
+    name = "classifier"
+
+    def __init__(self, path: str = CLASSIFIER_PATH, threshold: float = CLASSIFIER_THRESHOLD):
+        if not os.path.exists(path):
+            raise FileNotFoundError(
+                f"no classifier at {path}; train one with: python -m phase3.phase3_classifier train"
+            )
+        self.path = path
+        self.threshold = threshold
+        h = hashlib.sha1(f"{EXTRACTOR_FINGERPRINT}:{threshold}:".encode("utf-8"))
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        self.fingerprint = h.hexdigest()[:16]
+        self._model = None
+
+    def __getstate__(self):
+        # Workers load the model from disk once instead of unpickling it per chunk
+        return {**self.__dict__, "_model": None}
+
+    def _load(self):
+        if self._model is None:
+            model = joblib.load(self.path)
+            self._model = (make_vectorizer(model["n_features"]), model["relevance"], model["direction"])
+        return self._model
+
+    def predict(self, papers):
+        """
+        (relevance probabilities, directions or None) for a list of papers.
+        """
+        vectorizer, relevance, direction = self._load()
+        X = vectorizer.transform([paper_text(p) for p in papers])
+        probs = relevance.predict_proba(X)[:, list(relevance.classes_).index(1)]
+        return probs, (direction.predict(X) if direction is not None else None)
+
+    def extract_chunk(self, chunk) -> list:
+        if not chunk:
+            return []
+        probs, directions = self.predict([paper for _, paper, _ in chunk])
+        rows = []
+        for i, (drug, paper, sections) in enumerate(chunk):
+            if probs[i] < self.threshold:
+                rows.append(None)
+                continue
+            found, found_sections = scan_paper(paper, sections)
+            ev = evidence_row(drug, paper, sections, found, found_sections)
+            if directions is not None:
+                ev["direction"] = str(directions[i])
+            ev["relevance"] = round(float(probs[i]), 4)
+            rows.append(ev)
+        return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Phase 3 relevance/direction classifier")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("train", help="fit on labelled phase3_papers.csv rows")
+    p.add_argument("--labels", default=os.path.join(OUT_DIR, "phase3_papers.csv"),
+                   help="CSV with title, abstract, direction (optional: relevant 0/1)")
+    p.add_argument("--out", default=CLASSIFIER_PATH)
+    p.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    try:
+        from .phase3_search import STORE
+    except ImportError:
+        from phase3_search import STORE
+
+    if args.command == "train":
+        train(args.labels, STORE, args.out, seed=args.seed)
+
+if __name__ == "__main__":
+    main()
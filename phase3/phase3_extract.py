@@ -1,9 +1,28 @@
 # phase3/phase3_extract.py
+import json
+import hashlib
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
 
 try:
-    from .config import POSITIVE_KEYWORDS, NEGATIVE_KEYWORDS, OUTCOME_KEYWORDS
+    from .config import (
+        POSITIVE_KEYWORDS, NEGATIVE_KEYWORDS, OUTCOME_KEYWORDS,
+        EXTRACT_WORKERS, EXTRACT_CHUNK_SIZE
+    )
+    from .phase3_cache import paper_key
 except ImportError:
-    from config import POSITIVE_KEYWORDS, NEGATIVE_KEYWORDS, OUTCOME_KEYWORDS
+    from config import (
+        POSITIVE_KEYWORDS, NEGATIVE_KEYWORDS, OUTCOME_KEYWORDS,
+        EXTRACT_WORKERS, EXTRACT_CHUNK_SIZE
+    )
+    from phase3_cache import paper_key
+
+# Optional: single-pass Aho-Corasick keyword scan when pyahocorasick is installed
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
 
 # Strict Alzheimer pathology terms
 AD_TERMS = [
@@ -19,6 +38,14 @@ AD_MODEL_MARKERS = [
     "y-maze", "novel object recognition"
 ]
 
+# Study-type cues, checked in this order (first match wins)
+MODEL_RULES = [
+    ("clinical", ["phase ii", "phase iii", "double-blind", "placebo"]),
+    ("human_observational", ["cohort", "case-control", "observational"]),
+    ("animal", ["mouse", "mice", "rat", "transgenic", "5xfad", "3xtg", "app/ps1"]),
+    ("cell", ["cell", "in vitro", "neuronal culture", "primary neurons"]),
+]
+
 def contains_any(text: str, terms) -> bool:
     t = (text or "").lower()
     return any(term in t for term in terms)
@@ -33,14 +60,9 @@ def has_any_outcome(text: str) -> bool:
 def detect_model(text: str) -> str:
     t = (text or "").lower()
 
-    if any(k in t for k in ["phase ii", "phase iii", "double-blind", "placebo"]):
-        return "clinical"
-    if any(k in t for k in ["cohort", "case-control", "observational"]):
-        return "human_observational"
-    if any(k in t for k in ["mouse", "mice", "rat", "transgenic", "5xfad", "3xtg", "app/ps1"]):
-        return "animal"
-    if any(k in t for k in ["cell", "in vitro", "neuronal culture", "primary neurons"]):
-        return "cell"
+    for model, cues in MODEL_RULES:
+        if any(k in t for k in cues):
+            return model
 
     return "unknown"
 
@@ -56,36 +78,163 @@ def outcome_tags(text: str):
             tags.append(outcome)
     return tags
 
-def extract_evidence(drug: str, paper: dict):
+# ----------------------------------
+# Single-pass keyword matcher
+# ----------------------------------
+class KeywordMatcher:
+    """
+    All keyword lists compiled into one deduplicated term table, so each
+    text is lower-cased once and scanned once for every list. scan()
+    returns the terms present as a bitmask and each list is a mask over
+    it, so gates, counts and unions of several texts' hits are integer
+    operations. With pyahocorasick the scan is a single Aho-Corasick pass
+    (overlapping matches included); without it, one `in` check per
+    distinct term. Both find exactly the terms `term in text.lower()` does.
+    """
+    def __init__(self, categories: dict, use_automaton: bool = True):
+        self.categories = {name: [t.lower() for t in terms] for name, terms in categories.items()}
+        self.terms = list(dict.fromkeys(t for terms in self.categories.values() for t in terms))
+        bit = {t: 1 << i for i, t in enumerate(self.terms)}
+        self._table = [(t, bit[t]) for t in self.terms]
+        self._masks = {name: sum({bit[t] for t in terms}) for name, terms in self.categories.items()}
+        # keyword_hits counts list entries, so repeated entries count twice
+        self._repeats = {
+            name: [bit[t] for i, t in enumerate(terms) if t in terms[:i]]
+            for name, terms in self.categories.items()
+        }
+
+        self._automaton = None
+        if use_automaton and ahocorasick is not None and self.terms:
+            self._automaton = ahocorasick.Automaton()
+            for t, b in self._table:
+                self._automaton.add_word(t, b)
+            self._automaton.make_automaton()
+
+    @property
+    def backend(self) -> str:
+        return "aho-corasick" if self._automaton is not None else "substring"
+
+    def scan(self, text: str) -> int:
+        t = (text or "").lower()
+        found = 0
+        if self._automaton is not None:
+            for _, b in self._automaton.iter(t):
+                found |= b
+        else:
+            for term, b in self._table:
+                if term in t:
+                    found |= b
+        return found
+
+    def any(self, found: int, category: str) -> bool:
+        return bool(found & self._masks[category])
+
+    def count(self, found: int, category: str) -> int:
+        # Same as keyword_hits: one per list entry present
+        n = bin(found & self._masks[category]).count("1")
+        return n + sum(1 for b in self._repeats[category] if found & b)
+
+    def hits(self, text: str) -> dict:
+        """
+        {category: hit count} for every category, from a single scan.
+        """
+        found = self.scan(text)
+        return {name: self.count(found, name) for name in self.categories}
+
+MATCH_CATEGORIES = {
+    "ad": AD_TERMS,
+    "model_markers": AD_MODEL_MARKERS,
+    "positive": POSITIVE_KEYWORDS,
+    "negative": NEGATIVE_KEYWORDS,
+    **{f"outcome:{name}": kws for name, kws in OUTCOME_KEYWORDS.items()},
+    **{f"model:{name}": cues for name, cues in MODEL_RULES},
+}
+
+# Hard gates in the order extract_evidence applies them
+GATES = [["ad"], ["model_markers"], [f"outcome:{name}" for name in OUTCOME_KEYWORDS]]
+
+MATCHER = KeywordMatcher(MATCH_CATEGORIES)
+
+def model_from_hits(matcher: KeywordMatcher, found) -> str:
+    for model, _ in MODEL_RULES:
+        if matcher.any(found, f"model:{model}"):
+            return model
+    return "unknown"
+
+def outcome_from_hits(matcher: KeywordMatcher, found) -> list:
+    return [name for name in OUTCOME_KEYWORDS if matcher.any(found, f"outcome:{name}")]
+
+# Full-text sections whose wording counts towards direction/outcomes
+# (introductions and discussions mostly describe other work)
+FINDING_SECTIONS = {"results", "conclusions"}
+
+def extract_evidence(drug: str, paper: dict, sections=None, matcher: KeywordMatcher = None):
     """
     Extracts AD-relevant evidence from a single paper.
     Returns None if paper fails strict AD + model + outcome gates.
-    """
 
-    title = paper.get("title", "") or ""
-    abstract = paper.get("abstractText", "") or ""
-    text = f"{title}\n{abstract}"
+    sections: optional full text [(kind, text), ...] from phase3_fulltext.
+    Each gate then passes if the abstract or any one section passes it;
+    model detection also reads Methods, and direction/outcomes also
+    read Results/Conclusions.
+    Each text is scanned once by `matcher` (default: MATCHER) for every
+    keyword list.
+    """
+    matcher = MATCHER if matcher is None else matcher
+    found, found_sections = scan_paper(paper, sections, matcher)
 
     # -------------------------------
     # HARD SCIENTIFIC GATES
     # -------------------------------
-    if not contains_any(text, AD_TERMS):
+    if not passes_gates(found, found_sections, matcher):
         return None
 
-    if not contains_any(text, AD_MODEL_MARKERS):
-        return None
+    return evidence_row(drug, paper, sections, found, found_sections, matcher)
 
-    if not has_any_outcome(text):
-        return None
+def scan_paper(paper: dict, sections=None, matcher: KeywordMatcher = None):
+    """
+    Keyword hits of title + abstract and of each full-text section:
+    (found, [(kind, found), ...]).
+    """
+    matcher = MATCHER if matcher is None else matcher
+    title = paper.get("title", "") or ""
+    abstract = paper.get("abstractText", "") or ""
+    found = matcher.scan(f"{title}\n{abstract}")
+    return found, [(k, matcher.scan(t)) for k, t in (sections or [])]
+
+def passes_gates(found: int, found_sections, matcher: KeywordMatcher = None) -> bool:
+    # Each gate passes if the abstract or any one section passes it
+    matcher = MATCHER if matcher is None else matcher
+    scans = [found] + [f for _, f in found_sections]
+    return all(any(matcher.any(f, c) for f in scans for c in gate) for gate in GATES)
+
+def evidence_row(drug: str, paper: dict, sections, found: int, found_sections,
+                 matcher: KeywordMatcher = None) -> dict:
+    """
+    The evidence row (scoring features) of a paper that passed the gates.
+    """
+    matcher = MATCHER if matcher is None else matcher
+    title = paper.get("title", "") or ""
+    abstract = paper.get("abstractText", "") or ""
 
     # -------------------------------
     # Scoring features
     # -------------------------------
-    pos = keyword_hits(text, POSITIVE_KEYWORDS)
-    neg = keyword_hits(text, NEGATIVE_KEYWORDS)
+    # No keyword spans a newline, so hits in joined texts = union of hits
+    findings = methods = 0
+    for k, f in found_sections:
+        if k in FINDING_SECTIONS:
+            findings |= f
+        if k == "methods":
+            methods |= f
+    findings |= found
+    pos = matcher.count(findings, "positive")
+    neg = matcher.count(findings, "negative")
 
-    model = detect_model(text)
-    outcomes = outcome_tags(text)
+    model = model_from_hits(matcher, found)
+    if model == "unknown" and sections:
+        model = model_from_hits(matcher, methods)
+    outcomes = outcome_from_hits(matcher, findings)
 
     direction = "neutral"
     if pos > neg and pos > 0:
@@ -93,7 +242,7 @@ def extract_evidence(drug: str, paper: dict):
     elif neg > pos and neg > 0:
         direction = "negative"
 
-    return {
+    ev = {
         "drug": drug,
         "title": title,
         "pmid": paper.get("pmid"),
@@ -107,3 +256,142 @@ def extract_evidence(drug: str, paper: dict):
         "outcomes": ";".join(outcomes),
         "abstract": abstract[:8000],
     }
+    if sections is not None:
+        ev["text_source"] = "fulltext" if sections else "abstract"
+    return ev
+
+# ----------------------------------
+# Memo keys
+# ----------------------------------
+# Bump when extract_evidence's logic changes in a way the keyword lists don't show
+EXTRACTOR_VERSION = 1
+
+# Paper fields extract_evidence reads
+MEMO_FIELDS = ["pmid", "doi", "title", "abstractText", "journalTitle", "pubYear"]
+
+def extractor_fingerprint() -> str:
+    """
+    Hash of everything that decides extract_evidence's output besides the
+    paper: keyword lists, gates, model rules and finding sections.
+    """
+    spec = {
+        "version": EXTRACTOR_VERSION,
+        "categories": MATCH_CATEGORIES,
+        "gates": GATES,
+        "model_rules": MODEL_RULES,
+        "outcome_order": list(OUTCOME_KEYWORDS),
+        "finding_sections": sorted(FINDING_SECTIONS),
+    }
+    raw = json.dumps(spec, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+EXTRACTOR_FINGERPRINT = extractor_fingerprint()
+
+def memo_key(paper: dict, sections=None, fingerprint: str = None) -> str:
+    """
+    Memo key for a paper's extraction: its ID, content (and full-text
+    sections) and the extractor fingerprint. The drug only labels the row,
+    so a paper found for several drugs is extracted once.
+    """
+    fingerprint = EXTRACTOR_FINGERPRINT if fingerprint is None else fingerprint
+    raw = json.dumps(
+        [fingerprint, paper_key(paper), [paper.get(f) for f in MEMO_FIELDS], sections],
+        ensure_ascii=False, default=str
+    )
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+# ----------------------------------
+# Batch extraction
+# ----------------------------------
+def extract_chunk(chunk) -> list:
+    """
+    extract_evidence for each (drug, paper, sections) triple, in order
+    (None where the paper fails the gates).
+    """
+    return [extract_evidence(drug, paper, sections) for drug, paper, sections in chunk]
+
+class KeywordExtractor:
+    """
+    The keyword gates and features (extract_evidence). Extractors give
+    extract_all a memo fingerprint and a picklable extract_chunk.
+    """
+    name = "keyword"
+
+    @property
+    def fingerprint(self) -> str:
+        return EXTRACTOR_FINGERPRINT
+
+    def extract_chunk(self, chunk) -> list:
+        return extract_chunk(chunk)
+
+KEYWORD_EXTRACTOR = KeywordExtractor()
+
+def iter_chunks(items, size: int):
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, max(size, 1)))
+        if not chunk:
+            return
+        yield chunk
+
+def extract_all(triples, workers: int = EXTRACT_WORKERS, chunk_size: int = EXTRACT_CHUNK_SIZE,
+                store=None, stats: dict = None, extractor=None):
+    """
+    Yield evidence rows for (drug, paper, sections) triples in input order.
+
+    With a CacheStore, results are memoized by memo_key: only papers whose
+    content or extractor config changed since the last run are extracted.
+    With workers > 1, chunks are extracted on a process pool (at most 2
+    chunks per worker in flight) and yielded in submission order, so the
+    output matches a serial run exactly. `stats` counts reused/extracted.
+    `extractor` defaults to the keyword extractor.
+    """
+    extractor = KEYWORD_EXTRACTOR if extractor is None else extractor
+    stats = {} if stats is None else stats
+    stats.setdefault("reused", 0)
+    stats.setdefault("extracted", 0)
+
+    def submit(pool, chunk):
+        keys = [
+            memo_key(paper, sections, extractor.fingerprint) for _, paper, sections in chunk
+        ] if store is not None else []
+        cached = store.get_evidence(keys) if keys else {}
+        todo = [t for i, t in enumerate(chunk) if not keys or keys[i] not in cached]
+        if pool is None:
+            result = Future()
+            result.set_result(extractor.extract_chunk(todo))
+        else:
+            result = pool.submit(extractor.extract_chunk, todo)
+        return chunk, keys, cached, result
+
+    def finish(chunk, keys, cached, result):
+        fresh = iter(result.result())
+        new = {}
+        for i, (drug, _, _) in enumerate(chunk):
+            if keys and keys[i] in cached:
+                stored = cached[keys[i]]
+                ev = None if stored is None else {"drug": drug, **stored}
+                stats["reused"] += 1
+            else:
+                ev = next(fresh)
+                if keys:
+                    new[keys[i]] = None if ev is None else {k: v for k, v in ev.items() if k != "drug"}
+                stats["extracted"] += 1
+            if ev is not None:
+                yield ev
+        if new:
+            store.put_evidence(new)
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    depth = 2 * workers if pool is not None else 1
+    try:
+        pending = deque()
+        for chunk in iter_chunks(triples, chunk_size):
+            pending.append(submit(pool, chunk))
+            if len(pending) >= depth:
+                yield from finish(*pending.popleft())
+        while pending:
+            yield from finish(*pending.popleft())
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
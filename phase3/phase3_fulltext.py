@@ -0,0 +1,136 @@
+# phase3/phase3_fulltext.py
+import re
+import requests
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from .config import EUROPE_PMC_BASE_URL, EPMC_FULLTEXT_WORKERS, FULLTEXT_MAX_SECTION_CHARS
+    from .phase3_http import get, EPMCError
+    from .phase3_search import STORE
+except ImportError:
+    from config import EUROPE_PMC_BASE_URL, EPMC_FULLTEXT_WORKERS, FULLTEXT_MAX_SECTION_CHARS
+    from phase3_http import get, EPMCError
+    from phase3_search import STORE
+
+# sec-type attribute / title keyword -> section kind (first match wins)
+SECTION_KINDS = [
+    ("methods", ("method", "materials", "experimental", "procedure")),
+    ("results", ("result", "finding")),
+    ("discussion", ("discussion",)),
+    ("conclusions", ("conclusion", "summary")),
+    ("intro", ("intro", "background")),
+]
+
+def fulltext_url(pmcid: str) -> str:
+    return f"{EUROPE_PMC_BASE_URL}/{pmcid}/fullTextXML"
+
+def fulltext_params() -> dict:
+    # Cache key: changing the stored text cap re-parses
+    return {"fullTextXML": True, "max_section_chars": FULLTEXT_MAX_SECTION_CHARS}
+
+def local_tag(tag) -> str:
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else ""
+
+def section_kind(sec_type: str, title: str) -> str:
+    for source in ((sec_type or "").lower(), (title or "").lower()):
+        for kind, words in SECTION_KINDS:
+            if any(w in source for w in words):
+                return kind
+    return "other"
+
+def element_text(elem) -> str:
+    text = re.sub(r"\s+", " ", " ".join(elem.itertext())).strip()
+    return text[:FULLTEXT_MAX_SECTION_CHARS]
+
+def iter_sections(source):
+    """
+    Stream (kind, text) for each top-level <body> section of a JATS
+    article with iterparse. Every section is dropped from the tree once
+    read, and front/back matter (references, etc.) is discarded unread,
+    so memory is bounded by the largest single section.
+    """
+    stack = []
+    body_depth = 0   # > 0 while inside <body>
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        tag = local_tag(elem.tag)
+        if event == "start":
+            stack.append(elem)
+            body_depth += body_depth > 0 or tag == "body"
+            continue
+        stack.pop()
+        body_depth -= body_depth > 0
+        parent = stack[-1] if stack else None
+        if parent is None:
+            continue
+
+        if body_depth == 1:
+            # A direct child of <body>: emit it, then drop it
+            if tag == "sec":
+                title = elem.find("title")
+                kind = section_kind(elem.get("sec-type"), title.text if title is not None else "")
+            else:
+                kind = "other"
+            text = element_text(elem)
+            if text:
+                yield kind, text
+            parent.remove(elem)
+        elif body_depth == 0:
+            # Front/back matter is never needed: drop each element as it ends
+            parent.remove(elem)
+
+def fetch_sections(paper: dict):
+    """
+    Full-text sections [(kind, text), ...] for an open-access paper,
+    from the cache or parsed from fullTextXML as it streams in.
+    [] if the paper has no PMC full text; None if the fetch failed
+    (recent failures are not retried until the negative cache expires).
+    """
+    pmcid = paper.get("pmcid")
+    if not pmcid or paper.get("isOpenAccess", "Y") != "Y":
+        return []
+
+    key, params = f"fulltext:{pmcid}", fulltext_params()
+    cached = STORE.get(key, params)
+    if cached is not None:
+        return [tuple(s) for s in cached["sections"]]
+    if STORE.get_failure(key, params) is not None:
+        return None
+
+    try:
+        r = get(fulltext_url(pmcid), stream=True)
+        try:
+            r.raw.decode_content = True
+            sections = list(iter_sections(r.raw))
+        finally:
+            r.close()
+    except EPMCError as e:
+        if e.status == 404:
+            sections = []
+        else:
+            STORE.put_failure(key, params, e)
+            return None
+    except (ET.ParseError, requests.RequestException) as e:
+        # Truncated or malformed stream: retry once the failure expires
+        STORE.put_failure(key, params, f"full text unreadable: {e}")
+        return None
+
+    STORE.put(key, params, {"sections": [list(s) for s in sections]})
+    return sections
+
+def with_sections(items, workers: int = EPMC_FULLTEXT_WORKERS):
+    """
+    For (key, paper) pairs yield (key, paper, sections) in input order,
+    fetching full text on a thread pool a bounded window at a time
+    (never all papers at once). Failed fetches give [] (abstract only).
+    """
+    items = iter(items)
+    window = max(workers, 1) * 4
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        while True:
+            chunk = [item for _, item in zip(range(window), items)]
+            if not chunk:
+                return
+            sections = pool.map(fetch_sections, [paper for _, paper in chunk])
+            for (key, paper), secs in zip(chunk, sections):
+                yield key, paper, [] if secs is None else secs
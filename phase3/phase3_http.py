@@ -0,0 +1,210 @@
+# phase3/phase3_http.py
+import time
+import random
+import threading
+import email.utils
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    from .config import (
+        EPMC_MAX_IN_FLIGHT, EPMC_REQUESTS_PER_SECOND, EPMC_TIMEOUT,
+        EPMC_MAX_RETRIES, EPMC_BACKOFF_BASE, EPMC_BACKOFF_MAX,
+        EPMC_BREAKER_THRESHOLD, EPMC_BREAKER_COOLDOWN
+    )
+except ImportError:
+    from config import (
+        EPMC_MAX_IN_FLIGHT, EPMC_REQUESTS_PER_SECOND, EPMC_TIMEOUT,
+        EPMC_MAX_RETRIES, EPMC_BACKOFF_BASE, EPMC_BACKOFF_MAX,
+        EPMC_BREAKER_THRESHOLD, EPMC_BREAKER_COOLDOWN
+    )
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# Transport failures worth retrying (dropped, truncated or garbled transfers);
+# any other requests exception (bad URL, redirect loop, ...) fails at once
+RETRY_ERRORS = (
+    requests.ConnectionError, requests.Timeout,
+    requests.exceptions.ChunkedEncodingError, requests.exceptions.ContentDecodingError,
+)
+
+class EPMCError(Exception):
+    """
+    A Europe PMC request that failed after all retries.
+    `status` is the HTTP status for non-retryable errors (e.g. 404).
+    """
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+    Refills at `rate` tokens/second up to `capacity`; acquire() blocks
+    until a token is available, so all workers share one RPS ceiling.
+    """
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(capacity))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures; while open, every
+    worker waits in wait() for `cooldown` seconds, pausing the whole batch.
+    The next request after the pause is a probe: success closes the
+    breaker, another failure re-opens it.
+    """
+    def __init__(self, threshold: int = EPMC_BREAKER_THRESHOLD,
+                 cooldown: float = EPMC_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self._lock:
+                remaining = self._open_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def pause(self, seconds: float):
+        """
+        Hold all workers for `seconds` (e.g. a server-sent Retry-After).
+        """
+        with self._lock:
+            self._open_until = max(self._open_until, time.monotonic() + seconds)
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.threshold:
+                self._open_until = time.monotonic() + self.cooldown
+                self._failures = 0
+                tripped = True
+            else:
+                tripped = False
+        if tripped:
+            print(f" Europe PMC looks degraded; pausing requests for {self.cooldown:.0f}s")
+
+def make_session(pool_size: int = EPMC_MAX_IN_FLIGHT) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(pool_size, 10))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def retry_after_seconds(value):
+    """
+    Parse a Retry-After header (delta-seconds or HTTP-date).
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(when.timestamp() - time.time(), 0.0)
+
+def backoff_delay(attempt: int) -> float:
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(EPMC_BACKOFF_MAX, EPMC_BACKOFF_BASE * 2 ** attempt))
+
+class CallCounter:
+    """
+    Thread-safe count of HTTP requests sent (retries included),
+    for API-call budgets.
+    """
+    def __init__(self):
+        self._n = 0
+        self._lock = threading.Lock()
+
+    def add(self, n: int = 1):
+        with self._lock:
+            self._n += n
+
+    @property
+    def value(self) -> int:
+        return self._n
+
+# Shared by every phase 3 request in this process
+SESSION = make_session()
+RATE_LIMITER = TokenBucket(EPMC_REQUESTS_PER_SECOND)
+BREAKER = CircuitBreaker()
+CALLS = CallCounter()
+
+def get(url: str, params: dict = None, stream: bool = False) -> requests.Response:
+    """
+    Rate-limited GET on the pooled session.
+    Retries transport errors (RETRY_ERRORS), 429 and 5xx up to
+    EPMC_MAX_RETRIES times, sleeping for Retry-After when the server sends
+    one and for a jittered exponential backoff otherwise. Every failure,
+    including other requests exceptions, surfaces as EPMCError, so callers
+    can record it per drug.
+    """
+    last_error = None
+    for attempt in range(EPMC_MAX_RETRIES + 1):
+        BREAKER.wait()
+        RATE_LIMITER.acquire()
+        CALLS.add()
+        try:
+            r = SESSION.get(url, params=params, timeout=EPMC_TIMEOUT, stream=stream)
+        except RETRY_ERRORS as e:
+            last_error = e
+            BREAKER.failure()
+            time.sleep(backoff_delay(attempt))
+            continue
+        except requests.RequestException as e:
+            raise EPMCError(f"request failed for {url}: {e}")
+
+        if r.status_code in RETRY_STATUS:
+            last_error = EPMCError(f"HTTP {r.status_code}")
+            BREAKER.failure()
+            delay = retry_after_seconds(r.headers.get("Retry-After"))
+            r.close()
+            if delay is not None:
+                BREAKER.pause(delay)
+            else:
+                time.sleep(backoff_delay(attempt))
+            continue
+
+        if r.status_code >= 400:
+            r.close()
+            raise EPMCError(f"HTTP {r.status_code} for {url}", status=r.status_code)
+
+        BREAKER.success()
+        return r
+
+    raise EPMCError(f"giving up after {EPMC_MAX_RETRIES + 1} attempts: {last_error}")
+
+def get_json(url: str, params: dict = None) -> dict:
+    r = get(url, params)
+    try:
+        return r.json()
+    except ValueError as e:
+        raise EPMCError(f"invalid JSON from {url}: {e}")
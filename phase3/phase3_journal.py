@@ -0,0 +1,212 @@
+# phase3/phase3_journal.py
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import pandas as pd
+from contextlib import contextmanager
+
+try:
+    from .config import RUN_JOURNAL_PATH, STREAM_CHUNK_ROWS
+except ImportError:
+    from config import RUN_JOURNAL_PATH, STREAM_CHUNK_ROWS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id      INTEGER PRIMARY KEY AUTOINCREMENT,
+    signature   TEXT NOT NULL,
+    started_at  REAL NOT NULL,
+    finished_at REAL,
+    offset      INTEGER NOT NULL DEFAULT 0,
+    n_rows      INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS run_drugs (
+    run_id     INTEGER NOT NULL,
+    drug       TEXT NOT NULL,
+    stage      INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (run_id, drug)
+);
+"""
+
+# Per-drug stages, in order
+FETCHED, EXTRACTED, AGGREGATED = 1, 2, 3
+
+@contextmanager
+def atomic_path(path: str):
+    """
+    Write to "<path>.tmp" and move it over `path` only once the block
+    succeeds, so readers never see a half-written file.
+    """
+    tmp = f"{path}.tmp"
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def run_signature(**options) -> str:
+    # Options a resumed run must share with the one it continues
+    raw = json.dumps(options, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+class RunJournal:
+    """
+    SQLite journal of --stream runs:
+    - one row per run, with the committed byte length (offset) and row
+      count of its partial papers CSV
+    - each drug's furthest stage (fetched / extracted / aggregated)
+    A drug is marked extracted in the same transaction that moves the
+    offset past its rows, so after a crash the CSV is cut back to the
+    offset and exactly the unmarked drugs are redone.
+    """
+    def __init__(self, path: str = RUN_JOURNAL_PATH):
+        self.path = path
+        self._db = None
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=FULL")
+            self._db.executescript(SCHEMA)
+        return self._db
+
+    def start(self, signature: str) -> int:
+        cur = self._conn().execute(
+            "INSERT INTO runs (signature, started_at) VALUES (?, ?)", (signature, time.time())
+        )
+        return cur.lastrowid
+
+    def last_unfinished(self, signature: str):
+        """
+        run_id of the latest run with this signature that never finished,
+        or None. (Shards sharing a journal differ in signature.)
+        """
+        row = self._conn().execute(
+            "SELECT run_id FROM runs WHERE signature = ? AND finished_at IS NULL "
+            "ORDER BY run_id DESC LIMIT 1", (signature,)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def progress(self, run_id: int):
+        """
+        (offset, n_rows) committed for the run's papers CSV.
+        """
+        return self._conn().execute(
+            "SELECT offset, n_rows FROM runs WHERE run_id = ?", (run_id,)
+        ).fetchone()
+
+    def stages(self, run_id: int) -> dict:
+        return dict(self._conn().execute(
+            "SELECT drug, stage FROM run_drugs WHERE run_id = ?", (run_id,)
+        ).fetchall())
+
+    def mark(self, run_id: int, drugs, stage: int, offset: int = None, n_rows: int = None):
+        """
+        Raise `drugs` to `stage` (never lowers one) and, if given, move the
+        committed CSV offset, all in one transaction.
+        """
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT INTO run_drugs (run_id, drug, stage, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (run_id, drug) DO UPDATE SET "
+            "stage = MAX(stage, excluded.stage), updated_at = excluded.updated_at",
+            [(run_id, d, stage, now) for d in drugs]
+        )
+        if offset is not None:
+            conn.execute(
+                "UPDATE runs SET offset = ?, n_rows = ? WHERE run_id = ?", (offset, n_rows, run_id)
+            )
+        conn.execute("COMMIT")
+
+    def finish(self, run_id: int, drugs):
+        self.mark(run_id, drugs, AGGREGATED)
+        self._conn().execute(
+            "UPDATE runs SET finished_at = ? WHERE run_id = ?", (time.time(), run_id)
+        )
+
+    def fetched(self, run_id: int, fetched, every: int = 64):
+        """
+        Pass (drug, papers) through, marking drugs fetched `every` drugs
+        at a time (informational: fetched papers are already in the cache).
+        """
+        batch = []
+        for drug, papers in fetched:
+            batch.append(drug)
+            if len(batch) >= every:
+                self.mark(run_id, batch, FETCHED)
+                batch = []
+            yield drug, papers
+        self.mark(run_id, batch, FETCHED)
+
+def resume_run(journal: RunJournal, signature: str, path: str):
+    """
+    The latest unfinished run with the same options, if its partial CSV
+    at `path` still holds every committed byte; else None.
+    """
+    run_id = journal.last_unfinished(signature)
+    if run_id is None:
+        return None
+    offset, _ = journal.progress(run_id)
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    return run_id if size >= offset else None
+
+def write_journaled(rows, path: str, drugs, journal: RunJournal, run_id: int, state=None,
+                    chunk_rows: int = STREAM_CHUNK_ROWS, stats: dict = None,
+                    on_commit=None) -> int:
+    """
+    Append evidence rows (ordered by `drugs`, as extract_all yields them)
+    to the partial CSV at `path`, at drug boundaries once chunk_rows have
+    accumulated. Each append is fsynced, applied to the aggregation
+    `state` if any, and then committed to the journal together with the
+    drugs it completes; on_commit(completed drugs) runs after each commit.
+    `drugs` may grow while rows are consumed (a scheduler admitting drugs
+    as it goes). The file is first cut back to the last committed offset.
+    Returns the total rows in the file.
+    """
+    offset, n_rows = journal.progress(run_id)
+    stats = {} if stats is None else stats
+    stats.setdefault("changed", 0)
+
+    mode = "r+b" if os.path.exists(path) else "wb"
+    with open(path, mode) as f:
+        f.truncate(offset)
+        f.seek(offset)
+        done = 0
+        pending = []
+
+        def commit(upto: int):
+            nonlocal done, offset, n_rows
+            if pending:
+                f.write(pd.DataFrame(pending).to_csv(index=False, header=not offset).encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+                offset, n_rows = f.tell(), n_rows + len(pending)
+            completed = drugs[done:upto]
+            stage = EXTRACTED
+            if state is not None:
+                stats["changed"] += state.update(pending, completed)
+                stage = AGGREGATED
+            journal.mark(run_id, completed, stage, offset, n_rows)
+            pending.clear()
+            done = upto
+            if on_commit is not None:
+                on_commit(completed)
+
+        i = 0
+        for row in rows:
+            start = i
+            while drugs[i] != row["drug"]:
+                i += 1
+            # Rows of drugs before this one are all in: commit at the boundary
+            if len(pending) >= chunk_rows and i > start:
+                commit(i)
+            pending.append(row)
+        commit(len(drugs))
+    return n_rows
@@ -0,0 +1,534 @@
+# phase3/phase3_mock_epmc.py
+# Offline stand-in for the Europe PMC REST `search` and `{PMCID}/fullTextXML` endpoints.
+#
+# Modes:
+#   --synthetic N   generate N realistic-looking papers and answer queries locally
+#   --replay DIR    serve responses recorded with --record
+#   --record DIR    proxy to the real API and save every response
+#
+# Point phase 3 at it with:
+#   EPMC_BASE_URL=http://127.0.0.1:8765 python -m phase3.phase3_run_all
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from xml.sax.saxutils import escape
+
+import requests
+
+try:
+    from .config import POSITIVE_KEYWORDS, NEGATIVE_KEYWORDS, OUTCOME_KEYWORDS
+    from .phase3_extract import AD_MODEL_MARKERS
+except ImportError:
+    from config import POSITIVE_KEYWORDS, NEGATIVE_KEYWORDS, OUTCOME_KEYWORDS
+    from phase3_extract import AD_MODEL_MARKERS
+
+UPSTREAM_BASE_URL = "https://www.ebi.ac.uk/europepmc/webservices/rest"
+
+# ----------------------------------
+# Synthetic corpus
+# ----------------------------------
+JOURNALS = [
+    "J Alzheimers Dis", "Neurobiol Aging", "Sci Rep", "Mol Neurobiol",
+    "Front Aging Neurosci", "Alzheimers Dement", "Brain Res", "Neuropharmacology"
+]
+STUDY_SETUPS = [
+    "We treated {marker} mice with {drug} for {n} weeks.",
+    "Primary neurons exposed to Aβ oligomers were incubated with {drug} in vitro.",
+    "In a retrospective cohort of {n}00 patients, {drug} use was associated with dementia risk.",
+    "This phase II double-blind, placebo-controlled trial randomized {n}0 patients with mild Alzheimer's disease to {drug}.",
+    "Aged rats received {drug} before training in the morris water maze.",
+    "We screened {drug} in a cell model of tauopathy.",
+]
+CONTEXT = [
+    "Alzheimer's disease is characterized by amyloid plaque deposition and tau tangle formation.",
+    "Alzheimer's disease remains without disease-modifying therapy.",
+    "Neuroinflammation and mitochondrial dysfunction contribute to Alzheimer pathology.",
+    "Drug repurposing offers a fast route to candidate therapies for Alzheimer's disease.",
+]
+FILLER = [
+    "Statistical analysis used two-way ANOVA.",
+    "Further studies are needed to confirm these findings.",
+    "Dose-response relationships were examined.",
+    "Data are presented as mean ± SEM.",
+]
+
+def norm(x: str) -> str:
+    x = (x or "").lower()
+    x = re.sub(r"[^a-z0-9]+", " ", x)
+    return f" {x.strip()} "
+
+def _sentence(rng: random.Random, drug: str) -> str:
+    outcome = rng.choice(list(OUTCOME_KEYWORDS))
+    term = rng.choice(OUTCOME_KEYWORDS[outcome])
+    if rng.random() < 0.65:
+        verb = rng.choice(POSITIVE_KEYWORDS)
+    else:
+        verb = rng.choice(NEGATIVE_KEYWORDS)
+    return f"{drug.capitalize()} {verb} {term} levels compared with vehicle."
+
+def make_paper(rng: random.Random, idx: int, drugs) -> dict:
+    lead = drugs[0]
+    setup = rng.choice(STUDY_SETUPS).format(
+        marker=rng.choice(["APP/PS1", "5xFAD", "3xTg", "Tg2576", "P301S"]),
+        drug=lead, n=rng.randint(2, 12)
+    )
+    sentences = [rng.choice(CONTEXT), setup]
+    for d in drugs:
+        sentences += [_sentence(rng, d) for _ in range(rng.randint(1, 3))]
+    if rng.random() < 0.5:
+        sentences.append(f"Performance in the {rng.choice(AD_MODEL_MARKERS)} was assessed.")
+    sentences.append(rng.choice(FILLER))
+
+    if len(drugs) > 1:
+        title = f"Repurposed drugs for Alzheimer's disease: {', '.join(drugs)}"
+    else:
+        title = f"{lead.capitalize()} {rng.choice(POSITIVE_KEYWORDS + NEGATIVE_KEYWORDS)} " \
+                f"{rng.choice(list(OUTCOME_KEYWORDS))} pathology in Alzheimer's disease models"
+
+    year = rng.randint(1995, 2025)
+    pmid = str(10_000_000 + idx)
+    open_access = rng.random() < 0.3
+    return {
+        "id": pmid,
+        "source": "MED",
+        "pmid": pmid,
+        "pmcid": f"PMC{5_000_000 + idx}" if open_access else None,
+        "doi": f"10.5555/synthetic.{idx}",
+        "title": title,
+        "abstractText": " ".join(sentences),
+        "journalTitle": rng.choice(JOURNALS),
+        "pubYear": str(year),
+        "firstPublicationDate": f"{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "isOpenAccess": "Y" if open_access else "N",
+        "_drugs": drugs,
+    }
+
+def fulltext_xml(paper: dict, n_refs: int = 150) -> str:
+    """
+    JATS-like full text for an open-access synthetic paper. The model
+    system and most outcome sentences only appear in Methods/Results.
+    """
+    rng = random.Random(paper["pmid"])
+    drugs = paper["_drugs"]
+    lead = drugs[0]
+    marker = rng.choice(AD_MODEL_MARKERS)
+
+    def sec(sec_type, title, sentences):
+        paras = "".join(f"<p>{escape(x)}</p>" for x in sentences)
+        return f'<sec sec-type="{sec_type}"><title>{title}</title>{paras}</sec>'
+
+    intro = [rng.choice(CONTEXT) for _ in range(4)]
+    methods = [
+        f"Animals and treatment: {marker} cohorts received {lead} or vehicle for {rng.randint(2, 12)} weeks.",
+        "Behaviour was assessed in the morris water maze and novel object recognition tests.",
+    ] + [rng.choice(FILLER) for _ in range(6)]
+    results = [_sentence(rng, d) for d in drugs for _ in range(rng.randint(2, 5))]
+    discussion = [rng.choice(CONTEXT), rng.choice(FILLER)]
+    refs = "".join(
+        f'<ref id="R{i}"><mixed-citation>Author {i} et al. Study {i}. '
+        f'{rng.choice(JOURNALS)}. {rng.randint(1980, 2025)}.</mixed-citation></ref>'
+        for i in range(n_refs)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<article xmlns:xlink="http://www.w3.org/1999/xlink" article-type="research-article">'
+        f"<front><article-meta><title-group><article-title>{escape(paper['title'])}</article-title>"
+        f"</title-group><abstract><p>{escape(paper['abstractText'])}</p></abstract></article-meta></front>"
+        "<body>"
+        + sec("intro", "Introduction", intro)
+        + sec("methods", "Materials and methods", methods)
+        + sec("results", "Results", results)
+        + sec("discussion", "Discussion", discussion)
+        + f"</body><back><ref-list>{refs}</ref-list></back></article>"
+    )
+
+class SyntheticCorpus:
+    """
+    In-memory corpus with a name index for phrase queries.
+    Papers per drug follow a heavy-tailed distribution: most drugs get
+    none or a handful, a few get hundreds. ~1 KB of memory per paper.
+    """
+    def __init__(self, n_papers: int, drug_names, seed: int = 42, review_rate: float = 0.05):
+        rng = random.Random(seed)
+        names = list(drug_names)
+        rng.shuffle(names)
+        # Zipf-like popularity over drugs
+        weights = [1.0 / (rank + 1) ** 1.1 for rank in range(len(names))]
+
+        self.papers = []
+        self._phrase_ids = {}
+        for idx in range(n_papers):
+            k = rng.randint(2, 6) if rng.random() < review_rate else 1
+            drugs = list(dict.fromkeys(rng.choices(names, weights=weights, k=k)))
+            paper = make_paper(rng, idx, drugs)
+            paper["_norm"] = norm(f"{paper['title']} {paper['abstractText']}")
+            self.papers.append(paper)
+            for d in drugs:
+                self._phrase_ids.setdefault(norm(d), set()).add(idx)
+
+        self.by_pmid = {p["pmid"]: i for i, p in enumerate(self.papers)}
+        self.by_doi = {p["doi"].lower(): i for i, p in enumerate(self.papers)}
+        self.by_pmcid = {p["pmcid"]: i for i, p in enumerate(self.papers) if p["pmcid"]}
+        self._lock = threading.Lock()
+
+    def all_ids(self) -> set:
+        return set(range(len(self.papers)))
+
+    def phrase(self, text: str) -> set:
+        key = norm(text)
+        with self._lock:
+            ids = self._phrase_ids.get(key)
+        if ids is None:
+            # Drug names come from the generation index; anything else is scanned once
+            ids = {i for i, p in enumerate(self.papers) if key in p["_norm"]}
+            with self._lock:
+                self._phrase_ids[key] = ids
+        return ids
+
+    def field(self, name: str, value: str) -> set:
+        name = name.upper()
+        if name == "FIRST_PDATE":
+            m = re.match(r"\[\s*(\S+)\s+TO\s+(\S+)\s*\]", value)
+            if m is None:
+                raise QuerySyntaxError(f"bad FIRST_PDATE range {value!r}")
+            lo, hi = m.group(1), m.group(2)
+            return {i for i, p in enumerate(self.papers) if lo <= p["firstPublicationDate"] <= hi}
+        value = value.strip('"')
+        if name in ("EXT_ID", "PMID"):
+            i = self.by_pmid.get(value)
+        elif name == "DOI":
+            i = self.by_doi.get(value.lower())
+        elif name == "PMCID":
+            i = self.by_pmcid.get(value.upper())
+        elif name == "SRC":
+            return self.all_ids()
+        else:
+            return self.phrase(value)
+        return set() if i is None else {i}
+
+# ----------------------------------
+# Minimal query language: AND / OR / NOT, parentheses,
+# "phrases", words, FIELD:value and FIELD:[a TO b]
+# ----------------------------------
+TOKEN_RE = re.compile(r'\s*([A-Z_]+:\[[^\]]*\]|[A-Z_]+:"[^"]*"|"[^"]*"|\(|\)|[^\s()]+)')
+
+def tokenize(query: str):
+    return [t for t in TOKEN_RE.findall(query) if t.strip()]
+
+class QuerySyntaxError(ValueError):
+    """
+    A query the stand-in cannot parse (sent back as HTTP 400).
+    """
+
+class QueryParser:
+    def __init__(self, corpus: SyntheticCorpus, query: str):
+        self.corpus = corpus
+        self.tokens = tokenize(query)
+        self.pos = 0
+
+    def parse(self) -> set:
+        return self._or()
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _or(self) -> set:
+        ids = self._and()
+        while self._peek() == "OR":
+            self.pos += 1
+            ids = ids | self._and()
+        return ids
+
+    def _and(self) -> set:
+        ids = self._not()
+        while self._peek() not in (None, "OR", ")"):
+            if self._peek() == "AND":
+                self.pos += 1
+            ids = ids & self._not()
+        return ids
+
+    def _not(self) -> set:
+        if self._peek() == "NOT":
+            self.pos += 1
+            return self.corpus.all_ids() - self._atom()
+        return self._atom()
+
+    def _atom(self) -> set:
+        tok = self._peek()
+        if tok is None or tok == ")":
+            raise QuerySyntaxError("empty query" if not self.tokens else "unexpected end of query")
+        self.pos += 1
+        if tok == "(":
+            ids = self._or()
+            if self._peek() == ")":
+                self.pos += 1
+            return ids
+        m = re.match(r"^([A-Z_]+):(.+)$", tok)
+        if m:
+            return self.corpus.field(m.group(1), m.group(2))
+        return self.corpus.phrase(tok.strip('"'))
+
+IDLIST_FIELDS = ("id", "source", "pmid", "pmcid", "doi")
+
+def search_response(corpus: SyntheticCorpus, params: dict) -> dict:
+    query = params.get("query", "")
+    page_size = max(1, min(int(params.get("pageSize", 25)), 1000))
+    cursor = params.get("cursorMark", "*")
+    offset = 0 if cursor == "*" else int(cursor)
+
+    ids = sorted(QueryParser(corpus, query).parse())
+    page = ids[offset:offset + page_size]
+
+    if params.get("resultType") == "idlist":
+        results = [{k: corpus.papers[i][k] for k in IDLIST_FIELDS if corpus.papers[i][k]} for i in page]
+    else:
+        results = [{k: v for k, v in corpus.papers[i].items() if not k.startswith("_")} for i in page]
+
+    out = {
+        "version": "6.9",
+        "hitCount": len(ids),
+        "request": {"queryString": query, "resultType": params.get("resultType", "lite"),
+                    "cursorMark": cursor, "pageSize": page_size},
+        "resultList": {"result": results},
+    }
+    if page:
+        out["nextCursorMark"] = str(offset + len(page))
+    else:
+        out["nextCursorMark"] = cursor
+    return out
+
+# ----------------------------------
+# Record / replay
+# ----------------------------------
+def request_key(params: dict) -> str:
+    canon = {k: v for k, v in params.items() if k != "format"}
+    return hashlib.sha1(json.dumps(canon, sort_keys=True).encode("utf-8")).hexdigest()
+
+class Recorder:
+    def __init__(self, root: str, upstream: str = UPSTREAM_BASE_URL):
+        self.root = root
+        self.upstream = upstream
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, params: dict) -> str:
+        return os.path.join(self.root, f"{request_key(params)}.json")
+
+    def record(self, params: dict) -> dict:
+        r = requests.get(f"{self.upstream}/search", params={**params, "format": "json"}, timeout=60)
+        r.raise_for_status()
+        data = r.json()
+        with open(self.path(params), "w", encoding="utf-8") as f:
+            json.dump({"params": params, "response": data}, f)
+        return data
+
+    def replay(self, params: dict):
+        path = self.path(params)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)["response"]
+
+    def record_fulltext(self, pmcid: str):
+        r = requests.get(f"{self.upstream}/{pmcid}/fullTextXML", timeout=60)
+        if r.status_code == 404:
+            return None
+        r.raise_for_status()
+        with open(os.path.join(self.root, f"{pmcid}.xml"), "wb") as f:
+            f.write(r.content)
+        return r.content
+
+    def replay_fulltext(self, pmcid: str):
+        path = os.path.join(self.root, f"{pmcid}.xml")
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+# ----------------------------------
+# HTTP server
+# ----------------------------------
+class MockConfig:
+    def __init__(self, corpus=None, recorder=None, mode="synthetic",
+                 latency_ms=0.0, jitter_ms=0.0, error_429=0.0, error_5xx=0.0, retry_after=1):
+        self.corpus = corpus
+        self.recorder = recorder
+        self.mode = mode
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_429 = error_429
+        self.error_5xx = error_5xx
+        self.retry_after = retry_after
+        self.n_requests = 0
+        self._lock = threading.Lock()
+
+class MockHandler(BaseHTTPRequestHandler):
+    config: MockConfig = None
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json;charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_xml(self, body: bytes):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml;charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _fulltext(self, pmcid: str):
+        cfg = self.config
+        if cfg.mode == "synthetic":
+            i = cfg.corpus.by_pmcid.get(pmcid)
+            body = None if i is None else fulltext_xml(cfg.corpus.papers[i]).encode("utf-8")
+        elif cfg.mode == "replay":
+            body = cfg.recorder.replay_fulltext(pmcid)
+        else:
+            try:
+                body = cfg.recorder.record_fulltext(pmcid)
+            except Exception as e:
+                self._send_json(502, {"error": str(e)})
+                return
+        if body is None:
+            self._send_json(404, {"error": f"no full text for {pmcid}"})
+        else:
+            self._send_xml(body)
+
+    def _inject(self) -> bool:
+        """
+        Simulated latency and failures. Returns True if an error was sent.
+        """
+        cfg = self.config
+        with cfg._lock:
+            cfg.n_requests += 1
+        if cfg.latency_ms or cfg.jitter_ms:
+            delay = cfg.latency_ms + random.uniform(-cfg.jitter_ms, cfg.jitter_ms)
+            time.sleep(max(delay, 0.0) / 1000.0)
+        roll = random.random()
+        if roll < cfg.error_429:
+            self._send_json(429, {"error": "Too Many Requests"}, {"Retry-After": str(cfg.retry_after)})
+            return True
+        if roll < cfg.error_429 + cfg.error_5xx:
+            self._send_json(503, {"error": "Service Unavailable"})
+            return True
+        return False
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+        m = re.search(r"/(PMC\d+)/fullTextXML/?$", url.path)
+        if m:
+            if not self._inject():
+                self._fulltext(m.group(1))
+            return
+
+        if not url.path.rstrip("/").endswith("/search"):
+            self._send_json(404, {"error": f"unknown endpoint {url.path}"})
+            return
+        if self._inject():
+            return
+
+        cfg = self.config
+        if cfg.mode == "synthetic":
+            try:
+                data = search_response(cfg.corpus, params)
+            except ValueError as e:
+                # Unparseable query, pageSize or cursorMark
+                self._send_json(400, {"error": str(e)})
+                return
+            self._send_json(200, data)
+        elif cfg.mode == "replay":
+            data = cfg.recorder.replay(params)
+            if data is None:
+                self._send_json(404, {"error": "no recorded response", "key": request_key(params)})
+            else:
+                self._send_json(200, data)
+        else:
+            try:
+                self._send_json(200, cfg.recorder.record(params))
+            except Exception as e:
+                self._send_json(502, {"error": str(e)})
+
+def start_server(config: MockConfig, host: str = "127.0.0.1", port: int = 0):
+    """
+    Start the stand-in on a background thread.
+    Returns (server, base_url); call server.shutdown() to stop.
+    """
+    handler = type("BoundMockHandler", (MockHandler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+def default_drug_names(n: int):
+    """
+    Real BBB+ drug names if the Phase 2 list exists, else placeholders.
+    """
+    try:
+        try:
+            from .phase3_run_all import load_drug_list
+        except ImportError:
+            from phase3_run_all import load_drug_list
+        names = load_drug_list()
+    except (ImportError, OSError):
+        names = []
+    return names or [f"compound-{i:05d}" for i in range(n)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline Europe PMC stand-in")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--synthetic", type=int, metavar="N", help="serve a synthetic corpus of N papers")
+    mode.add_argument("--replay", metavar="DIR", help="serve responses recorded in DIR")
+    mode.add_argument("--record", metavar="DIR", help="proxy to Europe PMC and record into DIR")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--n-drugs", type=int, default=5000, help="placeholder drugs if no Phase 2 list")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-429", type=float, default=0.0, help="fraction of requests answered 429")
+    parser.add_argument("--error-5xx", type=float, default=0.0, help="fraction of requests answered 503")
+    args = parser.parse_args()
+
+    if args.synthetic is not None:
+        t0 = time.time()
+        corpus = SyntheticCorpus(args.synthetic, default_drug_names(args.n_drugs), seed=args.seed)
+        print(f" Generated {len(corpus.papers)} synthetic papers in {time.time() - t0:.1f}s")
+        config = MockConfig(corpus=corpus, mode="synthetic")
+    elif args.replay:
+        config = MockConfig(recorder=Recorder(args.replay), mode="replay")
+    else:
+        config = MockConfig(recorder=Recorder(args.record), mode="record")
+
+    config.latency_ms = args.latency_ms
+    config.jitter_ms = args.jitter_ms
+    config.error_429 = args.error_429
+    config.error_5xx = args.error_5xx
+
+    server, base_url = start_server(config, args.host, args.port)
+    print(f" Europe PMC stand-in ({config.mode}) listening on {base_url}")
+    print(f"   EPMC_BASE_URL={base_url} python -m phase3.phase3_run_all")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
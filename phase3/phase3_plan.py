@@ -0,0 +1,175 @@
+# phase3/phase3_plan.py
+import math
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+
+try:
+    from .config import (
+        EPMC_MAX_IN_FLIGHT, EPMC_PAGE_SIZE, EPMC_IDLIST_FIRST, EPMC_CORE_BATCH,
+        EPMC_REQUESTS_PER_SECOND, PLAN_TOTAL_BUDGET, PLAN_FLOOR, PLAN_CAP
+    )
+    from .phase3_search import STORE, query_params, search_page, load_state
+    from .phase3_http import EPMCError
+except ImportError:
+    from config import (
+        EPMC_MAX_IN_FLIGHT, EPMC_PAGE_SIZE, EPMC_IDLIST_FIRST, EPMC_CORE_BATCH,
+        EPMC_REQUESTS_PER_SECOND, PLAN_TOTAL_BUDGET, PLAN_FLOOR, PLAN_CAP
+    )
+    from phase3_search import STORE, query_params, search_page, load_state
+    from phase3_http import EPMCError
+
+POLICIES = ("proportional", "phase2", "capped", "uniform")
+
+def probe_params(drug: str) -> dict:
+    return {**query_params(drug), "probe": "hitCount"}
+
+def probe_hit_count(drug: str):
+    """
+    Total Europe PMC hits for a drug via minimal (1-row idlist) queries,
+    summed over its synonym queries. Reuses a hitCount already known from
+    the cache. None on API failure.
+    """
+    entry = load_state(drug)
+    if entry is not None and entry[0].get("hit_count") is not None:
+        return entry[0]["hit_count"]
+
+    cached = STORE.get(drug, probe_params(drug))
+    if cached is not None:
+        return cached["hit_count"]
+
+    qparams = query_params(drug)
+    hit_count = 0
+    for query in qparams.get("queries", [qparams["query"]]):
+        try:
+            data = search_page({
+                "query": query,
+                "resultType": "idlist",
+                "format": "json",
+                "pageSize": 1
+            })
+        except EPMCError as e:
+            print(f" Probe failed for {drug}: {e}")
+            return None
+        hit_count += int(data.get("hitCount", 0) or 0)
+
+    STORE.put(drug, probe_params(drug), {"hit_count": hit_count})
+    return hit_count
+
+def probe_all(drugs, workers: int = None) -> dict:
+    workers = EPMC_MAX_IN_FLIGHT if workers is None else workers
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        counts = list(tqdm(pool.map(probe_hit_count, drugs), total=len(drugs),
+                           desc="Probing hit counts"))
+    return dict(zip(drugs, counts))
+
+def water_fill(demand: np.ndarray, weights: np.ndarray, budget: int) -> np.ndarray:
+    """
+    Split an integer budget proportionally to weights without giving any
+    drug more than its demand; what capped drugs can't use is
+    redistributed to the rest.
+    """
+    alloc = np.zeros(len(demand), dtype=float)
+    remaining = float(budget)
+    active = (demand > 0) & (weights > 0)
+    while remaining > 1e-9 and active.any():
+        share = remaining * weights * active / weights[active].sum()
+        room = demand - alloc
+        take = np.minimum(share, room)
+        alloc += take
+        remaining -= take.sum()
+        active &= (demand - alloc) > 1e-9
+
+    # Integer papers: floor, then hand out leftovers by largest remainder
+    out = np.floor(alloc).astype(int)
+    left = int(min(round(alloc.sum()) - out.sum(), budget - out.sum()))
+    if left > 0:
+        frac = np.where(out < demand, alloc - out, -1.0)
+        for i in np.argsort(-frac, kind="stable")[:left]:
+            if frac[i] >= 0:
+                out[i] += 1
+    return out
+
+def allocate_budget(hit_counts: np.ndarray, policy: str, total_budget: int,
+                    floor: int = PLAN_FLOOR, cap: int = PLAN_CAP,
+                    priorities: np.ndarray = None) -> np.ndarray:
+    """
+    Per-drug paper budgets. Zero-hit drugs get nothing; nobody gets more
+    than min(hit_count, cap). Policies:
+    - proportional: floor each, the rest proportional to hitCount
+    - phase2:       floor each, the rest proportional to hitCount * phase2_score
+    - capped:       min(hit_count, cap) for everyone (ignores total_budget)
+    - uniform:      equal shares of the budget
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown plan policy {policy!r}; expected one of {POLICIES}")
+
+    # Failed probes (NaN) keep a floor-sized budget rather than being skipped
+    hits = np.asarray(hit_counts, dtype=float)
+    hits = np.where(np.isnan(hits), float(floor), hits)
+    demand = np.minimum(hits, cap)
+
+    if policy == "capped":
+        return demand.astype(int)
+
+    base = np.minimum(demand, floor)
+    if base.sum() >= total_budget:
+        # Budget can't even cover the floors: share it out instead
+        return water_fill(demand, (demand > 0).astype(float), total_budget)
+
+    if policy == "proportional":
+        weights = hits
+    elif policy == "phase2":
+        p = np.nan_to_num(np.asarray(priorities, dtype=float), nan=0.0)
+        weights = hits * (p + 1e-6)
+    else:
+        weights = (demand > 0).astype(float)
+
+    extra = water_fill(demand - base, weights, int(total_budget - base.sum()))
+    return (base + extra).astype(int)
+
+def estimate_calls(budget: int) -> int:
+    """
+    API calls needed to pull `budget` papers for one drug.
+    """
+    if budget <= 0:
+        return 0
+    pages = math.ceil(budget / EPMC_PAGE_SIZE)
+    if EPMC_IDLIST_FIRST:
+        return pages + math.ceil(budget / EPMC_CORE_BATCH)
+    return pages
+
+def make_plan(drugs, policy: str = "proportional", total_budget: int = PLAN_TOTAL_BUDGET,
+              priorities: dict = None, hit_counts: dict = None) -> pd.DataFrame:
+    """
+    Probe hit counts (unless given) and allocate the global paper budget.
+    Returns one row per drug: drug, hit_count, priority, budget, n_cached,
+    est_calls (calls still needed given what is already cached).
+    """
+    hit_counts = probe_all(drugs) if hit_counts is None else hit_counts
+    plan = pd.DataFrame({"drug": list(drugs)})
+    plan["hit_count"] = plan["drug"].map(hit_counts).astype(float)
+    plan["priority"] = plan["drug"].map(priorities or {}).astype(float)
+    plan["budget"] = allocate_budget(
+        plan["hit_count"].to_numpy(), policy, total_budget,
+        priorities=plan["priority"].to_numpy()
+    )
+
+    n_cached = []
+    for drug in plan["drug"]:
+        entry = load_state(drug)
+        n_cached.append(len(entry[0]["keys"]) if entry else 0)
+    plan["n_cached"] = n_cached
+    plan["est_calls"] = (plan["budget"] - plan["n_cached"]).clip(lower=0).map(estimate_calls)
+    return plan
+
+def summarize_plan(plan: pd.DataFrame) -> str:
+    n_skip = int((plan["budget"] == 0).sum())
+    calls = int(plan["est_calls"].sum())
+    minutes = calls / EPMC_REQUESTS_PER_SECOND / 60.0
+    return (
+        f"{len(plan)} drugs, {n_skip} skipped (zero hits/budget), "
+        f"{int(plan['budget'].sum())} papers, ~{calls} API calls "
+        f"(~{minutes:.1f} min at {EPMC_REQUESTS_PER_SECOND:g} req/s)"
+    )
@@ -1,32 +1,69 @@
 # phase3/phase3_run_all.py
 import os
 import sys
+import shutil
+import argparse
 import pandas as pd
 from tqdm import tqdm
 
 # Handle both direct script execution and package imports
 try:
-    from .config import BBB_CSV_PATH, OUT_DIR
-    from .phase3_search import batch_fetch
-    from .phase3_extract import extract_evidence
-    from .phase3_score import aggregate_drug_scores
+    from .config import (
+        BBB_CSV_PATH, OUT_DIR, PLAN_TOTAL_BUDGET, CANONICALIZE_DRUGS,
+        EXTRACT_WORKERS, EXTRACT_MEMO, STREAM_CHUNK_ROWS, AGG_INCREMENTAL,
+        PRIORITY_COLUMN, RUN_MAX_DRUGS, SNAPSHOT_EVERY_SECONDS
+    )
+    from .phase3_search import STORE, batch_fetch, iter_fetch, load_fetch_stats, refresh_all, failed_drugs
+    from .phase3_extract import extract_all
+    from .phase3_score import aggregate_drug_scores, aggregate_csv
+    from .phase3_plan import POLICIES, make_plan, summarize_plan
+    from .phase3_canon import load_groups, fan_out, group_aliases
+    from .phase3_synonyms import set_aliases
+    from .phase3_targets import mine_targets
+    from .phase3_fulltext import with_sections
+    from .phase3_classifier import ClassifierExtractor
+    from .phase3_state import AggregateState
+    from .phase3_journal import (
+        RunJournal, EXTRACTED, atomic_path, resume_run, run_signature, write_journaled
+    )
+    from .phase3_shard import (
+        parse_shard, parse_shard_count, shard_drugs, shard_path, merge_papers, merge_evidence, write_marker, check_markers
+    )
+    from .phase3_schedule import RunBudget, Snapshots, admit, priority_order
 except ImportError:
     # Running as a direct script
-    from config import BBB_CSV_PATH, OUT_DIR
-    from phase3_search import batch_fetch
-    from phase3_extract import extract_evidence
-    from phase3_score import aggregate_drug_scores
+    from config import (
+        BBB_CSV_PATH, OUT_DIR, PLAN_TOTAL_BUDGET, CANONICALIZE_DRUGS,
+        EXTRACT_WORKERS, EXTRACT_MEMO, STREAM_CHUNK_ROWS, AGG_INCREMENTAL,
+        PRIORITY_COLUMN, RUN_MAX_DRUGS, SNAPSHOT_EVERY_SECONDS
+    )
+    from phase3_search import STORE, batch_fetch, iter_fetch, load_fetch_stats, refresh_all, failed_drugs
+    from phase3_extract import extract_all
+    from phase3_score import aggregate_drug_scores, aggregate_csv
+    from phase3_plan import POLICIES, make_plan, summarize_plan
+    from phase3_canon import load_groups, fan_out, group_aliases
+    from phase3_synonyms import set_aliases
+    from phase3_targets import mine_targets
+    from phase3_fulltext import with_sections
+    from phase3_classifier import ClassifierExtractor
+    from phase3_state import AggregateState
+    from phase3_journal import (
+        RunJournal, EXTRACTED, atomic_path, resume_run, run_signature, write_journaled
+    )
+    from phase3_shard import (
+        parse_shard, parse_shard_count, shard_drugs, shard_path, merge_papers, merge_evidence, write_marker, check_markers
+    )
+    from phase3_schedule import RunBudget, Snapshots, admit, priority_order
 
 # Ensure output directory exists
 os.makedirs(OUT_DIR, exist_ok=True)
 
-def main():
-    print(" Phase 3 literature mining started")
-
-    # -------------------------------
-    # 1. Load Phase 2 / BBB drug list
-    # -------------------------------
-    bbb = pd.read_csv(BBB_CSV_PATH)
+def load_drug_table(path: str = BBB_CSV_PATH) -> pd.DataFrame:
+    """
+    Phase 2 / BBB list with a stripped "drug" name column,
+    one row per unique name (first occurrence wins).
+    """
+    bbb = pd.read_csv(path)
 
     # Robust drug-name column detection
     if "drug_name_out" in bbb.columns:
@@ -38,68 +75,129 @@ def main():
     else:
         name_col = bbb.columns[0]
 
-    drugs = (
-        bbb[name_col]
-        .astype(str)
-        .str.strip()
-        .replace("", pd.NA)
-        .dropna()
-        .unique()
-        .tolist()
-    )
+    bbb = bbb.assign(drug=bbb[name_col].astype(str).str.strip().replace("", pd.NA))
+    return bbb.dropna(subset=["drug"]).drop_duplicates("drug")
 
-    drugs = sorted(drugs)
+def load_drug_list(path: str = BBB_CSV_PATH):
+    """
+    Unique, stripped drug names from the Phase 2 / BBB list, sorted.
+    """
+    return sorted(load_drug_table(path)["drug"].tolist())
 
-    #  DEBUG / SAFE MODE
-    # Increase to 300500 once stable
-    drugs = drugs[:500]
+def load_priorities(column: str = PRIORITY_COLUMN, path: str = BBB_CSV_PATH) -> dict:
+    """
+    {drug: priority} from a Phase 2 column (empty if the column is missing).
+    """
+    table = load_drug_table(path)
+    if column not in table.columns:
+        return {}
+    return dict(zip(table["drug"], pd.to_numeric(table[column], errors="coerce")))
 
-    print(f" Running Phase 3 on {len(drugs)} drugs")
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Phase 3 literature mining")
+    parser.add_argument("--mode", choices=("drug", "target"), default="drug",
+                        help="search per drug, or per AD-relevant target and propagate to drugs")
+    parser.add_argument("--refresh", action="store_true",
+                        help="incrementally fetch papers published since each drug's last fetch")
+    parser.add_argument("--plan", choices=POLICIES,
+                        help="probe hit counts and split a global paper budget across drugs")
+    parser.add_argument("--budget", type=int, default=PLAN_TOTAL_BUDGET,
+                        help="total papers for --plan, per shard with --shard (default: PLAN_TOTAL_BUDGET)")
+    parser.add_argument("--plan-only", action="store_true",
+                        help="write phase3_fetch_plan.csv and stop (cost estimate)")
+    parser.add_argument("--fulltext", action="store_true",
+                        help="also read Methods/Results of open-access papers (fullTextXML)")
+    parser.add_argument("--workers", type=int, default=EXTRACT_WORKERS,
+                        help="processes for evidence extraction (default: EXTRACT_WORKERS; 1 = serial)")
+    parser.add_argument("--extractor", choices=("keyword", "classifier"), default="keyword",
+                        help="keyword gates, or the trained relevance/direction classifier")
+    parser.add_argument("--stream", action="store_true",
+                        help="search, extract and write drug by drug; aggregate from the CSV in chunks")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue the last interrupted --stream run from its journal (implies --stream)")
+    parser.add_argument("--shard", type=parse_shard, metavar="i/N",
+                        help="run only shard i of N (0-based, by name hash); outputs get a .shard-i-of-N suffix")
+    parser.add_argument("--merge", type=parse_shard_count, metavar="N",
+                        help="combine the outputs of shards 0..N-1 into the unsharded files and stop")
+    parser.add_argument("--priority", default=PRIORITY_COLUMN, metavar="COLUMN",
+                        help="Phase 2 column drugs are mined in (descending) order of (default: PRIORITY_COLUMN)")
+    parser.add_argument("--max-drugs", type=int, default=RUN_MAX_DRUGS,
+                        help="top drugs by priority to run on, 0 = all (default: RUN_MAX_DRUGS)")
+    parser.add_argument("--time-budget", type=float, metavar="MINUTES",
+                        help="stop admitting drugs after this many minutes (implies --stream)")
+    parser.add_argument("--call-budget", type=int, metavar="N",
+                        help="stop admitting drugs after N Europe PMC requests (implies --stream)")
+    return parser.parse_args(argv)
 
-    # -------------------------------
-    # 2. Literature search (API)
-    # -------------------------------
-    papers_by_drug = batch_fetch(drugs)
+def run_target_mode():
+    """
+    Search per AD-relevant target and propagate target evidence to every
+    drug through the ChEMBL drug-target map (few hundred queries at most).
+    """
+    df_papers, target_scores, df_drugs = mine_targets(load_drug_table())
 
-    # -------------------------------
-    # 3. Evidence extraction
-    # -------------------------------
-    rows = []
-    for drug, papers in tqdm(papers_by_drug.items(), desc="Extracting evidence"):
-        for paper in papers:
-            ev = extract_evidence(drug, paper)
-            if ev is not None:
-                rows.append(ev)
-
-    if not rows:
-        print(" No AD-relevant evidence extracted. Check gates.")
-        return
+    df_papers.to_csv(os.path.join(OUT_DIR, "phase3_target_papers.csv"), index=False, encoding="utf-8")
+    target_scores.to_csv(os.path.join(OUT_DIR, "phase3_target_scores.csv"), index=False, encoding="utf-8")
+    df_drugs.to_csv(os.path.join(OUT_DIR, "phase3_target_lit_evidence.csv"), index=False, encoding="utf-8")
 
-    df_papers = pd.DataFrame(rows)
-    df_papers.to_csv(
-        os.path.join(OUT_DIR, "phase3_papers.csv"),
-        index=False,
-        encoding="utf-8"
-    )
+    covered = int((df_drugs["n_papers"] > 0).sum())
+    print(f" {len(target_scores)} targets with evidence; {covered}/{len(df_drugs)} drugs covered")
+    print(" Saved phase3_target_papers.csv")
+    print(" Saved phase3_target_scores.csv")
+    print(" Saved phase3_target_lit_evidence.csv")
 
-    print(f" Saved {len(df_papers)} extracted papers")
+    print("\n Top 10 drugs by propagated target evidence:")
+    print(df_drugs.head(10)[["drug", "signed_score", "n_targets", "targets"]])
 
-    # -------------------------------
-    # 4. Drug-level aggregation
-    # -------------------------------
-    df_drugs = aggregate_drug_scores(df_papers)
+def select_drugs(priority: str = PRIORITY_COLUMN, max_drugs: int = RUN_MAX_DRUGS):
+    """
+    The drugs a run searches, in run order (canonical parents when
+    CANONICALIZE_DRUGS), and the grouping table (None without).
+    Run order is descending `priority` (a Phase 2 column), so a run
+    stopped early has mined the most promising drugs; only the top
+    max_drugs are kept (0 = all).
+    """
+    priorities = load_priorities(priority)
+    if not priorities:
+        print(f" No '{priority}' column in the Phase 2 table; running in name order")
+    drugs = priority_order(load_drug_list(), priorities)
+    if max_drugs:
+        drugs = drugs[:max_drugs]
 
-    df_drugs.to_csv(
-        os.path.join(OUT_DIR, "phase3_lit_evidence.csv"),
-        index=False,
-        encoding="utf-8"
+    print(f" Running Phase 3 on {len(drugs)} drugs")
+
+    # Stereo/salt variants share one literature pull (their parent),
+    # ranked by their best member
+    groups = None
+    if CANONICALIZE_DRUGS:
+        groups = load_groups(load_drug_table())
+        groups = groups[groups["drug"].isin(set(drugs))]
+        parent_of = dict(zip(groups["drug"], groups["parent"]))
+        drugs = list(dict.fromkeys(parent_of[d] for d in drugs if d in parent_of))
+        # Each parent's pull searches every member's name
+        set_aliases(group_aliases(groups))
+        print(f" Searching {len(drugs)} canonical parents")
+    return drugs, groups
+
+def evidence_table(df_drugs: pd.DataFrame, groups) -> pd.DataFrame:
+    """
+    Drug scores as phase3_lit_evidence.csv holds them: with fetch stats,
+    fanned out to every group member.
+    """
+    # How much literature was left unread (pagination cap)
+    fetch_stats = pd.DataFrame(
+        load_fetch_stats(df_drugs["drug"]),
+        columns=["drug", "hit_count", "n_fetched", "n_unread"]
     )
+    df_drugs = df_drugs.merge(fetch_stats, on="drug", how="left")
 
-    # -------------------------------
-    # 5. Human-readable report
-    # -------------------------------
-    report_path = os.path.join(OUT_DIR, "phase3_report.txt")
-    with open(report_path, "w", encoding="utf-8") as f:
+    # Parent evidence applies to every stereo/salt form in its group
+    if groups is not None:
+        df_drugs = fan_out(df_drugs, groups)
+    return df_drugs
+
+def write_report(df_drugs: pd.DataFrame, path: str):
+    with atomic_path(path) as tmp, open(tmp, "w", encoding="utf-8") as f:
         f.write("Top 25 drugs by SIGNED Phase-3 evidence score\n")
         f.write("=" * 60 + "\n\n")
         f.write(df_drugs.head(25).to_string(index=False))
@@ -109,11 +207,256 @@ def main():
         f.write("- evidence_score: raw summed paper scores\n")
         f.write("- net_positive: positive  negative papers\n")
         f.write("- confidence: robustness proxy (papers + model diversity)\n")
+        f.write("- hit_count / n_unread: Europe PMC hits vs. papers left unread\n")
+        f.write("- parent: canonical compound whose literature was searched\n")
+
+def merge_shards(n: int, priority: str = PRIORITY_COLUMN, max_drugs: int = RUN_MAX_DRUGS):
+    """
+    Combine the papers and lit-evidence outputs of shards 0..N-1 (copied
+    into OUT_DIR from wherever they ran) into the unsharded files.
+    Every shard must have finished on this drug selection (see
+    check_markers); empty shards merge as no rows.
+    """
+    drugs, _ = select_drugs(priority, max_drugs)
+    try:
+        check_markers(OUT_DIR, n, run_signature(drugs=drugs))
+    except ValueError as e:
+        raise SystemExit(f" Cannot merge: {e}")
+    papers_path = os.path.join(OUT_DIR, "phase3_papers.csv")
+    evidence_path = os.path.join(OUT_DIR, "phase3_lit_evidence.csv")
 
+    with atomic_path(papers_path) as tmp:
+        n_rows = merge_papers(papers_path, n, drugs, tmp)
+    df_drugs = merge_evidence(evidence_path, n)
+    with atomic_path(evidence_path) as tmp:
+        df_drugs.to_csv(tmp, index=False, encoding="utf-8")
+    write_report(pd.read_csv(evidence_path), os.path.join(OUT_DIR, "phase3_report.txt"))
+
+    print(f" Merged {n} shards: {n_rows} papers, {len(df_drugs)} drugs")
     print(" Saved phase3_papers.csv")
     print(" Saved phase3_lit_evidence.csv")
     print(" Saved phase3_report.txt")
 
+def main(argv=None):
+    args = parse_args(argv)
+    budget = RunBudget(args.time_budget, args.call_budget)
+    args.stream = args.stream or args.resume or budget.limited
+    print(" Phase 3 literature mining started")
+
+    if args.merge is not None:
+        merge_shards(args.merge, args.priority, args.max_drugs)
+        return
+
+    if args.mode == "target":
+        run_target_mode()
+        print("\n Phase 3 complete")
+        return
+
+    # -------------------------------
+    # 1. Load Phase 2 / BBB drug list
+    # -------------------------------
+    drugs, groups = select_drugs(args.priority, args.max_drugs)
+    if args.shard:
+        # What --merge checks each shard against
+        selection = run_signature(drugs=drugs)
+        options = run_signature(fulltext=args.fulltext, extractor=args.extractor,
+                                plan=args.plan, budget=args.budget)
+        drugs = shard_drugs(drugs, *args.shard)
+        print(f" Shard {args.shard[0]}/{args.shard[1]}: {len(drugs)} drugs")
+
+    def output(name: str) -> str:
+        return shard_path(os.path.join(OUT_DIR, name), args.shard)
+
+    # -------------------------------
+    # 2. Literature search (API)
+    # -------------------------------
+    if args.refresh:
+        refresh = pd.DataFrame(refresh_all(drugs), columns=["drug", "n_new", "n_total"])
+        refresh = refresh.sort_values("n_new", ascending=False, kind="stable")
+        refresh.to_csv(
+            output("phase3_refresh_report.csv"),
+            index=False,
+            encoding="utf-8"
+        )
+        gained = refresh[refresh["n_new"] > 0]
+        print(f" Refresh: {len(gained)} drugs gained {int(gained['n_new'].sum())} new papers")
+        if not gained.empty:
+            print(gained.head(20).to_string(index=False))
+
+    budgets = None
+    if args.plan or args.plan_only:
+        priorities = load_priorities(args.priority)
+        if groups is not None:
+            # A parent is as important as its best member
+            member = pd.Series(groups["drug"].map(priorities).values, index=groups["parent"])
+            priorities = member.groupby(level=0).max().to_dict()
+        plan = make_plan(drugs, args.plan or "proportional", args.budget, priorities)
+        plan.to_csv(output("phase3_fetch_plan.csv"), index=False, encoding="utf-8")
+        print(" Fetch plan:", summarize_plan(plan))
+        print(f" Saved {os.path.basename(output('phase3_fetch_plan.csv'))}")
+        if args.plan_only:
+            return
+        budgets = dict(zip(plan["drug"], plan["budget"]))
+
+    papers_path = output("phase3_papers.csv")
+    memo = STORE if EXTRACT_MEMO else None
+    extract_stats = {}
+    extractor = ClassifierExtractor() if args.extractor == "classifier" else None
+    state = AggregateState() if AGG_INCREMENTAL else None
+    state_stats = {}
+    stopped = False
+
+    def tracked(rows):
+        # Keep the per-drug tallies in step with the rows written
+        return state.track(rows, drugs, STREAM_CHUNK_ROWS, state_stats) if state else rows
+
+    if args.stream:
+        # -------------------------------
+        # 3. Search -> extract -> append, a window of drugs at a time,
+        #    journaled so an interrupted run can --resume
+        # -------------------------------
+        journal = RunJournal()
+        partial_path = papers_path + ".partial"
+        signature = run_signature(
+            drugs=drugs, budgets=budgets, fulltext=args.fulltext, extractor=args.extractor,
+            incremental=AGG_INCREMENTAL
+        )
+        run_id = resume_run(journal, signature, partial_path) if args.resume else None
+        if run_id is None:
+            if args.resume:
+                print(" No interrupted run with these options to resume; starting a new one")
+            run_id = journal.start(signature)
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        stages = journal.stages(run_id)
+        todo = [d for d in drugs if stages.get(d, 0) < EXTRACTED]
+        done_before = [d for d in drugs if stages.get(d, 0) >= EXTRACTED]
+        if len(todo) < len(drugs):
+            print(f" Resuming run {run_id}: {len(drugs) - len(todo)} drugs already done, {len(todo)} to go")
+
+        def publish(completed):
+            # Interim phase3_lit_evidence.csv over the drugs done so far
+            if state:
+                df = state.scores(done_before + completed)
+            elif os.path.exists(partial_path) and os.path.getsize(partial_path):
+                df = aggregate_csv(partial_path, STREAM_CHUNK_ROWS)
+            else:
+                return
+            with atomic_path(output("phase3_lit_evidence.csv")) as tmp:
+                evidence_table(df, groups).to_csv(tmp, index=False, encoding="utf-8")
+            tqdm.write(f" Snapshot: phase3_lit_evidence.csv over {len(done_before) + len(completed)} drugs")
+
+        # Drugs enter the fetch window in priority order while the budget
+        # lasts (batched prefetch would query every drug up front)
+        admitted = []
+        snapshots = Snapshots(publish, SNAPSHOT_EVERY_SECONDS)
+        fetched = tqdm(
+            iter_fetch(admit(todo, budget, admitted), budgets=budgets,
+                       batched=False if budget.limited else None),
+            total=len(todo), desc="Searching + extracting"
+        )
+        fetched = journal.fetched(run_id, fetched)
+        pairs = ((drug, paper) for drug, papers in fetched for paper in papers)
+        if args.fulltext:
+            triples = with_sections(pairs)
+        else:
+            triples = ((drug, paper, None) for drug, paper in pairs)
+        rows = extract_all(triples, workers=args.workers, store=memo, stats=extract_stats,
+                           extractor=extractor)
+        n_rows = write_journaled(rows, partial_path, admitted, journal, run_id, state,
+                                 STREAM_CHUNK_ROWS, state_stats, on_commit=snapshots)
+        stopped = len(admitted) < len(todo)
+        if stopped:
+            # Keep the partial CSV and journal for --resume; publish what is done
+            print(f" Budget spent ({budget.describe()}): {len(done_before) + len(admitted)}/{len(drugs)} "
+                  f"drugs mined; --resume continues with the rest")
+            drugs = done_before + admitted
+            if n_rows:
+                with atomic_path(papers_path) as tmp:
+                    shutil.copyfile(partial_path, tmp)
+        elif n_rows:
+            os.replace(partial_path, papers_path)
+        elif os.path.exists(partial_path):
+            os.remove(partial_path)
+        if snapshots.count:
+            print(f" Published {snapshots.count} interim lit-evidence snapshots")
+    else:
+        papers_by_drug = batch_fetch(drugs, budgets=budgets)
+
+    failed = failed_drugs(drugs)
+    if failed:
+        print(f" {len(failed)} drugs could not be fetched; they will be retried on the next run")
+
+    if not args.stream:
+        # -------------------------------
+        # 3. Evidence extraction
+        # -------------------------------
+        pairs = [(drug, paper) for drug, papers in papers_by_drug.items() for paper in papers]
+        if args.fulltext:
+            triples = with_sections(pairs)
+        else:
+            triples = ((drug, paper, None) for drug, paper in pairs)
+        triples = tqdm(triples, total=len(pairs), desc="Extracting evidence")
+        rows = list(tracked(extract_all(triples, workers=args.workers, store=memo,
+                                        stats=extract_stats, extractor=extractor)))
+        n_rows = len(rows)
+        if rows:
+            df_papers = pd.DataFrame(rows)
+            with atomic_path(papers_path) as tmp:
+                df_papers.to_csv(tmp, index=False, encoding="utf-8")
+
+    if EXTRACT_MEMO:
+        print(f" Extraction: {extract_stats['reused']} reused, {extract_stats['extracted']} extracted")
+    if state:
+        print(f" Aggregation state: {state_stats['changed']} drugs changed")
+
+    if not n_rows and not args.shard:
+        print(" No AD-relevant evidence extracted. Check gates.")
+        if args.stream and not stopped:
+            journal.finish(run_id, drugs)
+        return
+
+    if n_rows:
+        print(f" Saved {n_rows} extracted papers")
+    else:
+        # A shard still writes (empty) outputs, so --merge sees it finished
+        print(" No AD-relevant evidence extracted in this shard")
+        with atomic_path(papers_path) as tmp:
+            open(tmp, "w", encoding="utf-8").close()
+
+    # -------------------------------
+    # 4. Drug-level aggregation
+    # -------------------------------
+    if not n_rows:
+        df_drugs = aggregate_drug_scores(None)
+    elif state:
+        df_drugs = state.scores(drugs)
+    elif args.stream:
+        df_drugs = aggregate_csv(papers_path, STREAM_CHUNK_ROWS)
+    else:
+        df_drugs = aggregate_drug_scores(df_papers)
+
+    df_drugs = evidence_table(df_drugs, groups)
+
+    evidence_path = output("phase3_lit_evidence.csv")
+    with atomic_path(evidence_path) as tmp:
+        df_drugs.to_csv(tmp, index=False, encoding="utf-8")
+
+    # -------------------------------
+    # 5. Human-readable report
+    # -------------------------------
+    report_path = output("phase3_report.txt")
+    write_report(df_drugs, report_path)
+
+    if args.stream and not stopped:
+        journal.finish(run_id, drugs)
+    if args.shard:
+        write_marker(OUT_DIR, args.shard, selection, options, (papers_path, evidence_path),
+                     complete=not stopped)
+
+    for path in (papers_path, evidence_path, report_path):
+        print(f" Saved {os.path.basename(path)}")
+
     print("\n Top 10 Phase-3 candidates:")
     print(
         df_drugs.head(10)[
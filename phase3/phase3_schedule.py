@@ -0,0 +1,79 @@
+# phase3/phase3_schedule.py
+import time
+import math
+
+try:
+    from .phase3_http import CALLS
+except ImportError:
+    from phase3_http import CALLS
+
+def priority_order(drugs, priorities: dict) -> list:
+    """
+    Drugs by descending priority; drugs without one (missing or NaN)
+    last; ties by name.
+    """
+    def key(drug):
+        p = priorities.get(drug)
+        missing = p is None or (isinstance(p, float) and math.isnan(p))
+        return (missing, 0.0 if missing else -float(p), drug)
+    return sorted(drugs, key=key)
+
+class RunBudget:
+    """
+    Wall-clock minutes and/or Europe PMC calls one run may spend
+    (None = unlimited), counted from construction.
+    """
+    def __init__(self, minutes: float = None, calls: int = None):
+        self.seconds = None if minutes is None else minutes * 60.0
+        self.calls = calls
+        self._start = time.monotonic()
+        self._calls = CALLS.value
+
+    def used(self):
+        return time.monotonic() - self._start, CALLS.value - self._calls
+
+    def exhausted(self) -> bool:
+        seconds, calls = self.used()
+        return (
+            (self.seconds is not None and seconds >= self.seconds)
+            or (self.calls is not None and calls >= self.calls)
+        )
+
+    @property
+    def limited(self) -> bool:
+        return self.seconds is not None or self.calls is not None
+
+    def describe(self) -> str:
+        seconds, calls = self.used()
+        return f"{seconds / 60.0:.1f} min, {calls} API calls"
+
+def admit(drugs, budget: RunBudget, admitted: list):
+    """
+    Yield drugs in order, appending each to `admitted`, until the budget
+    is spent. Drugs already started (fetched ahead) still finish, so a
+    budget can be overrun by the fetch window.
+    """
+    for drug in drugs:
+        if budget.exhausted():
+            return
+        admitted.append(drug)
+        yield drug
+
+class Snapshots:
+    """
+    on_commit hook for write_journaled: collects committed drugs and calls
+    publish(drugs committed so far) at most every `every` seconds.
+    """
+    def __init__(self, publish, every: float):
+        self.publish = publish
+        self.every = every
+        self.done = []
+        self.count = 0
+        self._last = time.monotonic()
+
+    def __call__(self, completed):
+        self.done.extend(completed)
+        if self.every and time.monotonic() - self._last >= self.every:
+            self.publish(list(self.done))
+            self.count += 1
+            self._last = time.monotonic()
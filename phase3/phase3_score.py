@@ -1,4 +1,6 @@
 # phase3/phase3_score.py
+import re
+import numpy as np
 import pandas as pd
 
 try:
@@ -16,6 +18,15 @@ TOOL_PENALTY_TERMS = [
     "thiopental", "ketamine", "propofol"
 ]
 
+# Scoring constants (phase3_sensitivity perturbs these)
+DEFAULT_MODEL_WEIGHT = 0.2   # model not in MODEL_WEIGHTS
+SIGNAL_CAP = 6.0             # max net keyword signal per paper
+OUTCOME_BONUS = 0.3          # per distinct outcome tag
+EVIDENCE_CLIP = 50           # max summed evidence per drug
+NET_POSITIVE_FACTOR = 0.15   # signed-score boost per net positive paper
+NEUTRAL_PENALTY = 0.05       # multiplier when net positivity <= 0
+TOOL_PENALTY = 0.2           # multiplier for research tools / anesthetics
+
 def apply_tool_penalty(drug_name: str, score: float) -> float:
     """
     Penalize compounds that are likely research tools or anesthetics
@@ -25,7 +36,7 @@ def apply_tool_penalty(drug_name: str, score: float) -> float:
         return score
     d = (drug_name or "").lower()
     if any(term in d for term in TOOL_PENALTY_TERMS):
-        return score * 0.2
+        return score * TOOL_PENALTY
     return score
 
 
@@ -36,7 +47,7 @@ def paper_score(row):
     - caps signal so long abstracts don't dominate
     - adds outcome diversity bonus
     """
-    base = MODEL_WEIGHTS.get(row.get("model", "unknown"), 0.2)
+    base = MODEL_WEIGHTS.get(row.get("model", "unknown"), DEFAULT_MODEL_WEIGHT)
 
     pos = float(row.get("pos_hits", 0) or 0)
     neg = float(row.get("neg_hits", 0) or 0)
@@ -45,45 +56,122 @@ def paper_score(row):
     if signal <= 0:
         return 0.0
 
-    capped = min(signal, 6.0)
+    capped = min(signal, SIGNAL_CAP)
 
     outcomes = str(row.get("outcomes", "") or "")
     outcome_count = len([x for x in outcomes.split(";") if x.strip()])
-    outcome_bonus = 0.3 * outcome_count
+    outcome_bonus = OUTCOME_BONUS * outcome_count
 
     return base * capped + outcome_bonus
 
 
-def aggregate_drug_scores(df_papers: pd.DataFrame):
+SCORE_COLUMNS = [
+    "drug", "signed_score", "evidence_score", "n_papers",
+    "n_positive", "n_negative", "net_positive",
+    "models", "confidence"
+]
+
+# Paper columns the drug-level aggregation reads
+PAPER_COLUMNS = ["drug", "model", "direction", "pos_hits", "neg_hits", "outcomes"]
+
+def join_models(s) -> str:
+    return ";".join(sorted(set(s)))
+
+# Same match as apply_tool_penalty, for a whole column at once
+TOOL_PENALTY_PATTERN = "|".join(re.escape(t) for t in TOOL_PENALTY_TERMS)
+
+def per_value(codes: np.ndarray, uniques, fn) -> np.ndarray:
+    # fn over each distinct value instead of each row
+    return np.array([fn(u) for u in uniques], dtype=float)[codes]
+
+def outcome_count(outcomes) -> int:
+    return len([x for x in str(outcomes or "").split(";") if x.strip()])
+
+def paper_scores(df: pd.DataFrame, model_codes: np.ndarray, model_names) -> np.ndarray:
     """
-    Drug-level aggregation:
-    - sums paper_score
-    - computes net positivity (n_positive - n_negative)
-    - computes signed_score (direction-aware)
-    - applies research-tool penalties
-    - returns sorted dataframe
+    paper_score for every row, as column operations
+    (model weights looked up once per model category).
     """
+    base = per_value(model_codes, model_names, lambda m: MODEL_WEIGHTS.get(m, DEFAULT_MODEL_WEIGHT))
+    pos = pd.to_numeric(df["pos_hits"], errors="coerce").fillna(0).to_numpy(dtype=float)
+    neg = pd.to_numeric(df["neg_hits"], errors="coerce").fillna(0).to_numpy(dtype=float)
+    bonus = OUTCOME_BONUS * per_value(*pd.factorize(df["outcomes"], use_na_sentinel=False), outcome_count)
 
-    if df_papers is None or df_papers.empty:
-        return pd.DataFrame(columns=[
-            "drug", "signed_score", "evidence_score", "n_papers",
-            "n_positive", "n_negative", "net_positive",
-            "models", "confidence"
-        ])
-
-    df = df_papers.copy()
-    df["paper_score"] = df.apply(paper_score, axis=1)
-
-    agg = df.groupby("drug").agg(
-        evidence_score=("paper_score", "sum"),
-        n_papers=("paper_score", "count"),
-        n_positive=("direction", lambda s: (s == "positive").sum()),
-        n_negative=("direction", lambda s: (s == "negative").sum()),
-        models=("model", lambda s: ";".join(sorted(set(s))))
-    ).reset_index()
+    signal = pos - neg
+    score = base * np.minimum(signal, SIGNAL_CAP) + bonus
+    return np.where(signal <= 0, 0.0, score)
+
+def models_by_drug(drug_codes: np.ndarray, n_drugs: int, models: pd.Series) -> np.ndarray:
+    """
+    join_models of each drug's models, from a bitmask per drug over the
+    (sorted) model categories. drug_codes index 0..n_drugs-1, -1 = no drug.
+    """
+    model_codes, names = pd.factorize(models, sort=True, use_na_sentinel=False)
+    names = list(names)
+    keep = drug_codes >= 0
+    pairs = np.unique(drug_codes[keep].astype(np.int64) * len(names) + model_codes[keep])
+    drug_of, model_of = np.divmod(pairs, len(names))
+
+    if len(names) > 62:
+        members = [[] for _ in range(n_drugs)]
+        for d, m in zip(drug_of, model_of):
+            members[d].append(names[m])
+        return np.array([join_models(m) for m in members], dtype=object)
+
+    # Pairs are unique, so summing bits is an OR
+    mask = np.zeros(n_drugs, dtype=np.int64)
+    np.add.at(mask, drug_of, np.left_shift(1, model_of))
+    codes, masks = pd.factorize(mask)
+    labels = [";".join(n for i, n in enumerate(names) if m >> i & 1) for m in masks]
+    return np.array(labels, dtype=object)[codes]
+
+def partial_scores(df_papers: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per-drug partial state for a batch of papers: summed (unclipped)
+    paper scores, paper/direction counts and the set of models.
+    Partials of disjoint batches merge with combine_partials.
+    """
+    drug_codes, drugs = pd.factorize(df_papers["drug"], sort=True)
+    model_codes, model_names = pd.factorize(df_papers["model"], use_na_sentinel=False)
+    direction = df_papers["direction"]
+
+    df = pd.DataFrame({
+        "drug": drug_codes,
+        "evidence_score": paper_scores(df_papers, model_codes, model_names),
+        "n_positive": (direction == "positive").to_numpy(dtype=np.int64),
+        "n_negative": (direction == "negative").to_numpy(dtype=np.int64),
+    })
+    agg = df[drug_codes >= 0].groupby("drug").agg(
+        evidence_score=("evidence_score", "sum"),
+        n_papers=("evidence_score", "count"),
+        n_positive=("n_positive", "sum"),
+        n_negative=("n_negative", "sum"),
+    )
+    agg.insert(0, "drug", drugs)
+    agg["models"] = models_by_drug(drug_codes, len(drugs), df_papers["model"])
+    return agg.reset_index(drop=True)
+
+def combine_partials(parts) -> pd.DataFrame:
+    parts = pd.concat(parts, ignore_index=True)
+    drug_codes, drugs = pd.factorize(parts["drug"], sort=True)
+    agg = parts[["evidence_score", "n_papers", "n_positive", "n_negative"]].groupby(drug_codes).sum()
+    agg.insert(0, "drug", drugs)
+
+    models = parts["models"].str.split(";")
+    lengths = models.str.len().to_numpy()
+    agg["models"] = models_by_drug(
+        np.repeat(drug_codes, lengths), len(drugs), models.explode().reset_index(drop=True)
+    )
+    return agg.reset_index(drop=True)
+
+def finalize_scores(agg: pd.DataFrame) -> pd.DataFrame:
+    """
+    Drug scores from the merged partial state.
+    """
+    agg = agg.copy()
 
     # Prevent "volume-only" domination
-    agg["evidence_score"] = agg["evidence_score"].clip(upper=50)
+    agg["evidence_score"] = agg["evidence_score"].clip(upper=EVIDENCE_CLIP)
 
     # Net positivity
     agg["net_positive"] = agg["n_positive"] - agg["n_negative"]
@@ -91,20 +179,23 @@ def aggregate_drug_scores(df_papers: pd.DataFrame):
     # ----------------------------
     # Signed score (core ranking)
     # ----------------------------
-    agg["signed_score"] = agg["evidence_score"] * (1 + 0.15 * agg["net_positive"])
+    agg["signed_score"] = agg["evidence_score"] * (1 + NET_POSITIVE_FACTOR * agg["net_positive"])
 
     # Heavy penalty if evidence is neutral or negative
     agg.loc[agg["net_positive"] <= 0, "signed_score"] = (
-        agg.loc[agg["net_positive"] <= 0, "evidence_score"] * 0.05
+        agg.loc[agg["net_positive"] <= 0, "evidence_score"] * NEUTRAL_PENALTY
     )
 
     # ----------------------------
     # Apply research-tool penalty
     # ----------------------------
-    agg["signed_score"] = agg.apply(
-        lambda r: apply_tool_penalty(r["drug"], r["signed_score"]),
-        axis=1
+    # One flag per drug (rows are unique drugs here), as apply_tool_penalty
+    is_tool = (
+        agg["drug"].astype(object).where(agg["drug"].notna(), "").astype(str).str.lower()
+        .str.contains(TOOL_PENALTY_PATTERN, regex=True)
     )
+    penalize = is_tool & ~(agg["signed_score"] <= 0)
+    agg["signed_score"] = agg["signed_score"].where(~penalize, agg["signed_score"] * TOOL_PENALTY)
 
     # ----------------------------
     # Confidence proxy
@@ -118,3 +209,37 @@ def aggregate_drug_scores(df_papers: pd.DataFrame):
     agg = agg.sort_values("signed_score", ascending=False)
 
     return agg
+
+def aggregate_drug_scores(df_papers: pd.DataFrame):
+    """
+    Drug-level aggregation:
+    - sums paper_score
+    - computes net positivity (n_positive - n_negative)
+    - computes signed_score (direction-aware)
+    - applies research-tool penalties
+    - returns sorted dataframe
+    """
+
+    if df_papers is None or df_papers.empty:
+        return pd.DataFrame(columns=SCORE_COLUMNS)
+
+    return finalize_scores(partial_scores(df_papers))
+
+def aggregate_csv(path: str, chunk_rows: int = 50000):
+    """
+    aggregate_drug_scores over a papers CSV read chunk_rows at a time,
+    so memory depends on the number of drugs, not papers.
+    """
+    agg = None
+    chunks = pd.read_csv(
+        path, usecols=PAPER_COLUMNS, dtype=str, keep_default_na=False, chunksize=chunk_rows
+    )
+    for chunk in chunks:
+        for col in ("pos_hits", "neg_hits"):
+            chunk[col] = pd.to_numeric(chunk[col], errors="coerce").fillna(0)
+        part = partial_scores(chunk)
+        agg = part if agg is None else combine_partials([agg, part])
+
+    if agg is None:
+        return pd.DataFrame(columns=SCORE_COLUMNS)
+    return finalize_scores(agg)
@@ -1,68 +1,523 @@
 # phase3/phase3_search.py
-import os
-import json
-import time
-import hashlib
-import requests
+import re
+import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 
 try:
-    from .config import CACHE_DIR, MAX_PAPERS_PER_DRUG
+    from .config import (
+        MAX_PAPERS_PER_DRUG, EPMC_PAGE_SIZE,
+        EPMC_MAX_IN_FLIGHT,
+        EPMC_BATCHED_QUERIES, EPMC_BATCH_GROUP_SIZE,
+        EPMC_BATCH_MAX_CHARS, EPMC_BATCH_MAX_HITS,
+        EPMC_REFRESH_OVERLAP_DAYS, EUROPE_PMC_SEARCH_URL,
+        EPMC_IDLIST_FIRST, EPMC_CORE_BATCH, EPMC_USE_SYNONYMS
+    )
+    from .phase3_cache import CacheStore, paper_key
+    from .phase3_http import get_json, EPMCError
+    from .phase3_synonyms import search_names, pack_queries
 except ImportError:
-    from config import CACHE_DIR, MAX_PAPERS_PER_DRUG
+    from config import (
+        MAX_PAPERS_PER_DRUG, EPMC_PAGE_SIZE,
+        EPMC_MAX_IN_FLIGHT,
+        EPMC_BATCHED_QUERIES, EPMC_BATCH_GROUP_SIZE,
+        EPMC_BATCH_MAX_CHARS, EPMC_BATCH_MAX_HITS,
+        EPMC_REFRESH_OVERLAP_DAYS, EUROPE_PMC_SEARCH_URL,
+        EPMC_IDLIST_FIRST, EPMC_CORE_BATCH, EPMC_USE_SYNONYMS
+    )
+    from phase3_cache import CacheStore, paper_key
+    from phase3_http import get_json, EPMCError
+    from phase3_synonyms import search_names, pack_queries
 
-EPMC_API = "https://www.ebi.ac.uk/europepmc/webservices/rest/search"
+EPMC_API = EUROPE_PMC_SEARCH_URL
 
-def safe_cache_name(drug: str) -> str:
+# Shared cache store (one SQLite file, safe across threads/processes)
+STORE = CacheStore()
+
+def drug_names(drug: str) -> list:
+    """
+    Names searched for a drug (display name first; synonyms if enabled).
+    """
+    return search_names(drug, synonyms=EPMC_USE_SYNONYMS)
+
+def drug_queries(drug: str) -> list:
+    """
+    The drug's length-bounded OR queries, run one after another.
+    """
+    return pack_queries(drug_names(drug))
+
+def query_params(drug: str) -> dict:
     """
-    Generate a filesystem-safe cache filename using hash.
+    Query parameters that determine a drug's results (the cache key).
+    The per-drug cap is not part of it: entries are resumable pulls.
+    Results of all synonym queries are cached under the drug itself.
     """
-    h = hashlib.sha1(drug.encode("utf-8")).hexdigest()[:16]
-    return f"epmc_{h}.json"
+    queries = drug_queries(drug)
+    params = {"query": queries[0], "resultType": "core"}
+    if len(queries) > 1:
+        params["queries"] = queries
+    return params
+
+def today() -> str:
+    return datetime.date.today().isoformat()
 
-def fetch_drug_papers(drug: str):
-    cache_name = safe_cache_name(drug)
-    cache_path = os.path.join(CACHE_DIR, cache_name)
+def search_page(params: dict) -> dict:
+    """
+    One Europe PMC search call (pooled, rate-limited, retried).
+    Raises EPMCError if the API keeps failing.
+    """
+    return get_json(EPMC_API, params)
 
-    if os.path.exists(cache_path):
-        with open(cache_path, "r", encoding="utf-8") as f:
-            return json.load(f)
+# ----------------------------------
+# Global paper store: IDs first, full records only when unseen
+# ----------------------------------
+def search_keys(params: dict):
+    """
+    Run one search page and return (response, paper keys).
+    With EPMC_IDLIST_FIRST the page is a cheap resultType=idlist call;
+    otherwise core records come back and go straight into the paper store.
+    """
+    params = {**params, "resultType": "idlist" if EPMC_IDLIST_FIRST else "core"}
+    data = search_page(params)
+    results = data.get("resultList", {}).get("result", [])
+    if not EPMC_IDLIST_FIRST:
+        STORE.put_papers(results)
+    return data, [k for k in (paper_key(p) for p in results) if k]
 
-    params = {
-        "query": f'"{drug}" AND Alzheimer',
-        "format": "json",
-        "pageSize": MAX_PAPERS_PER_DRUG,
-        "resultType": "core"
+def id_term(key: str) -> str:
+    if key.isdigit():
+        return f"(EXT_ID:{key} AND SRC:MED)"
+    return f'DOI:"{key}"'
+
+def fetch_core_records(keys) -> dict:
+    """
+    Fetch full core records by PMID/DOI, EPMC_CORE_BATCH IDs per query,
+    and add them to the paper store. Returns {key: record}.
+    """
+    found = {}
+    for i in range(0, len(keys), EPMC_CORE_BATCH):
+        chunk = keys[i:i + EPMC_CORE_BATCH]
+        data = search_page({
+            "query": " OR ".join(id_term(k) for k in chunk),
+            "resultType": "core",
+            "format": "json",
+            "pageSize": min(2 * len(chunk), 1000)
+        })
+        wanted = set(chunk)
+        for p in data.get("resultList", {}).get("result", []):
+            key = paper_key(p)
+            if key in wanted and key not in found:
+                found[key] = p
+    STORE.put_papers(found.values())
+    return found
+
+def stored_papers(keys) -> list:
+    """
+    Records for keys already in the paper store, in order (no network).
+    """
+    have = STORE.get_papers(keys)
+    return [have[k] for k in keys if k in have]
+
+def resolve_papers(keys) -> list:
+    """
+    Full records for keys, in order: from the paper store, fetching
+    only the ones not stored yet. Keys Europe PMC no longer returns are dropped.
+    """
+    have = STORE.get_papers(keys)
+    missing = [k for k in dict.fromkeys(keys) if k not in have]
+    if missing:
+        have.update(fetch_core_records(missing))
+    return [have[k] for k in keys if k in have]
+
+def load_state(drug: str, include_expired: bool = False, qparams: dict = None):
+    """
+    A drug's cached pull state -> (state, fetched_at) or None.
+    Entries written before the paper store existed (full records under
+    "papers") are moved into it and rewritten as key lists.
+    """
+    qparams = query_params(drug) if qparams is None else qparams
+    entry = STORE.get_entry(drug, qparams, include_expired=include_expired)
+    if entry is None:
+        return None
+    state, fetched_at = entry
+    if "papers" in state:
+        papers = state.pop("papers")
+        STORE.put_papers(papers)
+        state["keys"] = list(dict.fromkeys(k for k in (paper_key(p) for p in papers) if k))
+        STORE.put(drug, qparams, state, fetched_at=fetched_at)
+    return state, fetched_at
+
+def iter_drug_pages(drug: str, max_papers: int = None, qparams: dict = None):
+    """
+    Yield a drug's papers page by page (cursorMark pagination), up to max_papers.
+    Every page is cached as it arrives, so an interrupted pull resumes
+    from the saved cursor; already-cached papers come out as the first page.
+    qparams overrides the drug's query (e.g. a target query in phase3_targets).
+    """
+    max_papers = MAX_PAPERS_PER_DRUG if max_papers is None else max_papers
+    qparams = query_params(drug) if qparams is None else qparams
+    queries = qparams.get("queries", [qparams["query"]])
+
+    entry = load_state(drug, qparams=qparams)
+    state = entry[0] if entry else {
+        "drug": drug, "keys": [], "hit_count": None, "next_cursor": "*", "done": False,
+        "last_fetch_date": today()
     }
+    seen = set(state["keys"])
+
+    # A recent failure is not a result: skip for now, retry once it expires
+    if STORE.get_failure(drug, qparams) is not None:
+        if state["keys"]:
+            yield stored_papers(state["keys"][:max_papers])
+        return
 
     try:
-        r = requests.get(EPMC_API, params=params, timeout=30)
-        r.raise_for_status()
-        data = r.json()
-        papers = data.get("resultList", {}).get("result", [])
-    except Exception as e:
+        if state["keys"]:
+            yield resolve_papers(state["keys"][:max_papers])
+
+        fetched = False
+        while not state["done"] and len(state["keys"]) < max_papers:
+            qi = state.get("query_index", 0)
+            cursor = state["next_cursor"]
+            data, keys = search_keys({
+                "query": queries[qi],
+                "format": "json",
+                "pageSize": min(EPMC_PAGE_SIZE, max_papers - len(state["keys"])),
+                "cursorMark": cursor
+            })
+            fetched = True
+
+            # De-duplicate by PMID/DOI (also across pages)
+            new_keys = []
+            for key in keys:
+                if key not in seen:
+                    seen.add(key)
+                    new_keys.append(key)
+            page = resolve_papers(new_keys)
+
+            # Synonym queries overlap, so hit_count is their sum (an upper bound)
+            hits = state.setdefault("query_hits", [None] * len(queries))
+            hits[qi] = data.get("hitCount", hits[qi])
+            read = state.get("query_read", len(state["keys"]) if qi == 0 else 0) + len(keys)
+            next_cursor = data.get("nextCursorMark")
+            exhausted = (
+                not keys
+                or not next_cursor
+                or next_cursor == cursor
+                or (hits[qi] is not None and read >= hits[qi])
+            )
+
+            state["keys"].extend(paper_key(p) for p in page)
+            if any(h is not None for h in hits):
+                state["hit_count"] = sum(h for h in hits if h is not None)
+            if exhausted and qi + 1 < len(queries):
+                # Move on to the next synonym query from its first page
+                state.update(query_index=qi + 1, next_cursor="*", query_read=0)
+            else:
+                state.update(next_cursor=next_cursor, query_read=read, done=exhausted)
+            STORE.put(drug, qparams, state)
+
+            if page:
+                yield page
+    except EPMCError as e:
+        # Keep what we have (resumable); never cache the failure as "no papers"
         print(f" API error for {drug}: {e}")
-        papers = []
-
-    # De-duplicate by PMID/DOI
-    seen = set()
-    dedup = []
-    for p in papers:
-        key = p.get("pmid") or p.get("doi")
-        if key and key not in seen:
-            seen.add(key)
-            dedup.append(p)
-
-    os.makedirs(CACHE_DIR, exist_ok=True)
-    with open(cache_path, "w", encoding="utf-8") as f:
-        json.dump(dedup, f, indent=2)
-
-    time.sleep(1.0)  # be polite to API
-    return dedup
-
-def batch_fetch(drugs):
-    all_papers = {}
-    for drug in tqdm(drugs, desc="Searching Europe PMC"):
-        all_papers[drug] = fetch_drug_papers(drug)
-    return all_papers
+        STORE.put_failure(drug, qparams, e)
+        return
+
+    if fetched:
+        STORE.clear_failure(drug, qparams)
+
+def fetch_drug_papers(drug: str, max_papers: int = None, qparams: dict = None):
+    papers = []
+    for page in iter_drug_pages(drug, max_papers, qparams):
+        papers.extend(page)
+    return papers
+
+def load_fetch_stats(drugs):
+    """
+    Per-drug cache summary: hit_count (total Europe PMC hits),
+    n_fetched (papers cached) and n_unread (hits never pulled).
+    """
+    rows = []
+    for drug in drugs:
+        entry = load_state(drug)
+        if entry is None:
+            continue
+        state = entry[0]
+        hit_count = state.get("hit_count")
+        n_fetched = len(state["keys"])
+        rows.append({
+            "drug": drug,
+            "hit_count": hit_count,
+            "n_fetched": n_fetched,
+            "n_unread": None if hit_count is None else max(hit_count - n_fetched, 0)
+        })
+    return rows
+
+def failed_drugs(drugs):
+    """
+    Drugs whose last fetch failed recently (negative cache entries).
+    """
+    return [d for d in drugs if STORE.get_failure(d, query_params(d)) is not None]
+
+# ----------------------------------
+# Incremental refresh
+# ----------------------------------
+def refresh_drug_papers(drug: str, max_papers: int = None) -> list:
+    """
+    Query only papers first published since the drug's last fetch
+    (FIRST_PDATE window, minus EPMC_REFRESH_OVERLAP_DAYS) and merge them
+    into the cached set, de-duplicated by PMID/DOI. Ignores the cache TTL.
+    Returns the newly added papers; uncached drugs get a full fetch.
+    """
+    max_papers = MAX_PAPERS_PER_DRUG if max_papers is None else max_papers
+    qparams = query_params(drug)
+
+    entry = load_state(drug, include_expired=True)
+    if entry is None:
+        return fetch_drug_papers(drug, max_papers)
+    state, fetched_at = entry
+
+    # A recent failure: skip for now, retry once it expires (as iter_drug_pages)
+    if STORE.get_failure(drug, qparams) is not None:
+        return []
+
+    last = state.get("last_fetch_date") or datetime.date.fromtimestamp(fetched_at).isoformat()
+    since = datetime.date.fromisoformat(last) - datetime.timedelta(days=EPMC_REFRESH_OVERLAP_DAYS)
+    started = today()
+
+    seen = set(state["keys"])
+    new_papers = []
+    failed = False
+    for query in qparams.get("queries", [qparams["query"]]):
+        cursor = "*"
+        while not failed and len(new_papers) < max_papers:
+            try:
+                data, keys = search_keys({
+                    "query": f"{query} AND (FIRST_PDATE:[{since.isoformat()} TO 3000-12-31])",
+                    "format": "json",
+                    "pageSize": min(EPMC_PAGE_SIZE, max_papers - len(new_papers)),
+                    "cursorMark": cursor
+                })
+                new_keys = [k for k in dict.fromkeys(keys) if k not in seen]
+                seen.update(new_keys)
+                new_papers.extend(resolve_papers(new_keys))
+            except EPMCError as e:
+                print(f" API error for {drug}: {e}")
+                STORE.put_failure(drug, qparams, e)
+                failed = True
+                break
+
+            next_cursor = data.get("nextCursorMark")
+            if not keys or not next_cursor or next_cursor == cursor:
+                break
+            cursor = next_cursor
+
+    if failed and not new_papers:
+        return []
+
+    # Newest first, so per-drug caps keep fresh evidence
+    state["keys"] = [paper_key(p) for p in new_papers] + state["keys"]
+    if state.get("hit_count") is not None:
+        state["hit_count"] += len(new_papers)
+    if not failed:
+        # On error keep the old window so the next refresh retries it
+        state["last_fetch_date"] = started
+    STORE.put(drug, qparams, state)
+    if not failed:
+        STORE.clear_failure(drug, qparams)
+    return new_papers
+
+def refresh_all(drugs, workers: int = None):
+    """
+    Incrementally refresh every drug -> [{drug, n_new, n_total}], input order.
+    """
+    workers = EPMC_MAX_IN_FLIGHT if workers is None else workers
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        new_by_drug = list(tqdm(pool.map(refresh_drug_papers, drugs), total=len(drugs),
+                                desc="Refreshing Europe PMC"))
+
+    rows = []
+    for drug, new_papers in zip(drugs, new_by_drug):
+        entry = load_state(drug, include_expired=True)
+        n_total = len(entry[0]["keys"]) if entry else 0
+        rows.append({"drug": drug, "n_new": len(new_papers), "n_total": n_total})
+    return rows
+
+# ----------------------------------
+# Batched (multi-drug) queries
+# ----------------------------------
+def norm_text(x: str) -> str:
+    x = (x or "").lower()
+    x = re.sub(r"[^a-z0-9]+", " ", x)
+    return f" {x.strip()} "
+
+def mentions(drug: str, text_norm: str) -> bool:
+    """
+    Does a paper's title/abstract mention the drug? Whole words of the
+    normalized name only, so "ethanol" does not match "methanol".
+    """
+    name = norm_text(drug)
+    return name.strip() != "" and name in text_norm
+
+def mentions_any(names, text_norm: str) -> bool:
+    return any(mentions(n, text_norm) for n in names)
+
+def group_drugs(drugs, group_size: int = EPMC_BATCH_GROUP_SIZE,
+                max_chars: int = EPMC_BATCH_MAX_CHARS):
+    """
+    Pack drug names (with their synonyms) into OR-groups bounded by
+    count and query length.
+    """
+    groups, cur, cur_len = [], [], 0
+    for drug in drugs:
+        term_len = sum(len(n) + 6 for n in drug_names(drug))   # quotes + " OR "
+        if cur and (len(cur) >= group_size or cur_len + term_len > max_chars):
+            groups.append(cur)
+            cur, cur_len = [], 0
+        cur.append(drug)
+        cur_len += term_len
+    if cur:
+        groups.append(cur)
+    return groups
+
+def fetch_group(group) -> list:
+    """
+    One OR query for a group of drugs; each returned paper is assigned to
+    every drug named in its title/abstract and cached under that drug.
+    Returns the drugs left unresolved (too many hits or API error), which
+    fall back to per-drug queries.
+    """
+    names = {d: drug_names(d) for d in group}
+    terms = " OR ".join(f'"{n}"' for d in group for n in names[d])
+    try:
+        data = search_page({
+            "query": f"({terms}) AND Alzheimer",
+            "format": "json",
+            "pageSize": min(EPMC_BATCH_MAX_HITS, 1000),
+            "resultType": "core"
+        })
+    except EPMCError as e:
+        print(f" API error for group of {len(group)}: {e}")
+        return list(group)
+
+    results = data.get("resultList", {}).get("result", [])
+    hit_count = data.get("hitCount")
+    if hit_count is None or hit_count > len(results):
+        return list(group)
+
+    STORE.put_papers(results)
+    texts = []
+    for p in results:
+        text = f"{p.get('title', '') or ''}\n{p.get('abstractText', '') or ''}"
+        texts.append((p, norm_text(text)))
+
+    for drug in group:
+        keys = []
+        for p, text_norm in texts:
+            key = paper_key(p)
+            if key and key not in keys and mentions_any(names[drug], text_norm):
+                keys.append(key)
+        # The group query has no per-drug hit count: leave it (and n_unread) unknown
+        STORE.put(drug, query_params(drug), {
+            "drug": drug, "keys": keys, "hit_count": None,
+            "next_cursor": None, "done": True, "source": "batched",
+            "last_fetch_date": today()
+        })
+    return []
+
+def prefetch_batched(drugs, workers: int = None):
+    """
+    Fill the per-drug cache for uncached drugs using grouped OR queries.
+    Returns the drugs that still need their own query.
+    """
+    workers = EPMC_MAX_IN_FLIGHT if workers is None else workers
+    # Names that can't be matched reliably in text go straight to per-drug queries
+    pending = [
+        d for d in drugs
+        if '"' not in d and norm_text(d).strip() and STORE.get(d, query_params(d)) is None
+    ]
+    groups = group_drugs(pending)
+
+    leftover = []
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        for rest in tqdm(pool.map(fetch_group, groups), total=len(groups),
+                         desc="Batched Europe PMC search"):
+            leftover.extend(rest)
+
+    print(f" Batched search: {len(groups)} queries for {len(pending)} drugs, "
+          f"{len(leftover)} need per-drug queries")
+    return leftover
+
+def batch_fetch(drugs, workers: int = None, batched: bool = None, budgets: dict = None):
+    """
+    Fetch papers for every drug -> {drug: papers}, in input order.
+    With workers > 1, requests run on a thread pool; the shared
+    rate limiter in phase3_http still caps the overall request rate.
+    With batched=True, uncached drugs are first searched in OR-groups.
+    budgets ({drug: max papers}, e.g. from phase3_plan) overrides
+    MAX_PAPERS_PER_DRUG; drugs budgeted 0 are skipped.
+    """
+    workers = EPMC_MAX_IN_FLIGHT if workers is None else workers
+    batched = EPMC_BATCHED_QUERIES if batched is None else batched
+    budgets = budgets or {}
+
+    def fetch(drug):
+        cap = budgets.get(drug, MAX_PAPERS_PER_DRUG)
+        return fetch_drug_papers(drug, cap) if cap > 0 else []
+
+    if batched:
+        # The prefetch needs every drug up front: don't let it use up an iterator
+        drugs = list(drugs)
+        prefetch_batched([d for d in drugs if budgets.get(d, 1) > 0], workers)
+
+    if workers <= 1:
+        all_papers = {}
+        for drug in tqdm(drugs, desc="Searching Europe PMC"):
+            all_papers[drug] = fetch(drug)
+        return all_papers
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fetch, drug): drug for drug in drugs}
+        for fut in tqdm(as_completed(futures), total=len(futures), desc="Searching Europe PMC"):
+            results[futures[fut]] = fut.result()
+
+    return {drug: results[drug] for drug in drugs}
+
+def iter_fetch(drugs, workers: int = None, batched: bool = None, budgets: dict = None,
+               window: int = None):
+    """
+    Streaming batch_fetch: yield (drug, papers) in input order, with at
+    most `window` drugs (default 4 per worker) fetched ahead, so only
+    those drugs' papers are held in memory at once.
+    """
+    workers = EPMC_MAX_IN_FLIGHT if workers is None else workers
+    batched = EPMC_BATCHED_QUERIES if batched is None else batched
+    budgets = budgets or {}
+    window = max(workers, 1) * 4 if window is None else max(window, 1)
+
+    def fetch(drug):
+        cap = budgets.get(drug, MAX_PAPERS_PER_DRUG)
+        return fetch_drug_papers(drug, cap) if cap > 0 else []
+
+    if batched:
+        # The prefetch needs every drug up front: don't let it use up an iterator
+        drugs = list(drugs)
+        prefetch_batched([d for d in drugs if budgets.get(d, 1) > 0], workers)
 
+    drugs = iter(drugs)
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        pending = deque()
+        while True:
+            while len(pending) < window:
+                drug = next(drugs, None)
+                if drug is None:
+                    break
+                pending.append((drug, pool.submit(fetch, drug)))
+            if not pending:
+                return
+            drug, fut = pending.popleft()
+            yield drug, fut.result()
@@ -0,0 +1,246 @@
+# phase3/phase3_sensitivity.py
+# Rank stability of Phase 3 drugs under perturbed scoring constants.
+#
+#   python -m phase3.phase3_sensitivity --samples 5000 --spread 2
+#   python -m phase3.phase3_sensitivity --grid signal_cap=4,6,8 --grid evidence_clip=25,50,100
+import os
+import time
+import itertools
+import argparse
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+try:
+    from .config import OUT_DIR, MODEL_WEIGHTS
+    from .phase3_score import (
+        PAPER_COLUMNS, TOOL_PENALTY_PATTERN, DEFAULT_MODEL_WEIGHT, SIGNAL_CAP, OUTCOME_BONUS,
+        EVIDENCE_CLIP, NET_POSITIVE_FACTOR, NEUTRAL_PENALTY, TOOL_PENALTY,
+        outcome_count, aggregate_drug_scores
+    )
+except ImportError:
+    from config import OUT_DIR, MODEL_WEIGHTS
+    from phase3_score import (
+        PAPER_COLUMNS, TOOL_PENALTY_PATTERN, DEFAULT_MODEL_WEIGHT, SIGNAL_CAP, OUTCOME_BONUS,
+        EVIDENCE_CLIP, NET_POSITIVE_FACTOR, NEUTRAL_PENALTY, TOOL_PENALTY,
+        outcome_count, aggregate_drug_scores
+    )
+
+# Signed scores held in memory at once (drugs x parameter vectors)
+EVAL_BLOCK = 20_000_000
+
+def baseline_params() -> dict:
+    """
+    The scoring constants in use, by parameter name ("w:<model>" for
+    MODEL_WEIGHTS, "w:default" for models not listed there).
+    """
+    params = {f"w:{m}": float(w) for m, w in MODEL_WEIGHTS.items()}
+    params.update({
+        "w:default": DEFAULT_MODEL_WEIGHT,
+        "signal_cap": SIGNAL_CAP,
+        "outcome_bonus": OUTCOME_BONUS,
+        "evidence_clip": float(EVIDENCE_CLIP),
+        "net_positive_factor": NET_POSITIVE_FACTOR,
+        "neutral_penalty": NEUTRAL_PENALTY,
+        "tool_penalty": TOOL_PENALTY,
+    })
+    return params
+
+def sample_params(n: int, spread: float = 2.0, seed: int = 42) -> pd.DataFrame:
+    """
+    n parameter vectors, each constant scaled independently by a
+    log-uniform factor in [1/spread, spread].
+    """
+    base = pd.Series(baseline_params())
+    rng = np.random.default_rng(seed)
+    factors = np.exp(rng.uniform(-np.log(spread), np.log(spread), size=(n, len(base))))
+    return pd.DataFrame(factors * base.to_numpy(), columns=base.index)
+
+def grid_params(grid: dict) -> pd.DataFrame:
+    """
+    Every combination of the listed values ({name: [values]});
+    unlisted constants stay at their baseline.
+    """
+    base = baseline_params()
+    unknown = set(grid) - set(base)
+    if unknown:
+        raise ValueError(f"Unknown parameters: {sorted(unknown)} (known: {sorted(base)})")
+    names = list(grid)
+    rows = [{**base, **dict(zip(names, combo))} for combo in itertools.product(*grid.values())]
+    return pd.DataFrame(rows, columns=list(base))
+
+class PaperFeatures:
+    """
+    Papers reduced to what the scoring constants act on:
+    - counts[d, (model, signal)]: drug d's papers with that study model
+      and net signal (only signal > 0 scores)
+    - outcomes[d]: outcome tags summed over those papers
+    - net[d] (positive - negative papers) and tool[d] (tool-penalty match)
+    A drug's evidence for weights w and cap c is then
+    counts @ (w[model] * min(signal, c)) + bonus * outcomes.
+    """
+    def __init__(self, df_papers: pd.DataFrame):
+        drug_codes, drugs = pd.factorize(df_papers["drug"], sort=True)
+        keep = drug_codes >= 0
+        df = df_papers[keep]
+        drug_codes = drug_codes[keep]
+        self.drugs = np.asarray(drugs, dtype=object)
+        n_drugs = len(self.drugs)
+
+        self.models = list(MODEL_WEIGHTS) + ["default"]
+        model_index = {m: i for i, m in enumerate(MODEL_WEIGHTS)}
+        model_codes = df["model"].map(model_index).fillna(len(MODEL_WEIGHTS)).to_numpy(dtype=np.int64)
+
+        pos = pd.to_numeric(df["pos_hits"], errors="coerce").fillna(0).to_numpy(dtype=float)
+        neg = pd.to_numeric(df["neg_hits"], errors="coerce").fillna(0).to_numpy(dtype=float)
+        signal = pos - neg
+        scoring = signal > 0
+
+        self.signals, signal_codes = np.unique(signal[scoring], return_inverse=True)
+        n_cols = len(self.models) * len(self.signals)
+        self.counts = sparse.csr_matrix(
+            (np.ones(int(scoring.sum())),
+             (drug_codes[scoring], model_codes[scoring] * len(self.signals) + signal_codes)),
+            shape=(n_drugs, n_cols)
+        )
+
+        codes, uniques = pd.factorize(df["outcomes"], use_na_sentinel=False)
+        n_outcomes = np.array([outcome_count(u) for u in uniques], dtype=float)[codes]
+        self.outcomes = np.bincount(drug_codes[scoring], n_outcomes[scoring], minlength=n_drugs)
+
+        direction = df["direction"].to_numpy()
+        self.net = (
+            np.bincount(drug_codes, direction == "positive", minlength=n_drugs)
+            - np.bincount(drug_codes, direction == "negative", minlength=n_drugs)
+        )
+        self.tool = (
+            pd.Series(self.drugs).astype(str).str.lower()
+            .str.contains(TOOL_PENALTY_PATTERN, regex=True).to_numpy()
+        )
+
+    def signed_scores(self, params: pd.DataFrame) -> np.ndarray:
+        """
+        signed_score of every drug (rows) under every parameter vector
+        (columns), as finalize_scores computes it.
+        """
+        p = {k: params[k].to_numpy(dtype=float) for k in params.columns}
+        weights = np.stack([p[f"w:{m}"] for m in self.models])                 # models x P
+        capped = np.minimum(self.signals[:, None], p["signal_cap"][None, :])   # signals x P
+        coef = (weights[:, None, :] * capped[None, :, :]).reshape(-1, len(params))
+
+        evidence = self.counts @ coef + self.outcomes[:, None] * p["outcome_bonus"][None, :]
+        evidence = np.minimum(evidence, p["evidence_clip"][None, :])
+
+        net = self.net[:, None]
+        signed = np.where(
+            net > 0,
+            evidence * (1 + p["net_positive_factor"][None, :] * net),
+            evidence * p["neutral_penalty"][None, :]
+        )
+        penalize = self.tool[:, None] & (signed > 0)
+        return np.where(penalize, signed * p["tool_penalty"][None, :], signed)
+
+def ranks(signed: np.ndarray) -> np.ndarray:
+    """
+    1-based rank of each drug (row) per column, highest score first,
+    ties in drug-name order.
+    """
+    order = np.argsort(-signed, axis=0, kind="stable")
+    out = np.empty_like(order, dtype=np.int32)
+    np.put_along_axis(out, order, np.arange(1, len(signed) + 1, dtype=np.int32)[:, None], axis=0)
+    return out
+
+def sensitivity(features: PaperFeatures, params: pd.DataFrame, top_k: int = 25,
+                interval: float = 90.0):
+    """
+    Rank every drug under each parameter vector, in blocks of columns.
+    Returns (per-drug table, summary dict):
+    - baseline_rank, median_rank, rank_lo/rank_hi (central `interval`%),
+      min_rank/max_rank, p_top_k (share of vectors with the drug in the top k)
+    - summary: mean overlap of each vector's top k with the baseline top k,
+      and the share of vectors whose top-k set is unchanged
+    """
+    n_drugs = len(features.drugs)
+    base = ranks(features.signed_scores(pd.DataFrame([baseline_params()])))[:, 0]
+    base_top = base <= top_k
+
+    block = max(1, EVAL_BLOCK // max(n_drugs, 1))
+    all_ranks = np.empty((n_drugs, len(params)), dtype=np.int32)
+    for start in range(0, len(params), block):
+        chunk = params.iloc[start:start + block]
+        all_ranks[:, start:start + len(chunk)] = ranks(features.signed_scores(chunk))
+
+    in_top = all_ranks <= top_k
+    k = min(top_k, n_drugs)
+    overlap = (in_top & base_top[:, None]).sum(axis=0) / max(k, 1)
+    lo, hi = (100 - interval) / 2, 100 - (100 - interval) / 2
+
+    table = pd.DataFrame({
+        "drug": features.drugs,
+        "baseline_rank": base,
+        "median_rank": np.median(all_ranks, axis=1),
+        "rank_lo": np.percentile(all_ranks, lo, axis=1),
+        "rank_hi": np.percentile(all_ranks, hi, axis=1),
+        "min_rank": all_ranks.min(axis=1),
+        "max_rank": all_ranks.max(axis=1),
+        "p_top_k": in_top.mean(axis=1),
+    }).sort_values("baseline_rank").reset_index(drop=True)
+
+    summary = {
+        "n_drugs": n_drugs,
+        "n_vectors": len(params),
+        "top_k": top_k,
+        "mean_top_k_overlap": float(overlap.mean()),
+        "top_k_unchanged": float((overlap == 1.0).mean()),
+    }
+    return table, summary
+
+def parse_grid(specs) -> dict:
+    grid = {}
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        grid[name.strip()] = [float(v) for v in values.split(",") if v.strip()]
+    return grid
+
+def main():
+    parser = argparse.ArgumentParser(description="Phase 3 scoring-constant sensitivity")
+    parser.add_argument("--papers", default=os.path.join(OUT_DIR, "phase3_papers.csv"))
+    parser.add_argument("--samples", type=int, default=2000,
+                        help="random parameter vectors (ignored with --grid)")
+    parser.add_argument("--spread", type=float, default=2.0,
+                        help="each constant is scaled by a factor in [1/spread, spread]")
+    parser.add_argument("--grid", action="append", default=[],
+                        help="NAME=v1,v2,... (repeatable); evaluates every combination")
+    parser.add_argument("--top-k", type=int, default=25)
+    parser.add_argument("--interval", type=float, default=90.0,
+                        help="central rank interval reported, in percent")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default=os.path.join(OUT_DIR, "phase3_sensitivity.csv"))
+    args = parser.parse_args()
+
+    df_papers = pd.read_csv(args.papers, usecols=PAPER_COLUMNS, dtype=str, keep_default_na=False)
+    t0 = time.perf_counter()
+    features = PaperFeatures(df_papers)
+    if args.grid:
+        params = grid_params(parse_grid(args.grid))
+    else:
+        params = sample_params(args.samples, args.spread, args.seed)
+
+    # The batched baseline must reproduce the pipeline's scores
+    check = aggregate_drug_scores(df_papers).set_index("drug")["signed_score"]
+    base = features.signed_scores(pd.DataFrame([baseline_params()]))[:, 0]
+    drift = np.abs(check.reindex(features.drugs).to_numpy() - base).max()
+
+    table, summary = sensitivity(features, params, args.top_k, args.interval)
+    seconds = time.perf_counter() - t0
+
+    table.to_csv(args.out, index=False, encoding="utf-8")
+    print(f" {summary['n_vectors']} parameter vectors x {summary['n_drugs']} drugs in {seconds:.1f}s "
+          f"(baseline vs aggregate_drug_scores: max diff {drift:.2g})")
+    print(f" Top {args.top_k}: mean overlap with baseline {summary['mean_top_k_overlap']:.1%}, "
+          f"unchanged in {summary['top_k_unchanged']:.1%} of vectors")
+    print(f" Saved {os.path.basename(args.out)}")
+    print(table.head(args.top_k).to_string(index=False))
+
+if __name__ == "__main__":
+    main()
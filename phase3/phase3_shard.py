@@ -0,0 +1,169 @@
+# phase3/phase3_shard.py
+import os
+import csv
+import json
+import heapq
+import hashlib
+import argparse
+import pandas as pd
+
+try:
+    from .phase3_targets import norm_name
+except ImportError:
+    from phase3_targets import norm_name
+
+def parse_shard(spec: str):
+    """
+    "i/N" -> (i, N), with shards numbered 0..N-1.
+    """
+    try:
+        i, n = (int(x) for x in spec.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {spec!r}")
+    if n < 1 or not 0 <= i < n:
+        raise argparse.ArgumentTypeError(f"shard {spec!r}: need N >= 1 and 0 <= i < N")
+    return i, n
+
+def parse_shard_count(spec: str) -> int:
+    """
+    "N" -> N, the number of shards to merge (N >= 1).
+    """
+    try:
+        n = int(spec)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a shard count, got {spec!r}")
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"shard count {spec!r}: need N >= 1")
+    return n
+
+def shard_of(drug: str, n: int) -> int:
+    # Stable across machines and Python runs (unlike hash())
+    h = hashlib.sha1(norm_name(drug).encode("utf-8")).digest()
+    return int.from_bytes(h[:8], "big") % n
+
+def shard_drugs(drugs, i: int, n: int) -> list:
+    return [d for d in drugs if shard_of(d, n) == i]
+
+def shard_path(path: str, shard) -> str:
+    """
+    "phase3_papers.csv" -> "phase3_papers.shard-1-of-4.csv" (unchanged if shard is None).
+    """
+    if shard is None:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard-{shard[0]}-of-{shard[1]}{ext}"
+
+def shard_files(path: str, n: int) -> list:
+    paths = [shard_path(path, (i, n)) for i in range(n)]
+    missing = [p for p in paths if not os.path.exists(p)]
+    if missing:
+        raise FileNotFoundError(f"Missing shard outputs: {', '.join(map(os.path.basename, missing))}")
+    return paths
+
+def marker_path(out_dir: str, shard) -> str:
+    return shard_path(os.path.join(out_dir, "phase3_shard.json"), shard)
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def write_marker(out_dir: str, shard, selection: str, options: str, outputs, complete: bool):
+    """
+    Record that a shard run finished: the drug selection it was cut from,
+    its run options, a digest of each output it wrote, and whether it
+    mined all its drugs (False if it stopped on its budget).
+    """
+    marker = {
+        "shard": list(shard),
+        "selection": selection,
+        "options": options,
+        "outputs": {os.path.basename(p): file_digest(p) for p in outputs},
+        "complete": complete,
+    }
+    with open(marker_path(out_dir, shard), "w", encoding="utf-8") as f:
+        json.dump(marker, f, indent=1)
+
+def check_markers(out_dir: str, n: int, selection: str):
+    """
+    Refuse to merge shards 0..N-1 unless each has a marker for this drug
+    selection, all ran with the same options and mined all their drugs,
+    and its outputs are the files it wrote (not left over or replaced).
+    """
+    options = set()
+    for i in range(n):
+        path = marker_path(out_dir, (i, n))
+        name = f"shard {i}/{n}"
+        if not os.path.exists(path):
+            raise ValueError(f"{name} has no {os.path.basename(path)}: it never finished (or ran before markers)")
+        with open(path, encoding="utf-8") as f:
+            marker = json.load(f)
+        if marker["selection"] != selection:
+            raise ValueError(f"{name} was run on a different drug selection (--priority / --max-drugs / Phase 2 table)")
+        if not marker["complete"]:
+            raise ValueError(f"{name} stopped on its budget; --resume it before merging")
+        for base, digest in marker["outputs"].items():
+            p = os.path.join(out_dir, base)
+            if not os.path.exists(p) or file_digest(p) != digest:
+                raise ValueError(f"{name}: {base} is missing or not the file that run wrote")
+        options.add(marker["options"])
+    if len(options) > 1:
+        raise ValueError("Shards were run with different options (--fulltext / --extractor / --plan ...)")
+
+def merge_papers(path: str, n: int, drugs, out_path: str = None) -> int:
+    """
+    Stream the N shard papers CSVs of `path` into out_path (default: path),
+    rows ordered as an unsharded run writes them (by drug, in `drugs`
+    order). Each shard is already in that order, so this is a k-way
+    merge. Returns the rows written.
+    """
+    position = {d: i for i, d in enumerate(drugs)}
+    files = [open(p, newline="", encoding="utf-8") for p in shard_files(path, n)]
+    try:
+        readers = [csv.reader(f) for f in files]
+        headers = [next(r, None) for r in readers]
+        header = next((h for h in headers if h), None)
+        if any(h and h != header for h in headers):
+            raise ValueError("Shard papers CSVs have different columns")
+        drug_col = header.index("drug") if header else 0
+
+        def keyed(reader):
+            for row in reader:
+                yield position.get(row[drug_col], len(position)), row
+
+        n_rows = 0
+        with open(out_path or path, "w", newline="", encoding="utf-8") as out:
+            writer = csv.writer(out, lineterminator=os.linesep)
+            if header:
+                writer.writerow(header)
+            for _, row in heapq.merge(*(keyed(r) for r in readers), key=lambda x: x[0]):
+                writer.writerow(row)
+                n_rows += 1
+        return n_rows
+    finally:
+        for f in files:
+            f.close()
+
+def merge_evidence(path: str, n: int) -> pd.DataFrame:
+    """
+    The N shard lit-evidence tables as one, in unsharded order: drug
+    (or parent) scores ranked as finalize_scores ranks them, then each
+    parent's member drugs by name (as fan_out orders them).
+    """
+    # As text, so values are written back exactly as the shards wrote them
+    df = pd.concat(
+        [pd.read_csv(p, dtype=str, keep_default_na=False) for p in shard_files(path, n)],
+        ignore_index=True
+    )
+    key = "parent" if "parent" in df.columns else "drug"
+
+    # Same values, same input order (by name), same sort -> same tie order
+    scores = df.drop_duplicates(key).sort_values(key).reset_index(drop=True)
+    scores["signed_score"] = scores["signed_score"].astype(float)
+    ranked = scores.sort_values("signed_score", ascending=False)[key]
+    df["_rank"] = df[key].map(pd.Series(range(len(ranked)), index=ranked.to_numpy()))
+
+    df = df.sort_values(["_rank", "drug"] if key == "parent" else "_rank", kind="stable")
+    return df.drop(columns="_rank").reset_index(drop=True)
@@ -0,0 +1,250 @@
+# phase3/phase3_state.py
+import os
+import json
+import math
+import sqlite3
+import argparse
+import pandas as pd
+
+try:
+    from .config import AGG_STATE_PATH, STREAM_CHUNK_ROWS
+    from .phase3_cache import paper_key, SQL_CHUNK
+    from .phase3_score import paper_scores, finalize_scores, SCORE_COLUMNS
+except ImportError:
+    from config import AGG_STATE_PATH, STREAM_CHUNK_ROWS
+    from phase3_cache import paper_key, SQL_CHUNK
+    from phase3_score import paper_scores, finalize_scores, SCORE_COLUMNS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS papers (
+    drug        TEXT NOT NULL,
+    row_key     TEXT NOT NULL,
+    paper_score REAL NOT NULL,
+    direction   TEXT,
+    model       TEXT,
+    PRIMARY KEY (drug, row_key)
+);
+CREATE TABLE IF NOT EXISTS drugs (
+    drug           TEXT PRIMARY KEY,
+    evidence_score REAL NOT NULL,
+    n_papers       INTEGER NOT NULL,
+    n_positive     INTEGER NOT NULL,
+    n_negative     INTEGER NOT NULL,
+    models         TEXT NOT NULL
+);
+"""
+
+def row_key(row: dict) -> str:
+    return str(paper_key(row) or row.get("title") or "")
+
+def scored(rows) -> list:
+    """
+    (drug, row_key, paper_score, direction, model) per evidence row.
+    """
+    df = pd.DataFrame(rows)
+    scores = paper_scores(df, *pd.factorize(df["model"], use_na_sentinel=False))
+    return [
+        (row["drug"], row_key(row), score, row.get("direction"), row.get("model"))
+        for row, score in zip(rows, scores.tolist())
+    ]
+
+class AggregateState:
+    """
+    Persisted per-drug partial scores (the state partial_scores builds),
+    plus each drug's scored paper rows so that re-runs can tell which
+    rows are new, changed or gone.
+    - counts and per-model paper counts move by the row delta only
+    - evidence_score is re-summed (fsum) from the drug's stored paper
+      scores, so retractions leave no rounding residue
+    - finalize_scores over the state gives aggregate_drug_scores' output
+    """
+    def __init__(self, path: str = AGG_STATE_PATH):
+        self.path = path
+        self._db = None
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(SCHEMA)
+        return self._db
+
+    def stored_rows(self, drug: str) -> dict:
+        return {
+            key: (score, direction, model)
+            for key, score, direction, model in self._conn().execute(
+                "SELECT row_key, paper_score, direction, model FROM papers WHERE drug = ?", (drug,)
+            )
+        }
+
+    def apply(self, drug: str, added, retracted) -> bool:
+        """
+        Move one drug's tallies by added [(row_key, score, direction, model)]
+        and retracted row keys. Returns whether anything changed.
+        """
+        return self._apply(drug, self.stored_rows(drug), added, retracted)
+
+    def _apply(self, drug: str, old: dict, added, retracted) -> bool:
+        if not added and not retracted:
+            return False
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT n_papers, n_positive, n_negative, models FROM drugs WHERE drug = ?", (drug,)
+        ).fetchone()
+        n_papers, n_pos, n_neg, models = 0, 0, 0, {}
+        if row is not None:
+            n_papers, n_pos, n_neg = row[:3]
+            models = json.loads(row[3])
+
+        def tally(direction, model, sign):
+            nonlocal n_papers, n_pos, n_neg
+            n_papers += sign
+            n_pos += sign * (direction == "positive")
+            n_neg += sign * (direction == "negative")
+            models[model] = models.get(model, 0) + sign
+            if not models[model]:
+                del models[model]
+
+        for key in retracted:
+            _, direction, model = old.pop(key)
+            tally(direction, model, -1)
+        for key, score, direction, model in added:
+            old[key] = (score, direction, model)
+            tally(direction, model, 1)
+
+        conn.executemany(
+            "DELETE FROM papers WHERE drug = ? AND row_key = ?", [(drug, k) for k in retracted]
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO papers (drug, row_key, paper_score, direction, model) "
+            "VALUES (?, ?, ?, ?, ?)", [(drug,) + tuple(a) for a in added]
+        )
+        if n_papers:
+            conn.execute(
+                "INSERT OR REPLACE INTO drugs "
+                "(drug, evidence_score, n_papers, n_positive, n_negative, models) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (drug, math.fsum(v[0] for v in old.values()), n_papers, n_pos, n_neg,
+                 json.dumps(models, sort_keys=True))
+            )
+        else:
+            conn.execute("DELETE FROM drugs WHERE drug = ?", (drug,))
+        return True
+
+    def replace(self, drug: str, rows) -> bool:
+        """
+        Make `rows` (scored tuples of one drug) its complete paper set.
+        """
+        old = self.stored_rows(drug)
+        new = {}
+        for _, key, score, direction, model in rows:
+            # The same paper twice under one drug: "<key>#1", "<key>#2", ...
+            unique, n = key, 0
+            while unique in new:
+                n += 1
+                unique = f"{key}#{n}"
+            new[unique] = (score, direction, model)
+        retracted = [k for k, v in old.items() if new.get(k) != v]
+        added = [(k,) + v for k, v in new.items() if old.get(k) != v]
+        return self._apply(drug, old, added, retracted)
+
+    def update(self, rows, drugs) -> int:
+        """
+        Make `rows` (evidence rows) the complete paper set of every drug
+        in `drugs`, in one transaction. Returns how many drugs changed.
+        """
+        by_drug = {drug: [] for drug in drugs}
+        for r in scored(rows) if rows else []:
+            by_drug.setdefault(r[0], []).append(r)
+        conn = self._conn()
+        conn.execute("BEGIN")
+        changed = sum(self.replace(drug, drug_rows) for drug, drug_rows in by_drug.items())
+        conn.execute("COMMIT")
+        return changed
+
+    def track(self, rows, drugs, chunk_rows: int = STREAM_CHUNK_ROWS, stats: dict = None):
+        """
+        Pass evidence rows through unchanged while making them the paper
+        set of every drug in `drugs` (drugs without rows lose theirs).
+        Rows must come grouped by drug, as extract_all yields them.
+        """
+        stats = {} if stats is None else stats
+        stats.setdefault("changed", 0)
+        pending = []
+        done = set()
+
+        def flush(more=()):
+            seen = list(dict.fromkeys(r["drug"] for r in pending))
+            stats["changed"] += self.update(pending, seen + list(more))
+            done.update(seen)
+            pending.clear()
+
+        for row in rows:
+            yield row
+            if not isinstance(row.get("drug"), str):
+                continue
+            # Flush at a drug boundary once a chunk has filled up
+            if len(pending) >= chunk_rows and row["drug"] != pending[-1]["drug"]:
+                flush()
+            pending.append(row)
+        done.update(r["drug"] for r in pending)
+        flush(d for d in dict.fromkeys(drugs) if d not in done)
+
+    def partials(self, drugs=None) -> pd.DataFrame:
+        """
+        The state as partial_scores columns, sorted by drug.
+        """
+        conn = self._conn()
+        query = "SELECT drug, evidence_score, n_papers, n_positive, n_negative, models FROM drugs"
+        if drugs is None:
+            rows = conn.execute(query).fetchall()
+        else:
+            drugs = list(dict.fromkeys(drugs))
+            rows = []
+            for i in range(0, len(drugs), SQL_CHUNK):
+                chunk = drugs[i:i + SQL_CHUNK]
+                rows += conn.execute(
+                    f"{query} WHERE drug IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+        rows.sort(key=lambda r: r[0])
+        df = pd.DataFrame(rows, columns=["drug", "evidence_score", "n_papers",
+                                         "n_positive", "n_negative", "models"])
+        df["models"] = [";".join(sorted(json.loads(m))) for m in df["models"]]
+        return df
+
+    def scores(self, drugs=None) -> pd.DataFrame:
+        """
+        aggregate_drug_scores output for `drugs` (default: every drug).
+        """
+        agg = self.partials(drugs)
+        if agg.empty:
+            return pd.DataFrame(columns=SCORE_COLUMNS)
+        return finalize_scores(agg)
+
+    def reset(self):
+        self._conn().executescript("DELETE FROM papers; DELETE FROM drugs;")
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        return {
+            "drugs": conn.execute("SELECT COUNT(*) FROM drugs").fetchone()[0],
+            "papers": conn.execute("SELECT COUNT(*) FROM papers").fetchone()[0],
+            "path": self.path
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Phase 3 incremental aggregation state")
+    parser.add_argument("--reset", action="store_true",
+                        help="forget all tallies (the next run re-adds every paper)")
+    args = parser.parse_args()
+
+    state = AggregateState()
+    if args.reset:
+        state.reset()
+        print(f" Cleared {state.path}")
+    print(" State:", state.stats())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+# phase3/phase3_synonyms.py
+import os
+import re
+import sqlite3
+import threading
+
+try:
+    from .config import CHEMBL_DB_PATH, EPMC_SYNONYM_MAX, EPMC_QUERY_MAX_CHARS
+except ImportError:
+    from config import CHEMBL_DB_PATH, EPMC_SYNONYM_MAX, EPMC_QUERY_MAX_CHARS
+
+# Most literature-relevant synonym types first; research codes last
+SYN_TYPE_ORDER = ["INN", "USAN", "BAN", "JAN", "USP", "FDA", "TRADE_NAME", "OTHER", "RESEARCH_CODE"]
+
+# Shorter synonyms (two-letter abbreviations etc.) match unrelated text
+MIN_SYNONYM_LEN = 4
+
+# "(+)-", "( + )-", "(+/-)-", "(?)-" (mis-encoded ±), "(r)-", "(3s,11bs)-", "(z) ", "rac-"
+STEREO_PREFIX = re.compile(
+    r"^\s*(?:\(\s*[+\-±?/ ]+\s*\)|\(\s*(?:\d+[a-z]?)?[rsez]\s*(?:,\s*(?:\d+[a-z]?)?[rsez]\s*)*\)|rac)"
+    r"(?:\s*-\s*|\s+)",
+    re.IGNORECASE
+)
+
+def strip_stereo(name: str) -> str:
+    """
+    Drop leading stereo descriptors: "(+)-terbutaline" -> "terbutaline".
+    """
+    prev = None
+    name = name.strip()
+    while prev != name:
+        prev, name = name, STEREO_PREFIX.sub("", name, count=1)
+    return name
+
+def name_key(name: str) -> str:
+    return re.sub(r"\s+", " ", name.strip().lower())
+
+class ChemblNames:
+    """
+    Name -> synonym index built once from ChEMBL molecule_dictionary.pref_name
+    and molecule_synonyms. Empty (display names only) if the DB is missing.
+    """
+    def __init__(self, db_path: str = CHEMBL_DB_PATH):
+        self.db_path = db_path
+        self._by_name = None
+        self._names = None
+        self._pref = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        by_name, names, pref = {}, {}, {}
+        if not os.path.exists(self.db_path):
+            print(f" ChEMBL DB not found at {self.db_path}; searching display names only")
+            return by_name, names, pref
+
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        try:
+            rows = conn.execute(
+                "SELECT molregno, pref_name, 'PREF_NAME' FROM molecule_dictionary "
+                "WHERE pref_name IS NOT NULL "
+                "UNION ALL SELECT molregno, synonyms, syn_type FROM molecule_synonyms "
+                "WHERE synonyms IS NOT NULL"
+            ).fetchall()
+        finally:
+            conn.close()
+
+        rank = {t: i for i, t in enumerate(["PREF_NAME"] + SYN_TYPE_ORDER)}
+        for molregno, syn, syn_type in rows:
+            syn = syn.strip()
+            names.setdefault(molregno, []).append((rank.get(syn_type, len(rank)), syn))
+            by_name.setdefault(name_key(syn), molregno)
+            if syn_type == "PREF_NAME":
+                pref[molregno] = syn
+        for molregno in names:
+            names[molregno] = [s for _, s in sorted(names[molregno], key=lambda x: x[0])]
+        return by_name, names, pref
+
+    def _molregno(self, name: str):
+        with self._lock:
+            if self._by_name is None:
+                self._by_name, self._names, self._pref = self._load()
+        for candidate in (name, strip_stereo(name)):
+            molregno = self._by_name.get(name_key(candidate))
+            if molregno is not None:
+                return molregno
+        return None
+
+    def synonyms(self, name: str) -> list:
+        """
+        All ChEMBL names of the molecule called `name` (by exact name,
+        then without stereo prefix), best-known first. [] if unknown.
+        """
+        molregno = self._molregno(name)
+        return [] if molregno is None else self._names[molregno]
+
+    def preferred(self, name: str):
+        """
+        ChEMBL pref_name of the molecule called `name`, or None.
+        """
+        molregno = self._molregno(name)
+        return None if molregno is None else self._pref.get(molregno)
+
+CHEMBL = ChemblNames()
+
+# Extra names searched for a drug: {drug: [names]}, e.g. the members of a
+# canonical group for its parent (set by phase3_run_all)
+ALIASES = {}
+
+def set_aliases(aliases: dict):
+    ALIASES.clear()
+    ALIASES.update(aliases)
+
+def search_names(drug: str, max_names: int = EPMC_SYNONYM_MAX, synonyms: bool = True) -> list:
+    """
+    Names to search for a drug: the display name, the name without stereo
+    prefix, its ALIASES, then ChEMBL synonyms of the drug and each alias
+    (without `synonyms`: the display name and aliases only). Deduplicated
+    case-insensitively; names that can't be quoted or are too short to be
+    specific are dropped.
+    """
+    aliases = ALIASES.get(drug, [])
+    if not synonyms and not aliases:
+        return [drug]
+    candidates = [drug]
+    if synonyms:
+        candidates.append(strip_stereo(drug))
+    candidates += aliases
+    if synonyms:
+        for name in [drug] + aliases:
+            candidates += CHEMBL.synonyms(name)
+
+    out, seen = [], set()
+    for i, name in enumerate(candidates):
+        key = name_key(name)
+        if not key or key in seen:
+            continue
+        if i > 0 and ('"' in name or len(key) < MIN_SYNONYM_LEN):
+            continue
+        seen.add(key)
+        out.append(name.strip())
+        if len(out) >= max_names:
+            break
+    return out
+
+def pack_queries(names, max_chars: int = EPMC_QUERY_MAX_CHARS, suffix: str = " AND Alzheimer") -> list:
+    """
+    Pack names into as few OR queries as fit in max_chars each.
+    A single name gives today's query: "name" AND Alzheimer.
+    """
+    groups, cur, cur_len = [], [], 0
+    for name in names:
+        term_len = len(name) + 6   # quotes + " OR "
+        if cur and cur_len + term_len > max_chars:
+            groups.append(cur)
+            cur, cur_len = [], 0
+        cur.append(name)
+        cur_len += term_len
+    if cur:
+        groups.append(cur)
+
+    queries = []
+    for group in groups:
+        terms = " OR ".join(f'"{n}"' for n in group)
+        queries.append(f"{terms}{suffix}" if len(group) == 1 else f"({terms}){suffix}")
+    return queries
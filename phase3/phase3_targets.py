@@ -0,0 +1,164 @@
+# phase3/phase3_targets.py
+import re
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+
+try:
+    from .config import MOA_CSV_PATH, TARGET_MAX_PAPERS, EPMC_MAX_IN_FLIGHT, EXTRACT_MEMO
+    from .phase3_search import STORE, fetch_drug_papers
+    from .phase3_extract import extract_all
+    from .phase3_score import aggregate_drug_scores
+except ImportError:
+    from config import MOA_CSV_PATH, TARGET_MAX_PAPERS, EPMC_MAX_IN_FLIGHT, EXTRACT_MEMO
+    from phase3_search import STORE, fetch_drug_papers
+    from phase3_extract import extract_all
+    from phase3_score import aggregate_drug_scores
+
+# Mechanism words too vague to narrow a target query
+GENERIC_ACTIONS = {"", "agent", "other", "unknown"}
+
+# Target-level columns carried over to drugs (weighted by the drug-target map)
+PROPAGATED = ["signed_score", "evidence_score", "confidence"]
+
+def norm_name(x) -> str:
+    # Same normalization as phase2_scoring.norm_name (drug <-> MOA join key)
+    if pd.isna(x):
+        return ""
+    x = str(x).lower()
+    x = re.sub(r"\(.*?\)", "", x)
+    x = re.sub(r"[^a-z0-9\s]", " ", x)
+    x = re.sub(r"\s+", " ", x).strip()
+    return x
+
+def load_target_map(path: str = MOA_CSV_PATH) -> pd.DataFrame:
+    """
+    ChEMBL mechanism table with Phase 2's target identifier:
+    t_upper = gene symbol, else target name (as target_best in phase2_scoring).
+    """
+    moa = pd.read_csv(path)
+    for col in ("target_gene", "target_name", "mechanism"):
+        moa[col] = moa[col].fillna("").astype(str).str.strip() if col in moa.columns else ""
+    moa["drug_norm"] = moa["drug_name"].apply(norm_name)
+    moa["t_upper"] = moa["target_gene"].where(moa["target_gene"] != "", moa["target_name"]).str.upper()
+    return moa[moa["t_upper"] != ""]
+
+def ad_targets(drug_table: pd.DataFrame) -> list:
+    """
+    Targets Phase 2 weighted as AD-relevant (union of ad_hit_targets).
+    """
+    hits = drug_table.get("ad_hit_targets", pd.Series(dtype=str)).fillna("").astype(str)
+    return sorted({t for cell in hits for t in cell.split(";") if t})
+
+def target_params(target: str, moa: pd.DataFrame) -> dict:
+    """
+    Query for one target: its symbol or ChEMBL name, AND Alzheimer, AND
+    the mechanisms drugs act on it by, e.g.
+    ("GSK3B" OR "Glycogen synthase kinase-3 beta") AND Alzheimer AND (inhibitor).
+    """
+    rows = moa[moa["t_upper"] == target]
+    names = [target] + [
+        n for n in dict.fromkeys(rows["target_name"])
+        if n and n.upper() != target and '"' not in n
+    ][:2]
+    actions = sorted({
+        m.split()[-1].lower() for m in rows["mechanism"] if m.split()
+    } - GENERIC_ACTIONS)
+
+    terms = " OR ".join(f'"{n}"' for n in names)
+    query = f"({terms}) AND Alzheimer"
+    if actions:
+        query += f" AND ({' OR '.join(actions)})"
+    return {"query": query, "resultType": "core", "target": target}
+
+def fetch_targets(targets, moa: pd.DataFrame, max_papers: int = TARGET_MAX_PAPERS,
+                  workers: int = None) -> dict:
+    """
+    {target: papers}, cached and resumable like per-drug pulls
+    (entries are filed under "target:<SYMBOL>").
+    """
+    workers = EPMC_MAX_IN_FLIGHT if workers is None else workers
+
+    def fetch(target):
+        return fetch_drug_papers(f"target:{target}", max_papers, target_params(target, moa))
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        papers = list(tqdm(pool.map(fetch, targets), total=len(targets), desc="Searching targets"))
+    return dict(zip(targets, papers))
+
+def drug_target_matrix(drug_table: pd.DataFrame, moa: pd.DataFrame, targets):
+    """
+    Sparse drugs x targets matrix. A drug's row spreads 1 / (its number
+    of MOA targets) over each mined target it hits, the same promiscuity
+    normalization Phase 2 uses.
+    """
+    drug_norm = (
+        drug_table["drug_norm"].fillna("").astype(str) if "drug_norm" in drug_table.columns
+        else drug_table["drug"].apply(norm_name)
+    )
+    n_targets = moa.groupby("drug_norm")["t_upper"].nunique()
+    col_of = {t: j for j, t in enumerate(targets)}
+
+    edges = (
+        pd.DataFrame({"row": np.arange(len(drug_table)), "drug_norm": drug_norm.values})
+        .merge(moa[["drug_norm", "t_upper"]].drop_duplicates(), on="drug_norm")
+    )
+    edges = edges[edges["t_upper"].isin(col_of)]
+    weights = 1.0 / edges["drug_norm"].map(n_targets).clip(lower=1)
+
+    return sparse.csr_matrix(
+        (weights.to_numpy(dtype=float), (edges["row"].to_numpy(), edges["t_upper"].map(col_of).to_numpy())),
+        shape=(len(drug_table), len(targets))
+    )
+
+def score_targets(papers_by_target: dict):
+    """
+    Target-level evidence with the per-drug gates and scoring.
+    Returns (extracted papers, target scores), both keyed by "target".
+    """
+    triples = ((target, paper, None) for target, papers in papers_by_target.items() for paper in papers)
+    df_papers = pd.DataFrame(list(extract_all(triples, store=STORE if EXTRACT_MEMO else None)))
+    scores = aggregate_drug_scores(df_papers).rename(columns={"drug": "target"})
+    return df_papers.rename(columns={"drug": "target"}), scores
+
+def propagate(matrix, drug_table: pd.DataFrame, targets, scores: pd.DataFrame) -> pd.DataFrame:
+    """
+    Drug scores = drug-target matrix @ target scores (targets without
+    evidence count as 0). n_papers counts papers behind every target hit.
+    """
+    by_target = scores.set_index("target").reindex(list(targets))
+    values = by_target[PROPAGATED].fillna(0.0).to_numpy(dtype=float)
+    n_papers = by_target["n_papers"].fillna(0).to_numpy(dtype=float)
+
+    hits = (matrix > 0).astype(float)
+    has_evidence = (n_papers > 0).astype(float)
+
+    out = pd.DataFrame(matrix @ values, columns=PROPAGATED)
+    out.insert(0, "drug", drug_table["drug"].values)
+    out["n_papers"] = (hits @ n_papers).astype(int)
+    out["n_targets"] = (hits @ has_evidence).astype(int)
+
+    targets = np.asarray(targets)
+    names = []
+    for i in range(matrix.shape[0]):
+        cols = matrix.indices[matrix.indptr[i]:matrix.indptr[i + 1]]
+        names.append(";".join(sorted(t for t, n in zip(targets[cols], n_papers[cols]) if n > 0)))
+    out["targets"] = names
+
+    return out.sort_values("signed_score", ascending=False, kind="stable").reset_index(drop=True)
+
+def mine_targets(drug_table: pd.DataFrame, max_papers: int = TARGET_MAX_PAPERS):
+    """
+    Target-centric Phase 3: one pull per AD-relevant target instead of
+    one per drug. Returns (target papers, target scores, drug scores).
+    """
+    moa = load_target_map()
+    targets = ad_targets(drug_table)
+    print(f" Target mode: {len(targets)} AD-relevant targets for {len(drug_table)} drugs")
+
+    papers_by_target = fetch_targets(targets, moa, max_papers)
+    df_papers, scores = score_targets(papers_by_target)
+    matrix = drug_target_matrix(drug_table, moa, targets)
+    return df_papers, scores, propagate(matrix, drug_table, targets, scores)